@@ -0,0 +1,184 @@
+# Runs many machines on the same program at once.
+# Requires numpy.
+
+from typing import NamedTuple
+
+import numpy as np
+
+from predecode import NUM_REGS, READS, predecode
+
+MEM_SIZE = 1 << 16
+
+
+class BatchResult(NamedTuple):
+    """
+    Per-lane outcome of BatchMachine.run().
+        reg: (N, 5) uint16 final registers
+        pc: (N,) final program counters (0 for lanes that halted)
+        cycles: (N,) instructions executed by each lane
+        halted: (N,) whether each lane reached pc == 0
+        errors: error message for each lane that crashed, else None
+    """
+    reg: np.ndarray
+    pc: np.ndarray
+    cycles: np.ndarray
+    halted: np.ndarray
+    errors: list
+
+
+class BatchMachine:
+    """
+    N independent machines running the same program in lockstep.
+        reg: (N, 5) uint16 registers
+        mem: (N, 65536) uint16 memories
+        pc: (N,) program counters
+
+    Each step, lanes are grouped by pc (and by the word there, in case a
+    lane has rewritten its code) and every group executes its
+    instruction with a single vectorized update. Results match running
+    each lane on its own with execute.execute().
+    """
+    def __init__(self, interp, lanes: int):
+        """
+        Create lanes copies of an Interpreter with a loaded program.
+            Set per-lane inputs afterwards, e.g. machine.reg[:, 3] = inputs.
+        """
+        self.lanes = lanes
+        self.reg = np.tile(np.array(interp.reg, dtype=np.uint16), (lanes, 1))
+        self.mem = np.tile(np.array(interp.mem, dtype=np.uint16), (lanes, 1))
+        self.pc = np.full(lanes, interp.PROG_START, dtype=np.int64)
+        self.cycles = np.zeros(lanes, dtype=np.int64)
+        self.crashed = np.zeros(lanes, dtype=bool)
+        self.errors = [None] * lanes
+
+    def fail(self, lanes: np.ndarray, message: str):
+        """
+        Mark lanes as crashed.
+        """
+        self.crashed[lanes] = True
+        for lane in lanes:
+            self.errors[lane] = message
+
+    def step_group(self, lanes: np.ndarray, pc: int, inst: int):
+        """
+        Execute the instruction inst at pc on the given lanes.
+        """
+        name, rs, rd, ro, imm = predecode(inst)
+        reg, mem = self.reg, self.mem
+
+        if rd >= NUM_REGS:
+            self.fail(lanes, f"Index {rd} out of range for 5 registers")
+            return
+        regs = {"s": rs, "d": rd, "o": ro}
+        if any(regs[r] >= NUM_REGS for r in READS.get(name, "")):
+            # jalr writes the link register before reading rs
+            if name == "jalr" and rd != 0:
+                reg[lanes, rd] = (pc + 1) & 0xFFFF
+            self.fail(lanes, "list index out of range")
+            return
+
+        new_pc = np.full(len(lanes), pc + 1, dtype=np.int64)
+        x = reg[lanes, rs].astype(np.int64) if rs < NUM_REGS else None
+        val = None
+        match name:
+            case "addi":
+                val = x + imm
+            case "nandi":
+                val = ~(x & imm)
+            case "swb":
+                val = ((x & 0xFF) << 8) | ((x & 0xFF00) >> 8)
+            case "nand":
+                val = ~(x & reg[lanes, ro].astype(np.int64))
+            case "sl":
+                val = x << 1
+            case "sr":
+                val = x >> 1
+            case "add":
+                val = x + reg[lanes, ro]
+            case "jalr":
+                if rd != 0:
+                    reg[lanes, rd] = (pc + 1) & 0xFFFF
+                new_pc = reg[lanes, rs].astype(np.int64)
+            case "bn":
+                new_pc[x < 0] = pc + imm
+            case "bz":
+                new_pc[x == 0] = pc + imm
+            case "bp":
+                new_pc[x > 0] = pc + imm
+            case "lw":
+                addr = x + imm
+                bad = addr >= MEM_SIZE
+                if bad.any():
+                    self.fail(lanes[bad], "list index out of range")
+                    lanes, addr, new_pc = lanes[~bad], addr[~bad], new_pc[~bad]
+                # Negative addresses wrap around, like list indices
+                val = mem[lanes, addr % MEM_SIZE]
+            case "sw":
+                mem[lanes, (rs + imm) % MEM_SIZE] = reg[lanes, rd]
+
+        if val is not None and rd != 0:
+            reg[lanes, rd] = val & 0xFFFF
+        self.pc[lanes] = new_pc
+        self.cycles[lanes] += 1
+
+    def run(self, max_cycles: int | None = None) -> BatchResult:
+        """
+        Run every lane until it halts (pc == 0), crashes, or has executed
+            max_cycles instructions.
+        """
+        while True:
+            active = (self.pc != 0) & ~self.crashed
+            if max_cycles is not None:
+                active &= self.cycles < max_cycles
+            lanes = np.flatnonzero(active)
+            if len(lanes) == 0:
+                break
+
+            pcs = self.pc[lanes]
+            # Fetching outside memory fails; negative pcs wrap like list indices
+            bad = (pcs >= MEM_SIZE) | (pcs < -MEM_SIZE)
+            if bad.any():
+                self.fail(lanes[bad], "list index out of range")
+                lanes, pcs = lanes[~bad], pcs[~bad]
+                if len(lanes) == 0:
+                    continue
+
+            insts = self.mem[lanes, pcs % MEM_SIZE]
+            if pcs.min() == pcs.max() and insts.min() == insts.max():
+                # Common case: every lane is at the same instruction
+                self.step_group(lanes, int(pcs[0]), int(insts[0]))
+                continue
+
+            # Diverged lanes: one group per (pc, instruction) pair
+            keys = (pcs + MEM_SIZE) * MEM_SIZE + insts
+            for key in np.unique(keys):
+                group = lanes[keys == key]
+                pc, inst = divmod(int(key), MEM_SIZE)
+                self.step_group(group, pc - MEM_SIZE, inst)
+
+        return BatchResult(self.reg.copy(), self.pc.copy(), self.cycles.copy(),
+                           self.pc == 0, list(self.errors))
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from interpreter import Interpreter
+
+    if len(sys.argv) < 3:
+        print(f"Usage: batch.py <script> <lanes>")
+        exit(1)
+
+    with open(sys.argv[1]) as fin:
+        prog = fin.read()
+    interp = Interpreter()
+    interp.load_prog(prog)
+
+    machine = BatchMachine(interp, int(sys.argv[2]))
+    machine.reg[:, 3] = np.arange(machine.lanes)
+    start = time.perf_counter()
+    result = machine.run()
+    elapsed = time.perf_counter() - start
+    print(f"Ran {machine.lanes} lanes, {result.cycles.sum()} instructions "
+          f"in {elapsed:.3f}s ({result.cycles.sum() / elapsed:,.0f} inst/s)")
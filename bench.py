@@ -0,0 +1,397 @@
+# Benchmarks the assembler and execution engines.
+#
+# Runs a fixed set of synthetic programs and small kernels and writes the
+# results as JSON, so runs from different versions can be compared:
+#   python bench.py -o before.json
+#   python bench.py -o after.json --compare before.json
+#
+# Kernels stay within what execute() supports: loops jump back with j
+# (backward branch offsets do not encode), and sw addresses memory by
+# register index, so results are written to fixed words or kept in
+# virtual registers.
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from execute import execute
+from interpreter import Interpreter
+from memory import STORAGES
+
+# Stop repeating a measurement once it has run this long
+MIN_SECONDS = 0.2
+MAX_REPEATS = 50
+
+
+def straight_line(n: int) -> str:
+    """
+    n ALU instructions with no branches.
+    """
+    ops = ["add 2, 3, 4", "nand 3, 2, 4", "addi 4, 2, 7", "swb 2, 3",
+           "sl 3, 4", "sr 4, 2", "nandi 2, 3, -5"]
+    return "\n".join(ops[i % len(ops)] for i in range(n)) + "\nhalt"
+
+
+def tight_loop(iters: int) -> str:
+    """
+    Short loop body on physical registers.
+    """
+    return f"""
+    li 3, {iters}
+loop:
+    bz 3, end
+    add 2, 2, 3
+    nand 4, 2, 3
+    addi 3, 3, -1
+    j loop
+end:
+    halt
+"""
+
+
+def vreg_loop(iters: int) -> str:
+    """
+    Loop where every instruction goes through virtual registers.
+    """
+    return f"""
+    li a0, {iters}
+    li a1, 1
+    li a2, 3
+loop:
+    bz a0, end
+    add a3, a1, a2
+    nand a4, a3, a1
+    addi a1, a4, 5
+    mv a2, a3
+    addi a0, a0, -1
+    j loop
+end:
+    halt
+"""
+
+
+def many_labels(n: int) -> str:
+    """
+    Every instruction labelled and chained with forward jumps.
+    """
+    lines = [f"L{i}:\n    addi 2, 2, 1\n    j L{i + 1}" for i in range(n)]
+    return "\n".join(lines) + f"\nL{n}:\n    halt"
+
+
+def fib(n: int) -> str:
+    """
+    Fibonacci numbers mod 2^16, the last one in a2.
+    """
+    return f"""
+    li a0, {n}
+    li a1, 0
+    li a2, 1
+loop:
+    bz a0, end
+    add a3, a1, a2
+    mv a1, a2
+    mv a2, a3
+    addi a0, a0, -1
+    j loop
+end:
+    halt
+"""
+
+
+def primes(limit: int) -> str:
+    """
+    Count primes in [2, limit) by trial division. There is no compare,
+        so n % d == 0 is checked with a counter that restarts every d
+        steps while counting down n.
+    """
+    return f"""
+    li s0, 0            # primes found
+    li a0, 2            # n
+outer:
+    addi t0, a0, -{limit}
+    bz t0, done
+    li a1, 2            # d
+inner:
+    nand t1, a0, a0
+    addi t1, t1, 1      # t1 = -n
+    add t1, a1, t1
+    bz t1, prime        # d == n: no divisor found
+    mv a2, a0           # countdown from n
+    mv a3, a1           # restarts every d steps
+count:
+    bz a2, counted
+    addi a2, a2, -1
+    addi a3, a3, -1
+    bz a3, reset
+    j count
+reset:
+    mv a3, a1
+    j count
+counted:
+    nand t1, a3, a3
+    addi t1, t1, 1
+    add t1, a1, t1
+    bz t1, composite    # counter back at d: d divides n
+    addi a1, a1, 1
+    j inner
+prime:
+    addi s0, s0, 1
+composite:
+    addi a0, a0, 1
+    j outer
+done:
+    halt
+"""
+
+
+def memsum(n: int) -> str:
+    """
+    Sum n words of data through a pointer. Stands in for memcpy: sw
+        cannot write through a pointer, but lw reads through one.
+    """
+    data = "\n".join(f"    .fill {(i * 37) & 0x7FFF}" for i in range(n))
+    return f"""
+    li 2, data
+    li 3, {n}
+    li a0, 0
+loop:
+    bz 3, end
+    lw 4, 0(2)
+    add a0, a0, 4
+    addi 2, 2, 1
+    addi 3, 3, -1
+    j loop
+end:
+    halt
+data:
+{data}
+"""
+
+
+def multiply(pairs: int) -> str:
+    """
+    Multiply pairs of numbers by shift and add.
+    """
+    return f"""
+    li a3, {pairs}
+    li a1, 1234
+    li a2, 77
+next:
+    bz a3, done
+    mv 2, a1            # multiplicand, shifted left
+    mv 3, a2            # multiplier, shifted right
+    li a0, 0            # product
+    li a4, 16
+bit:
+    bz a4, finished
+    nandi 4, 3, 1
+    nandi 4, 4, -1      # 4 = low bit of multiplier
+    bz 4, skip
+    add a0, a0, 2
+skip:
+    sl 2, 2
+    sr 3, 3
+    addi a4, a4, -1
+    j bit
+finished:
+    addi a1, a1, 3
+    addi a2, a2, 5
+    addi a3, a3, -1
+    j next
+done:
+    halt
+"""
+
+
+def programs(quick: bool) -> dict:
+    scale = 1 if quick else 10
+    return {
+        "straight_line": straight_line(2_000 * scale),
+        "tight_loop": tight_loop(5_000 * scale),
+        "vreg_loop": vreg_loop(1_000 * scale),
+        "many_labels": many_labels(500 * scale),
+        "fib": fib(2_000 * scale),
+        "primes": primes(20 + 5 * scale),
+        "memsum": memsum(500 * scale),
+        "multiply": multiply(50 * scale),
+    }
+
+
+def timed(fn) -> tuple:
+    """
+    Best time of fn() over repeated calls, with its last result.
+    """
+    best, total, repeats = float("inf"), 0.0, 0
+    while total < MIN_SECONDS and repeats < MAX_REPEATS:
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best, total, repeats = min(best, elapsed), total + elapsed, repeats + 1
+    return best, result
+
+
+def reference(interp: Interpreter) -> int:
+    """
+    Run with execute.execute(), the slowest and simplest engine.
+    """
+    pc, cycles, reg, mem = interp.PROG_START, 0, interp.reg, interp.mem
+    while pc != 0:
+        pc = execute(mem[pc], reg, mem, pc)
+        cycles += 1
+    return cycles
+
+
+def bench_assemble(name: str, prog: str) -> dict:
+    seconds, words = timed(lambda: Interpreter().load_prog(prog))
+    return {"bench": "assemble", "program": name, "words": words,
+            "lines": prog.count("\n") + 1, "seconds": seconds,
+            "words_per_s": words / seconds}
+
+
+def bench_run(name: str, prog: str, engine: str) -> dict:
+    """
+    Instructions per second of one engine, including its warm-up on a
+        fresh Interpreter, but not loading the program.
+    """
+    interp = Interpreter()
+    interp.load_prog(prog)
+    obj = interp.object()
+
+    best, total, repeats = float("inf"), 0.0, 0
+    while total < MIN_SECONDS and repeats < MAX_REPEATS:
+        interp = Interpreter()
+        interp.load_object(obj)
+        start = time.perf_counter()
+        if engine == "execute":
+            cycles = reference(interp)
+        else:
+            cycles = interp.run(trace=False, engine=engine).cycles
+        elapsed = time.perf_counter() - start
+        best, total, repeats = min(best, elapsed), total + elapsed, repeats + 1
+
+    return {"bench": "run", "program": name, "engine": engine, "cycles": cycles,
+            "seconds": best, "inst_per_s": cycles / best,
+            # Kernels leave their results in virtual registers
+            "reg": interp.reg, "vregs": list(interp.mem[1:16])}
+
+
+def bench_footprint(storage: str, prog: str) -> dict:
+    """
+    Bytes allocated by an idle Interpreter, and after running prog.
+    """
+    # Imports and lazily built tables are not part of the footprint
+    Interpreter(storage=storage).load_prog(prog)
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    interp = Interpreter(storage=storage)
+    idle = tracemalloc.get_traced_memory()[0] - base
+    interp.load_prog(prog)
+    interp.run(trace=False)
+    loaded = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return {"bench": "footprint", "storage": storage,
+            "idle_bytes": idle, "after_run_bytes": loaded}
+
+
+def bench_startup(prog: str) -> list:
+    """
+    Time to import the interpreter in a fresh process, and to get a
+        program into memory from source and from an object file.
+    """
+    import os
+    cmd = [sys.executable, "-c", "import interpreter; interpreter.Interpreter()"]
+    here = os.path.dirname(os.path.abspath(__file__))
+    seconds, _ = timed(lambda: subprocess.run(cmd, cwd=here, check=True))
+
+    interp = Interpreter()
+    interp.load_prog(prog)
+    data = interp.object()
+    from_source, _ = timed(lambda: Interpreter().load_prog(prog))
+    from_object, _ = timed(lambda: Interpreter().load_object(data))
+    return [{"bench": "startup", "what": "import", "seconds": seconds},
+            {"bench": "startup", "what": "load_prog", "seconds": from_source},
+            {"bench": "startup", "what": "load_object", "seconds": from_object}]
+
+
+def key(result: dict) -> tuple:
+    return tuple(result.get(k) for k in ("bench", "program", "engine", "storage", "what"))
+
+
+def compare(old: dict, new: dict, threshold: float = 0.25):
+    """
+    Print how each measurement changed, flagging changes over threshold.
+    """
+    before = {key(r): r for r in old["results"]}
+    for r in new["results"]:
+        o = before.get(key(r))
+        if o is None:
+            continue
+        name = "/".join(str(k) for k in key(r) if k is not None)
+        # Lower is better for every metric
+        for metric in ("seconds", "idle_bytes", "after_run_bytes"):
+            if metric not in r or not o.get(metric):
+                continue
+            ratio = r[metric] / o[metric]
+            flag = "REGRESSION" if ratio > 1 + threshold else \
+                "improved" if ratio < 1 - threshold else ""
+            print(f"{name:<40} {metric:<16} {ratio:6.2f}x {flag}")
+        if any(r.get(k) != o.get(k) for k in ("reg", "vregs")):
+            print(f"{name:<40} results differ!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the assembler and engines.")
+    parser.add_argument("-o", "--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--quick", action="store_true", help="smaller programs")
+    parser.add_argument("--engines", default="execute,predecode,blocks",
+                        help="comma-separated engines to time")
+    parser.add_argument("--compare", help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative change to flag when comparing")
+    args = parser.parse_args()
+
+    progs = programs(args.quick)
+    results = []
+    for name, prog in progs.items():
+        results.append(bench_assemble(name, prog))
+        print(f"assemble {name}: {results[-1]['words_per_s']:,.0f} words/s", file=sys.stderr)
+    for name, prog in progs.items():
+        for engine in args.engines.split(","):
+            results.append(bench_run(name, prog, engine))
+            print(f"run {name} ({engine}): {results[-1]['inst_per_s']:,.0f} inst/s",
+                  file=sys.stderr)
+
+    for storage in STORAGES:
+        try:
+            results.append(bench_footprint(storage, progs["fib"]))
+        except ImportError:
+            continue
+    results.extend(bench_startup(progs["straight_line"]))
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {
+        "meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit,
+                 "python": platform.python_version(), "quick": args.quick},
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(report, fout, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as fin:
+            compare(json.load(fin), report, args.threshold)
@@ -0,0 +1,318 @@
+# Translates basic blocks into Python functions.
+
+from typing import Callable, NamedTuple
+
+from execute import ExecutionError
+from idle import find_loop
+from predecode import NUM_REGS, READS, DecodeCache, predecode
+
+# Longest block to translate in one go
+MAX_BLOCK_LEN = 256
+
+# Expressions for instructions that write rd
+EXPRS = {
+    "addi": "(r{rs} + {imm}) & 0xFFFF",
+    "nandi": "~(r{rs} & {imm}) & 0xFFFF",
+    "swb": "((r{rs} & 0xFF) << 8) | ((r{rs} & 0xFF00) >> 8)",
+    "nand": "~(r{rs} & r{ro}) & 0xFFFF",
+    "sl": "(r{rs} << 1) & 0xFFFF",
+    "sr": "(r{rs} >> 1) & 0xFFFF",
+    "add": "(r{rs} + r{ro}) & 0xFFFF",
+}
+
+BRANCH_CONDS = {"bn": "< 0", "bz": "== 0", "bp": "> 0"}
+
+# Cached for addresses where no block can start
+MISSING = object()
+
+
+class Block(NamedTuple):
+    """
+    A translated basic block.
+        fn: fn(reg, mem) -> (new_pc, cycles)
+        start, end: addresses covered, end is exclusive
+        source: generated Python source, for debugging
+    """
+    fn: Callable
+    start: int
+    end: int
+    source: str
+
+
+def can_translate(d) -> bool:
+    """
+    Whether an instruction can go in a block.
+        Instructions that would fail with a bad register index are left
+        to the single-step path, so it raises the usual error.
+    """
+    if d.rd >= NUM_REGS:
+        return False
+    regs = {"s": d.rs, "d": d.rd, "o": d.ro}
+    return all(regs[r] < NUM_REGS for r in READS.get(d.name, ""))
+
+
+def is_device_access(d, ports: dict, size: int) -> bool:
+    """
+    Whether an instruction reads or writes a device (see mmio.py).
+    """
+    if d.name == "lw":
+        return d.rs == 0 and d.imm % size in ports
+    return d.name == "sw" and (d.rs + d.imm) % size in ports
+
+
+def translate(mem: list, start: int, ports: dict | None = None) -> Block | None:
+    """
+    Translate the basic block starting at start.
+        A block ends after bz/bn/bp/jalr, or before an instruction that
+        cannot be translated or accesses a device in ports. Returns None
+        if the block would be empty.
+
+    Registers live in locals r0..r4 inside the block and are written
+    back to reg before it returns.
+    """
+    insts = []
+    addr = start
+    while 0 <= addr < len(mem) and len(insts) < MAX_BLOCK_LEN:
+        d = predecode(mem[addr])
+        if not can_translate(d) or (ports and is_device_access(d, ports, len(mem))):
+            break
+        insts.append((addr, d))
+        addr += 1
+        if d.name in ("bn", "bz", "bp", "jalr"):
+            break
+    if not insts:
+        return None
+
+    used = set()
+    written = set()
+    for _, d in insts:
+        regs = {"s": d.rs, "d": d.rd, "o": d.ro}
+        used.update(regs[r] for r in READS.get(d.name, ""))
+        if d.name in EXPRS or d.name in ("jalr", "lw"):
+            if d.rd != 0:
+                used.add(d.rd)
+                written.add(d.rd)
+
+    used = sorted(used)
+    written = sorted(written)
+    if written:
+        writeback = ", ".join(f"reg[{i}]" for i in written) + " = " + \
+            ", ".join(f"r{i}" for i in written)
+    else:
+        writeback = "pass"
+
+    body = []
+    if used:
+        body.append(", ".join(f"r{i}" for i in used) + " = " +
+                    ", ".join(f"reg[{i}]" for i in used))
+
+    def leave(new_pc: str, cycles: int, indent: str = ""):
+        body.append(indent + writeback)
+        body.append(indent + f"return {new_pc}, {cycles}")
+
+    size = len(mem)
+    ends_block = False
+    for k, (addr, d) in enumerate(insts):
+        name, rs, rd, ro, imm = d
+        if name in EXPRS:
+            if rd != 0:
+                body.append(f"r{rd} = " + EXPRS[name].format(rs=rs, ro=ro, imm=imm))
+
+        elif name == "lw":
+            if imm > 0:
+                # Past the end of memory: let the single-step path raise
+                body.append(f"if r{rs} > {size - 1 - imm}:")
+                leave(addr, k, "    ")
+            if rd != 0:
+                body.append(f"r{rd} = mem[r{rs} + {imm}] & 0xFFFF")
+
+        elif name == "sw":
+            target = (rs + imm) % size
+            body.append(f"mem[{target}] = r{rd}")
+            body.append(f"entries[{target}] = None")
+            # Self-modifying code: stop so that the new word is decoded
+            body.append(f"if {target} in watched:")
+            body.append(f"    written({target})")
+            leave(addr + 1, k + 1, "    ")
+
+        elif name == "jalr":
+            if rd != 0:
+                body.append(f"r{rd} = {(addr + 1) & 0xFFFF}")
+            leave(f"r{rs}", k + 1)
+            ends_block = True
+
+        elif name in BRANCH_CONDS:
+            cond = BRANCH_CONDS[name]
+            leave(f"{addr + imm} if r{rs} {cond} else {addr + 1}", k + 1)
+            ends_block = True
+
+    if not ends_block:
+        leave(insts[-1][0] + 1, len(insts))
+
+    source = f"def block_{start}(reg, mem, entries=entries, watched=watched, written=written):\n" + \
+        "".join(f"    {line}\n" for line in body)
+    return Block(None, start, insts[-1][0] + 1, source)
+
+
+class BlockCache:
+    """
+    Caches translated blocks by start address for one memory image.
+        Shares memory with a DecodeCache, which is used to single-step
+        instructions that cannot be translated. Blocks are dropped when
+        sw writes to an address they cover.
+        With decoded.fast_forward set, counted loops (see idle.py) found
+        at block starts are skipped, within max_cycles.
+    """
+    def __init__(self, decoded: DecodeCache):
+        self.decoded = decoded
+        self.mem = decoded.mem
+        self.blocks = {}
+        self.covering = {}
+        self.loops = {}
+        decoded.listeners.append(self.invalidate)
+
+    def compile(self, start: int) -> Block | None:
+        """
+        Translate and cache the block at start.
+        """
+        block = translate(self.mem, start, self.decoded.ports)
+        if block is None:
+            # Remembered until the word at start changes
+            self.blocks[start] = None
+            self.covering.setdefault(start, set()).add(start)
+            self.decoded.watched.add(start)
+            return None
+        if self.decoded.fast_forward:
+            loop = find_loop(self.mem, start)
+            if loop is not None:
+                self.loops[start] = loop
+
+        env = {
+            "entries": self.decoded.entries,
+            "watched": self.decoded.watched,
+            "written": self.decoded.written,
+        }
+        exec(block.source, env)
+        block = block._replace(fn=env[f"block_{start}"])
+
+        self.blocks[start] = block
+        for addr in range(block.start, block.end):
+            self.covering.setdefault(addr, set()).add(start)
+            self.decoded.watched.add(addr)
+        return block
+
+    def invalidate(self, addr: int | None = None):
+        """
+        Drop blocks covering addr, or all blocks if addr is None.
+        """
+        if addr is None:
+            self.blocks.clear()
+            self.covering.clear()
+            self.loops.clear()
+            self.decoded.watched.clear()
+            return
+
+        for start in self.covering.pop(addr, ()):
+            block = self.blocks.pop(start, None)
+            self.loops.pop(start, None)
+            if block is None:
+                continue
+            for other in range(block.start, block.end):
+                starts = self.covering.get(other)
+                if starts:
+                    starts.discard(start)
+                if not starts:
+                    self.covering.pop(other, None)
+                    self.decoded.watched.discard(other)
+        self.decoded.watched.discard(addr)
+
+    def run(self, reg: list, pc: int, max_cycles: int | None = None):
+        """
+        Execute from pc until the program halts (pc == 0) or max_cycles
+            instructions have run. Returns (pc, cycles).
+        Raises ExecutionError if an instruction fails.
+        """
+        blocks, loops, mem, step = self.blocks, self.loops, self.mem, self.decoded.step
+        # Loops are skipped here rather than by single-stepped handlers
+        self.decoded.budget = 0
+        cycles = 0
+        try:
+            while pc != 0:
+                block = blocks.get(pc, MISSING)
+                if block is MISSING:
+                    block = self.compile(pc)
+                if pc in loops:
+                    cycles += loops[pc].skip(
+                        reg, mem, None if max_cycles is None else max_cycles - cycles)
+                if max_cycles is not None:
+                    left = max_cycles - cycles
+                    if left <= 0:
+                        break
+                    if block is not None and block.end - block.start > left:
+                        block = None
+                if block is not None:
+                    pc, n = block.fn(reg, mem)
+                    cycles += n
+                    if n:
+                        continue
+                # Blocks stop without executing anything at an instruction
+                # that is about to fail, which the single-step path raises
+                pc = step(reg, pc)
+                cycles += 1
+        except Exception as e:
+            raise ExecutionError(pc, e, cycles) from e
+        return pc, cycles
+
+
+if __name__ == "__main__":
+    # Benchmark the engines against each other on the example programs
+    import glob
+    import sys
+    import time
+
+    from execute import execute
+    from interpreter import Interpreter
+
+    paths = sys.argv[1:] or sorted(glob.glob("scripts/*.S"))
+    MIN_CYCLES = 200_000
+
+    def reference(interp: Interpreter):
+        pc, cycles = interp.PROG_START, 0
+        while pc != 0:
+            pc = execute(interp.mem[pc], interp.reg, interp.mem, pc)
+            cycles += 1
+        return cycles
+
+    engines = {
+        "execute": reference,
+        "predecode": lambda interp: interp.run(trace=False).cycles,
+        "blocks": lambda interp: interp.run(trace=False, engine="blocks").cycles,
+    }
+
+    for path in paths:
+        with open(path) as fin:
+            prog = fin.read()
+        print(path)
+
+        results = {}
+        for name, engine in engines.items():
+            interp = Interpreter()
+            try:
+                interp.load_prog(prog)
+                start = time.perf_counter()
+                total = 0
+                while total < MIN_CYCLES:
+                    # Programs only write data below PROG_START
+                    interp.reg = [0] * NUM_REGS
+                    interp.mem[:interp.PROG_START] = [0] * interp.PROG_START
+                    total += engine(interp)
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                print(f"\t{name:>10}: failed ({e})")
+                break
+
+            results[name] = (interp.reg, interp.mem[:64])
+            print(f"\t{name:>10}: {total / elapsed:>12,.0f} inst/s")
+
+        if len(results) == len(engines) and len(set(map(repr, results.values()))) != 1:
+            print("\tengines disagree!")
@@ -0,0 +1,140 @@
+# Command line client for daemon.py.
+#
+# Only uses the standard library, so it starts quickly; the daemon does
+# the assembling and running. Programs are sent as paths, which the
+# daemon reads, so it must run on the same machine.
+#
+# Usage:
+#   python client.py run <script> [--reg in=10] [--max-cycles N] [--dump data:4]
+#   python client.py batch <manifest> [-o results]   (manifest as for runner.py)
+#   python client.py stats
+#   python client.py stop
+
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# Must match daemon.DEFAULT_SOCKET, which is not imported to keep this fast
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f"risc16-{os.getuid()}.sock")
+
+
+class Client:
+    """
+    Connection to a daemon, sending one request at a time.
+    """
+    def __init__(self, path: str = DEFAULT_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile("rb")
+
+    def request(self, request: dict) -> dict:
+        """
+        Send a request and wait for its response.
+        """
+        self.sock.sendall(json.dumps(request, separators=(",", ":")).encode() + b"\n")
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("Daemon closed the connection")
+        return json.loads(line)
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_value(text: str):
+    """
+    An int if text is a number, else text (a label).
+    """
+    try:
+        return int(text, 0)
+    except ValueError:
+        return text
+
+
+def read_jobs(path: str):
+    """
+    Jobs from a JSON lines manifest, with ids filled in and program paths
+        made absolute, since the daemon has its own working directory.
+    """
+    with open(path) as fin:
+        for line_no, line in enumerate(fin):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            job.setdefault("id", line_no)
+            job["program"] = os.path.abspath(job["program"])
+            yield job
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send requests to daemon.py.")
+    parser.add_argument("-s", "--socket", default=DEFAULT_SOCKET, help="daemon socket path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run one program")
+    run.add_argument("program", help="assembly source or object file")
+    run.add_argument("--reg", action="append", default=[], metavar="NAME=VALUE")
+    run.add_argument("--max-cycles", type=int)
+    run.add_argument("--engine")
+    run.add_argument("--dump", action="append", default=[], metavar="START:LENGTH")
+    for option in ("optimize", "allocate", "relax"):
+        run.add_argument(f"--{option}", action="store_true")
+    batch = commands.add_parser("batch", help="run a manifest of jobs")
+    batch.add_argument("manifest", help="JSON lines file, one job per line")
+    batch.add_argument("-o", "--output", help="write results here instead of stdout")
+    commands.add_parser("stats", help="show cache statistics")
+    commands.add_parser("stop", help="shut the daemon down")
+    args = parser.parse_args()
+
+    try:
+        client = Client(args.socket)
+    except OSError as e:
+        print(f"Cannot connect to daemon at {args.socket}: {e}", file=sys.stderr)
+        exit(2)
+
+    with client:
+        if args.command == "run":
+            request = {"op": "run", "program": os.path.abspath(args.program)}
+            if args.reg:
+                request["reg"] = {}
+                for item in args.reg:
+                    name, value = item.split("=", 1)
+                    request["reg"][name] = int(value, 0)
+            if args.max_cycles is not None:
+                request["max_cycles"] = args.max_cycles
+            if args.engine:
+                request["engine"] = args.engine
+            if args.dump:
+                request["dump"] = []
+                for item in args.dump:
+                    start, length = item.rsplit(":", 1)
+                    request["dump"].append([parse_value(start), int(length, 0)])
+            for option in ("optimize", "allocate", "relax"):
+                if getattr(args, option):
+                    request[option] = True
+            result = client.request(request)
+            print(json.dumps(result, separators=(",", ":")))
+            exit(1 if result.get("error") else 0)
+        elif args.command == "batch":
+            out = open(args.output, "w") if args.output else sys.stdout
+            try:
+                for job in read_jobs(args.manifest):
+                    result = client.request({"op": "run", **job})
+                    out.write(json.dumps(result, separators=(",", ":")) + "\n")
+                    out.flush()
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        elif args.command == "stats":
+            print(json.dumps(client.request({"op": "stats"})))
+        else:
+            client.request({"op": "shutdown"})
@@ -0,0 +1,272 @@
+# Keeps assembled programs loaded between runs, behind a Unix socket.
+#
+# Starting Python, importing the interpreter and assembling a program
+# costs far more than running most programs once. The daemon pays that
+# once: programs stay loaded in warm interpreters, with their decoded
+# handlers, in an LRU cache keyed by a hash of the program and the load
+# options. Between runs memory is copied back from the loaded image and
+# only handlers for words that changed are dropped.
+#
+# Clients send JSON requests, one per line, and get one compact JSON
+# response line each, on the same connection:
+#   {"op": "assemble", "source": "...",      assemble and cache a program,
+#    "optimize": false, "allocate": false,   returns {"hash", "words"}
+#    "relax": false}
+#   {"op": "run", "hash": "...", ...}        run a cached program, or one
+#   {"op": "run", "source": "...", ...}      given as text, or as a path
+#   {"op": "run", "program": "x.S", ...}     (source or object file) read
+#                                            by the daemon
+# Sources using .include also need a "base_dir" that the included paths
+# are relative to.
+#   {"op": "stats"}                          cache size, hits and misses
+#   {"op": "shutdown"}
+# Runs take the job fields of runner.py ("id", "reg", "mem", "max_cycles",
+# "engine", "dump") and return its results, with the program's "hash".
+# Each connection is served on its own thread, so a client that keeps its
+# connection open does not hold up others; runs of the same program wait
+# for each other, since they share its interpreter. client.py is the
+# command line side.
+#
+# Usage:
+#   python daemon.py [-s socket] [--cache N] &
+#   python client.py run scripts/fib_2.S --reg in=10
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import objfile
+import preprocess
+import runner
+from interpreter import Interpreter
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f"risc16-{os.getuid()}.sock")
+# Programs kept loaded; each holds two 64K-entry lists
+DEFAULT_CACHE = 32
+# Words compared at a time when restoring memory
+CHUNK = 256
+LOAD_OPTIONS = ("optimize", "allocate", "relax")
+
+
+def program_hash(data: bytes, options: dict) -> str:
+    """
+    Cache key for a program's source or object file and load options.
+    """
+    h = hashlib.sha256(data)
+    for option in LOAD_OPTIONS:
+        h.update(b"1" if options.get(option) else b"0")
+    return h.hexdigest()[:32]
+
+
+def changed(mem: list, image: list) -> list:
+    """
+    Addresses where mem differs from image.
+    """
+    addrs = []
+    for start in range(0, len(image), CHUNK):
+        if mem[start:start + CHUNK] != image[start:start + CHUNK]:
+            addrs += [addr for addr in range(start, start + CHUNK) if mem[addr] != image[addr]]
+    return addrs
+
+
+class Program:
+    """
+    A loaded program and a copy of memory as it was loaded. lock is held
+        while it runs.
+    """
+    def __init__(self, data: bytes, options: dict):
+        if objfile.is_object(data):
+            obj = objfile.from_bytes(data)
+            self.interp = Interpreter(PROG_START=obj.load_addr)
+            self.interp.load_object(obj)
+        else:
+            self.interp = Interpreter()
+            # load_prog reports errors on stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                self.interp.load_prog(data.decode(), **{o: bool(options.get(o))
+                                                        for o in LOAD_OPTIONS})
+        self.image = list(self.interp.mem)
+        self.runs = 0
+        self.lock = threading.Lock()
+
+    def run(self, job: dict, result: dict) -> dict:
+        """
+        Run a job (see runner.py) from the loaded state.
+        """
+        with self.lock:
+            interp = self.interp
+            interp.reg[:] = [0] * len(interp.reg)
+            try:
+                return runner.run_loaded(interp, job, result)
+            finally:
+                self.runs += 1
+                # Handlers for words left as they were stay valid
+                mem = interp.mem
+                for addr in changed(mem, self.image):
+                    mem[addr] = self.image[addr]
+                    interp.decoded.invalidate(addr)
+
+
+class ProgramCache:
+    """
+    Loaded programs by hash, dropping the least recently used. Programs
+        that fail to assemble are kept as their error message.
+    Safe to use from several threads; programs are assembled outside the
+        lock, so one being assembled does not hold up others.
+    """
+    def __init__(self, size: int = DEFAULT_CACHE):
+        self.size = size
+        self.programs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> "Program | str | None":
+        with self.lock:
+            program = self.programs.get(key)
+            if program is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.programs.move_to_end(key)
+            return program
+
+    def load(self, data: bytes, options: dict) -> tuple:
+        """
+        The cached program for data and options, loading it if needed.
+            Returns (hash, Program or error message).
+        """
+        key = program_hash(data, options)
+        program = self.get(key)
+        if program is None:
+            try:
+                program = Program(data, options)
+            except Exception as e:
+                program = str(e)
+            with self.lock:
+                # Another thread may have loaded it meanwhile
+                program = self.programs.setdefault(key, program)
+                self.programs.move_to_end(key)
+                while len(self.programs) > self.size:
+                    self.programs.popitem(last=False)
+        return key, program
+
+    def stats(self) -> dict:
+        with self.lock:
+            programs = list(self.programs.values())
+            stats = {"programs": len(programs), "size": self.size,
+                     "hits": self.hits, "misses": self.misses}
+        stats["runs"] = sum(p.runs for p in programs if isinstance(p, Program))
+        return stats
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.respond(json.loads(line))
+            except Exception as e:
+                response = {"error": f"Bad request: {e}"}
+            self.wfile.write(json.dumps(response, separators=(",", ":")).encode() + b"\n")
+            self.wfile.flush()
+            if self.server.stopping:
+                break
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves requests (see the top of this file) from a ProgramCache, each
+        connection on its own thread.
+    """
+    # Connections left open do not keep the daemon from exiting
+    daemon_threads = True
+
+    def __init__(self, path: str = DEFAULT_SOCKET, cache_size: int = DEFAULT_CACHE):
+        # A socket left by a daemon that did not shut down cleanly
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, Handler)
+        self.path = path
+        self.cache = ProgramCache(cache_size)
+        self.stopping = False
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def respond(self, request: dict) -> dict:
+        op = request.get("op")
+        options = {o: request[o] for o in LOAD_OPTIONS if o in request}
+        match op:
+            case "assemble" | "run":
+                if "hash" in request:
+                    key = request["hash"]
+                    program = self.cache.get(key)
+                    if program is None:
+                        return {"id": request.get("id"), "hash": key,
+                                "error": "Unknown hash, send the program again"}
+                elif "source" in request:
+                    source = request["source"]
+                    if preprocess.has_directives(source):
+                        if ".include" in source and "base_dir" not in request:
+                            raise ValueError("Sources with .include need a base_dir")
+                        # Hashed with the files it includes, which may have changed
+                        source = "\n".join(preprocess.expand(source, request.get("base_dir")))
+                    key, program = self.cache.load(source.encode(), options)
+                elif "program" in request:
+                    path = request["program"]
+                    with open(path, "rb") as fin:
+                        data = fin.read()
+                    if not objfile.is_object(data) and preprocess.has_directives(data.decode()):
+                        # Hashed with the files it includes, which may have changed
+                        lines = preprocess.expand(data.decode(), os.path.dirname(os.path.abspath(path)))
+                        data = "\n".join(lines).encode()
+                    key, program = self.cache.load(data, options)
+                else:
+                    raise ValueError("Expected hash, source or program")
+
+                if op == "assemble":
+                    if isinstance(program, str):
+                        return {"hash": key, "error": f"Assembly failed: {program}"}
+                    return {"hash": key, "words": program.interp.prog_len}
+                result = {"id": request.get("id"), "hash": key}
+                if "program" in request:
+                    result["program"] = request["program"]
+                if isinstance(program, str):
+                    result["error"] = f"Assembly failed: {program}"
+                    return result
+                return program.run(request, result)
+            case "stats":
+                return self.cache.stats()
+            case "shutdown":
+                self.stopping = True
+                # shutdown() waits for serve_forever() to return, so it
+                # cannot be called from this thread
+                threading.Thread(target=self.shutdown).start()
+                return {"stopping": True}
+        raise ValueError(f"Unknown op '{op}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve assemble and run requests.")
+    parser.add_argument("-s", "--socket", default=DEFAULT_SOCKET, help="socket path")
+    parser.add_argument("--cache", type=int, default=DEFAULT_CACHE,
+                        help="number of programs kept loaded")
+    args = parser.parse_args()
+
+    with Daemon(args.socket, args.cache) as daemon:
+        print(f"Listening on {args.socket}", file=sys.stderr)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
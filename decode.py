@@ -1,8 +1,140 @@
 # Decodes instructions.
+#
+# Every 16-bit word is disassembled once, into a table that is built the
+# first time it is needed, so decode() is a bounds check and a lookup.
+
+from typing import NamedTuple
 
 from utils.reg_names import REG_NAMES
 
-def decode(inst: int):
+NUM_WORDS = 1 << 16
+
+IMM_TYPE = {0b10: "addi", 0b11: "nandi"}
+ALU3_TYPE = {0b01100: "add", 0b01001: "nand"}
+ALU2_TYPE = {0b01000: "swb", 0b01010: "sl", 0b01011: "sr"}
+MEM_TYPE = {0b00010: "lw", 0b00011: "sw"}
+BR_TYPE = {0b00101: "bn", 0b00110: "bz", 0b00111: "bp"}
+
+# Disassembly of every word, or the error message for words that name
+# registers that do not exist; built by table()
+TABLE = None
+
+
+class Disassembled(NamedTuple):
+    """
+    Fields of a decoded instruction. Fields the opcode does not use are
+    None. For .fill, imm is the whole word.
+        opcode: e.g. "add" or ".fill"
+        rd, rs, ro: register indices
+        imm: sign-extended immediate
+        text: assembly, e.g. "add 1, 2, 3"
+    """
+    opcode: str
+    rd: int | None
+    rs: int | None
+    ro: int | None
+    imm: int | None
+    text: str
+
+
+def reg_name(idx: int) -> str:
+    """
+    Canonical name of a register index.
+    """
+    if idx >= len(REG_NAMES):
+        raise ValueError(f"Invalid register index: {idx}")
+    return REG_NAMES[idx][0]
+
+
+def signed(x: int, width: int) -> int:
+    return x - (1 << width) if x >> (width - 1) else x
+
+
+def disassemble_word(inst: int) -> Disassembled:
+    """
+    Decode one word without the table.
+        Raises ValueError if it names a register that does not exist,
+        checking rs, then rd, then ro.
+    """
+    rs, rd, ro = (inst >> 8) & 0b111, (inst >> 5) & 0b111, (inst >> 2) & 0b111
+    op2, op5 = inst >> 14, inst >> 11
+
+    # IMM-TYPE: op(2) imm[7:5](3) rs(3) rd(3) imm[4:0](5)
+    if op2 in IMM_TYPE:
+        opcode = IMM_TYPE[op2]
+        imm = signed((((inst >> 11) & 0b111) << 5) | (inst & 0b11111), 8)
+        s, d = reg_name(rs), reg_name(rd)
+        text = f"{opcode} {d}, {s}, {imm}"
+        return Disassembled(opcode, rd, rs, None, imm, text)
+
+    if op5 in ALU3_TYPE:
+        opcode = ALU3_TYPE[op5]
+        s, d, o = reg_name(rs), reg_name(rd), reg_name(ro)
+        text = f"{opcode} {d}, {s}, {o}"
+        return Disassembled(opcode, rd, rs, ro, None, text)
+
+    if op5 in ALU2_TYPE:
+        opcode = ALU2_TYPE[op5]
+        s, d = reg_name(rs), reg_name(rd)
+        text = f"{opcode} {d}, {s}"
+        return Disassembled(opcode, rd, rs, None, None, text)
+
+    if op5 == 0b00000:
+        s, d = reg_name(rs), reg_name(rd)
+        text = f"jalr {d}, {s}"
+        return Disassembled("jalr", rd, rs, None, None, text)
+
+    if op5 in MEM_TYPE:
+        opcode = MEM_TYPE[op5]
+        imm = signed(inst & 0b11111, 5)
+        s, d = reg_name(rs), reg_name(rd)
+        text = f"{opcode} {d}, {imm}({s})"
+        return Disassembled(opcode, rd, rs, None, imm, text)
+
+    if op5 in BR_TYPE:
+        opcode = BR_TYPE[op5]
+        imm = signed(inst & 0xFF, 8)
+        text = f"{opcode} {reg_name(rs)}, {imm}"
+        return Disassembled(opcode, None, rs, None, imm, text)
+
+    # Anything else is data
+    return Disassembled(".fill", None, None, None, inst, f".fill {inst}")
+
+
+def table() -> list:
+    """
+    Disassembly of every word, built on first use.
+    """
+    global TABLE
+    if TABLE is None:
+        entries = []
+        for inst in range(NUM_WORDS):
+            try:
+                entries.append(disassemble_word(inst))
+            except ValueError as e:
+                entries.append(str(e))
+        TABLE = entries
+    return TABLE
+
+
+def fields(inst: int) -> Disassembled:
+    """
+    Decode a 16-bit instruction into its fields.
+        Raises ValueError for words that name registers that do not exist.
+    """
+    # Check that inst is a non-negative 16-bit integer
+    if not isinstance(inst, int):
+        raise TypeError("Instruction must be an integer")
+    if inst < 0 or inst >= NUM_WORDS:
+        raise ValueError("Instruction must be a non-negative 16-bit integer")
+
+    entry = (TABLE or table())[inst]
+    if isinstance(entry, str):
+        raise ValueError(entry)
+    return entry
+
+
+def decode(inst: int) -> str:
     """
     Decodes a 16-bit instruction into a string representation.
         inst: 16-bit integer instruction
@@ -12,94 +144,26 @@ def decode(inst: int):
     gets decoded as
         "add x1, x2, x3"
     """
-    # Check that inst is a non-negative 16-bit integer
-    if not isinstance(inst, int):
-        raise TypeError("Instruction must be an integer")
-    if inst < 0 or inst >= (1 << 16):
-        raise ValueError("Instruction must be a non-negative 16-bit integer")
-
-    # Convert instruction to 16-bit binary string
-    bin_str = bin(inst)[2:].zfill(16)
+    return fields(inst).text
 
-    # Helper function to get register name from 3-bit binary string
-    def get_reg_name(reg_bits: str) -> str:
-        idx = int(reg_bits, 2)
-        if idx >= len(REG_NAMES):
-            raise ValueError(f"Invalid register index: {idx}")
-        return REG_NAMES[idx][0]  # Return canonical name
 
-    # Special case for .fill: if the value is small (< 64) and doesn't match valid opcodes
-    if inst < 64 and not bin_str.startswith(("01", "10", "11", "000", "001")):
-        return f".fill {inst}"
-    
-    # IMM-TYPE instructions (addi, nandi)
-    if bin_str[0:2] in ["10", "11"]:
-        opcode = "addi" if bin_str[0:2] == "10" else "nandi"
-        # Format in encode.py: f"{imm_type[opcode]}_{imm[0:3]}_{rs}_{rd}_{imm[3:8]}"
-        imm_high = bin_str[2:5]
-        rs = get_reg_name(bin_str[5:8])
-        rd = get_reg_name(bin_str[8:11])
-        imm_low = bin_str[11:16]
-        imm = imm_high + imm_low
-        
-        # Convert imm to signed integer
-        imm_val = int(imm, 2)
-        if imm_high[0] == "1":  # If MSB is 1, it's negative
-            imm_val -= (1 << 8)
-        
-        return f"{opcode} {rd}, {rs}, {imm_val}"
-    
-    # ALU3-TYPE (add, nand)
-    elif bin_str[0:5] in ["01100", "01001"]:
-        # Format in encode.py: f"{alu3_type[opcode]}_{rs}_{rd}_{ro}_00"
-        opcode = "add" if bin_str[0:5] == "01100" else "nand"
-        rs = get_reg_name(bin_str[5:8])
-        rd = get_reg_name(bin_str[8:11])
-        ro = get_reg_name(bin_str[11:14])
-        return f"{opcode} {rd}, {rs}, {ro}"
-    
-    # ALU2-TYPE (swb, sl, sr)
-    elif bin_str[0:5] in ["01000", "01010", "01011"]:
-        # Format in encode.py: f"{alu2_type[opcode]}_{rs}_{rd}_00000"
-        opcode_map = {"01000": "swb", "01010": "sl", "01011": "sr"}
-        opcode = opcode_map[bin_str[0:5]]
-        rs = get_reg_name(bin_str[5:8])
-        rd = get_reg_name(bin_str[8:11])
-        return f"{opcode} {rd}, {rs}"
-    
-    # JUMP-TYPE (jalr)
-    elif bin_str[0:5] == "00000":
-        # Format in encode.py: f"{jump_type[opcode]}_{rs}_{rd}_00000"
-        rs = get_reg_name(bin_str[5:8])
-        rd = get_reg_name(bin_str[8:11])
-        return f"jalr {rd}, {rs}"
-    
-    # MEM-TYPE (lw, sw)
-    elif bin_str[0:5] in ["00010", "00011"]:
-        # Format in encode.py: f"{mem_type[opcode]}_{rs}_{rd}_{imm}"
-        opcode = "lw" if bin_str[0:5] == "00010" else "sw"
-        rs = get_reg_name(bin_str[5:8])
-        rd = get_reg_name(bin_str[8:11])
-        imm = int(bin_str[11:16], 2)
-        # Convert to signed if needed
-        if bin_str[11] == "1":  # If MSB is 1, it's negative
-            imm -= (1 << 5)
-        return f"{opcode} {rd}, {imm}({rs})"
-    
-    # BR-TYPE (bn, bz, bp)
-    elif bin_str[0:5] in ["00101", "00110", "00111"]:
-        # Format in encode.py: f"{br_type[opcode]}_{rs}_{imm}"
-        opcode_map = {"00101": "bn", "00110": "bz", "00111": "bp"}
-        opcode = opcode_map[bin_str[0:5]]
-        rs = get_reg_name(bin_str[5:8])
-        imm = int(bin_str[8:16], 2)
-        # Convert to signed if needed
-        if bin_str[8] == "1":  # If MSB is 1, it's negative
-            imm -= (1 << 8)
-        return f"{opcode} {rs}, {imm}"
-    
-    # Default case - treat as .fill directive
-    return f".fill {inst}"
+def disassemble(mem, start: int, end: int, errors: bool = False) -> list:
+    """
+    Decode mem[start:end] in one call, as a list of text lines.
+        errors: raise for undecodable words instead of showing them
+            as .fill
+    """
+    entries = TABLE or table()
+    out = []
+    for inst in mem[start:end]:
+        entry = entries[inst]
+        if isinstance(entry, str):
+            if errors:
+                raise ValueError(entry)
+            out.append(f".fill {inst}")
+        else:
+            out.append(entry.text)
+    return out
 
 
 if __name__ == "__main__":
@@ -1,174 +1,329 @@
 # Encodes instructions.
 
 import re
-from utils.reg_names import r2idx, is_vreg
-from utils.literals import encode_literal
+from functools import lru_cache
+from typing import NamedTuple
+
+from utils.reg_names import is_vreg, r2idx
+from utils.literals import parse_literal, fit_literal
 from utils.pseudo import expand
 
+LINE = re.compile(r"^([\.\w]+)(?: (.+))?$")
+ARG_SEP = re.compile(r"[,\s]+")
+MEM_ARG = re.compile(r"^(.+)\((.+)\)$")
+
+# Opcode fields of each instruction type
+IMM_TYPE = {"addi": 0b10, "nandi": 0b11}
+ALU2_TYPE = {"swb": 0b01000, "sl": 0b01010, "sr": 0b01011}
+ALU3_TYPE = {"nand": 0b01001, "add": 0b01100}
+JUMP_TYPE = {"jalr": 0b00000}
+BR_TYPE = {"bn": 0b00101, "bz": 0b00110, "bp": 0b00111}
+MEM_TYPE = {"lw": 0b00010, "sw": 0b00011}
+
+PRIMITIVES = {**IMM_TYPE, **ALU2_TYPE, **ALU3_TYPE, **JUMP_TYPE, **BR_TYPE, **MEM_TYPE}
 
-def encode(inst: str, addr: int, labels: dict | None) -> int:
+# Encodings of lines that do not reference labels, keyed by line
+ENCODED = {}
+MAX_ENCODED = 1 << 16
+
+
+class Parsed(NamedTuple):
     """
-    Encodes instruction as a 16-bit integer.
-        inst: raw instruction
-        addr: address of the instruction
-        labels: dictionary containing parsed labels
+    An instruction split into its opcode and arguments.
+    """
+    opcode: str
+    args: tuple
 
-    Example:
-        add x1, x2, x3
-    gets encoded as
-        000_001_010_0000_011.
+
+@lru_cache(maxsize=MAX_ENCODED)
+def parse(inst: str) -> Parsed:
+    """
+    Tokenize an instruction, e.g. "add x1, x2, x3" into
+        Parsed("add", ("x1", "x2", "x3")).
+    """
+    match = LINE.match(inst)
+    if match is None:
+        raise SyntaxError(f"Cannot parse instruction '{inst}'")
+    opcode, args_str = match.groups()
+    args = tuple(ARG_SEP.split(args_str)) if args_str else ()
+    return Parsed(opcode, args)
+
+
+def resolve(x: str, width: int, signed: bool, addr: int, labels: dict | None,
+            refs: list, offset: bool = False) -> int:
+    """
+    Encode x as a signed/unsigned immediate field.
+    x is allowed to be a label, in which case we optionally
+        compute the offset from current address.
+    Offset: whether to compute label as an offset to addr.
+    Labels that are used are appended to refs.
     """
-    def r(reg_name) -> str:
-        """
-        Encode reg name as 3 bits.
-        """
-        idx = r2idx(reg_name)
-        return bin(idx)[2:].zfill(3)
-
-    def si(x: str, width: int, signed: bool, offset: bool = False) -> str:
-        """
-        Encode x as a signed/unsigned immediate.
-        x is allowed to be a label, in which case we optionally
-            compute the offset from current address.
-        Offset: whether to compute label as an offset to addr.
-        """
-        res = encode_literal(x, width, signed)
-
-        if res == None:
-            # If labels is not provided, this is probably a first pass
-            if labels == None:
-                return bin(0xFFFF)[2:]
-
-            # If x is not numeric, it is a label
-            if not x in labels:
-                raise NameError(f"Label '{x}' not found")
-            value = labels[x] - addr if offset else labels[x]
-            return si(value, width, signed)
-
-        return res
-
-    def join(subinstructions: list):
-        """
-        Recursively join list of instructions.
-        """
-        return sum([encode(inst, addr, labels) for inst in subinstructions], [])
-
-    opcode, args_str = re.findall(r"^([\.\w]+)(?: (.+))?$", inst)[0]
-    args = re.split(r"[,\s]+", args_str) if args_str else []
+    value = parse_literal(x)
+    if value is None:
+        refs.append(x)
+        # If labels is not provided, this is probably a first pass
+        if labels == None:
+            return (1<<width) - 1
+
+        # If x is not numeric, it is a label
+        if not x in labels:
+            raise NameError(f"Label '{x}' not found")
+        value = labels[x] - addr if offset else labels[x]
+
+    return fit_literal(value, width, signed)
 
+
+def split_imm(imm: int) -> tuple | None:
+    """
+    Split a 16-bit value into the two 8-bit immediates that li loads with
+        "addi rd, zero, hi; swb rd, rd; addi rd, rd, lo".
+    Both immediates are sign extended, so hi is off by one when lo is
+        negative, and swb leaves 0xFF in the low byte when hi is negative.
+    Returns None for 0x7F80-0x807E, which no such pair reaches.
+    """
+    for carry in (1, 0, -1):
+        imm_hi = ((imm >> 8) + carry) & 0xFF
+        base = (imm_hi << 8) | (0xFF if imm_hi & 0x80 else 0)
+        imm_lo = (imm - base) & 0xFFFF
+        if imm_lo < 0x80 or imm_lo >= 0xFF80:
+            return imm_hi, imm_lo & 0xFF
+    return None
+
+
+def two_word_imms() -> dict:
+    """
+    Values "addi rd, zero, x" followed by swb, sl or sr on rd can load,
+        mapped to (x, op).
+    """
+    ops = {
+        "swb": lambda v: ((v & 0xFF) << 8) | (v >> 8),
+        "sl": lambda v: (v << 1) & 0xFFFF,
+        "sr": lambda v: v >> 1,
+    }
+    imms = {}
+    for x in range(-128, 128):
+        for op, fn in ops.items():
+            imms.setdefault(fn(x & 0xFFFF), (x, op))
+    return imms
+
+TWO_WORD_IMMS = two_word_imms()
+
+
+def load_imm(rd: str, imm: int, shortest: bool = False) -> list:
+    """
+    Instructions that load a 16-bit value into rd: always three, or the
+        fewest there are if shortest (see relax.py).
+    """
+    if shortest:
+        if imm < 0x80 or imm >= 0xFF80:
+            return [f"addi {rd}, zero, {imm & 0xFF}"]
+        if imm in TWO_WORD_IMMS:
+            x, op = TWO_WORD_IMMS[imm]
+            return [f"addi {rd}, zero, {x}", f"{op} {rd}, {rd}"]
+
+    split = split_imm(imm)
+    if split is None:
+        # Values around 0x8000 are reached from 0x7FFF instead
+        return [f"addi {rd}, zero, -1",
+                f"sr {rd}, {rd}",
+                f"addi {rd}, {rd}, {(imm - 0x7FFF) & 0xFF}"]
+    imm_hi, imm_lo = split
+    return [f"addi {rd}, zero, {imm_hi}",
+            f"swb {rd}, {rd}",
+            f"addi {rd}, {rd}, {imm_lo}"]
+
+
+def lower(opcode: str, args: tuple, inst: str, addr: int, labels: dict | None,
+          refs: list) -> list | None:
+    """
+    Expand virtual registers and pseudoinstructions into simpler
+        instructions. Returns None for primitive instructions.
+    """
     # Check if instruction uses virtual registers
     expanded = expand(inst, opcode, args)
     if len(expanded) > 1:
-        return join(expanded)
-
-    # FILL DIRECTIVE
-    if opcode == ".fill":
-        return [int(si(args[0], 16, True), 2)]
+        return expanded
 
-    # PSEUDOINSTRUCTIONS
     if opcode == "halt":
-        return join(["jalr 0, 0"])
+        return ["jalr 0, 0"]
 
     if opcode == "neg":
         rd, rs = args
-        return join([f"nand {rd}, {rs}, {rs}",
-        f"addi {rd}, {rd}, 1"])
+        return [f"nand {rd}, {rs}, {rs}",
+                f"addi {rd}, {rd}, 1"]
 
     if opcode == "nop":
-        return join([f"add 0, 0, 0"])
+        return ["add 0, 0, 0"]
 
     if opcode == "mv":
         rd, rs = args
-        return join([f"addi {rd}, {rs}, 0"])
+        return [f"addi {rd}, {rs}, 0"]
 
     if opcode == "li":
         assert len(args) == 2, \
             "Expected 1 register, 1 immediate for li instruction"
         rd, imm_raw = args
-        imm = si(imm_raw, 16, True)
-        imm_lo = int(imm[8:16], 2)
-
-        # Add an extra 1 to compensate for sign extensions
-        # Two's complement is weird
-        imm_hi = (int(imm[0:8], 2) + (1 if imm_lo & 0xC0 else 0)) & 0xFF
-
-        # If there are high bits, we must do swap thing
-        # Also must do swap thing if it's a label
-        if imm_hi != 0 or (encode_literal(imm_raw, 16, True) == None):
-            return join([f"addi {rd}, zero, {imm_hi}",
-                         f"swb {rd}, {rd}",
-                         f"addi {rd}, {rd}, {imm_lo}"])
-
-        # Otherwise, we can add directly
-        return encode(f"addi {rd}, zero, {imm_lo}", addr, labels)
+        imm = resolve(imm_raw, 16, True, addr, labels, refs)
+        split = split_imm(imm)
+        # Label values are not known when widths are worked out, so labels
+        # always take the longest form (relax.py picks shorter ones)
+        if parse_literal(imm_raw) is not None and split is not None and split[0] == 0:
+            return [f"addi {rd}, zero, {split[1]}"]
+        return load_imm(rd, imm)
 
     if opcode == "jal":
         # Jump and link
         assert len(args) == 1, "Expected 1 label for jal instruction"
-        return join([f"li 1, {args[0]}",
-                     f"jalr 1, 1"])
+        return [f"li 1, {args[0]}",
+                f"jalr 1, 1"]
 
     if opcode == "j":
         # Jump and DO NOT LINK
         assert len(args) == 1, "Expected 1 label for j instruction"
-        return join([f"li 1, {args[0]}",
-                     f"jalr 0, 1"])
+        return [f"li 1, {args[0]}",
+                f"jalr 0, 1"]
+
+    if opcode in PRIMITIVES or opcode == ".fill":
+        return None
+
+    raise Exception(f"Opcode '{opcode}' not supported")
+
+
+@lru_cache(maxsize=MAX_ENCODED)
+def width(inst: str) -> int:
+    """
+    Number of words inst assembles to, without encoding it.
+        Widths never depend on label values.
+    """
+    opcode, args = parse(inst)
+    subinstructions = lower(opcode, args, inst, 0, None, [])
+    if subinstructions is None:
+        return 1
+    return sum(width(sub) for sub in subinstructions)
+
+
+def flatten(inst: str) -> list:
+    """
+    Expand inst into single-word instructions ahead of encoding.
+        Lines whose expansion depends on label values stay whole, as do
+        li instructions into physical registers.
+    """
+    opcode, args = parse(inst)
+    if opcode == "li" and len(args) == 2 and not is_vreg(args[0]):
+        return [inst]
+
+    refs = []
+    subinstructions = lower(opcode, args, inst, 0, None, refs)
+    if subinstructions is None or refs:
+        return [inst]
+    return [line for sub in subinstructions for line in flatten(sub)]
+
+
+def encode_primitive(opcode: str, args: tuple, addr: int, labels: dict | None,
+                     refs: list) -> int:
+    """
+    Encode a single-word instruction.
+    """
+    r = r2idx
+
+    def si(x: str, width: int, signed: bool, offset: bool = False) -> int:
+        return resolve(x, width, signed, addr, labels, refs, offset)
+
+    # FILL DIRECTIVE
+    if opcode == ".fill":
+        return si(args[0], 16, True)
 
     # IMM-TYPE
-    imm_type = {"addi": "10", "nandi": "11"}
-    if opcode in imm_type:
+    if opcode in IMM_TYPE:
         assert len(
             args) == 3, "Expected 2 registers, 1 immediate for imm-type instruction"
         imm = si(args[2], 8, True)
         rd, rs = r(args[0]), r(args[1])
-        return [int(f"{imm_type[opcode]}_{imm[0:3]}_{rs}_{rd}_{imm[3:8]}", 2)]
+        return (IMM_TYPE[opcode] << 14) | ((imm >> 5) << 11) | (rs << 8) | (rd << 5) | (imm & 0b11111)
 
     # ALU2-TYPE
-    alu2_type = {"swb": "01000", "sl": "01010", "sr": "01011"}
-    if opcode in alu2_type:
+    if opcode in ALU2_TYPE:
         assert len(args) == 2, "Expected 2 registers for alu2-type instruction"
         rd = r(args[0])
         rs = r(args[1])
-        return [int(f"{alu2_type[opcode]}_{rs}_{rd}_00000", 2)]
+        return (ALU2_TYPE[opcode] << 11) | (rs << 8) | (rd << 5)
 
     # ALU3-TYPE
-    alu3_type = {"nand": "01001", "add": "01100"}
-    if opcode in alu3_type:
+    if opcode in ALU3_TYPE:
         assert len(args) == 3, "Expected 3 registers for alu3-type instruction"
         rd = r(args[0])
         rs = r(args[1])
         ro = r(args[2])
-        return [int(f"{alu3_type[opcode]}_{rs}_{rd}_{ro}_00", 2)]
+        return (ALU3_TYPE[opcode] << 11) | (rs << 8) | (rd << 5) | (ro << 2)
 
     # JUMP-TYPE
-    jump_type = {"jalr": "00000"}
-    if opcode in jump_type:
+    if opcode in JUMP_TYPE:
         assert len(args) == 2, "Expected 2 registers for jump-type instruction"
         rd = r(args[0])
         rs = r(args[1])
-        return [int(f"{jump_type[opcode]}_{rs}_{rd}_00000", 2)]
+        return (JUMP_TYPE[opcode] << 11) | (rs << 8) | (rd << 5)
 
     # BR-TYPE
-    br_type = {"bn": "00101", "bz": "00110", "bp": "00111"}
-    if opcode in br_type:
+    if opcode in BR_TYPE:
         assert len(
             args) == 2, "Expected 1 register, 1 label for br-type instruction"
         rs = r(args[0])
         imm = si(args[1], 8, True, True)
-        return [int(f"{br_type[opcode]}_{rs}_{imm}", 2)]
+        return (BR_TYPE[opcode] << 11) | (rs << 8) | imm
 
     # MEM-TYPE
-    mem_type = {"lw": "00010", "sw": "00011"}
-    if opcode in mem_type:
+    if opcode in MEM_TYPE:
         assert len(args) == 2, "Expected 2 registers for mem-type instruction"
         rd = r(args[0])
-        imm, rs = re.findall(r"^(.+)\((.+)\)$", args[1])[0]
+        imm, rs = MEM_ARG.findall(args[1])[0]
         imm = si(imm, 5, True)
         rs = r(rs)
-        return [int(f"{mem_type[opcode]}_{rs}_{rd}_{imm}", 2)]
+        return (MEM_TYPE[opcode] << 11) | (rs << 8) | (rd << 5) | imm
 
     raise Exception(f"Opcode '{opcode}' not supported")
 
 
+def encode_words(inst: str, addr: int, labels: dict | None, refs: list) -> tuple:
+    """
+    Encode inst, reusing the cached encoding if it has one.
+        Labels that are used are appended to refs.
+    """
+    words = ENCODED.get(inst)
+    if words is not None:
+        return words
+
+    n_refs = len(refs)
+    opcode, args = parse(inst)
+    subinstructions = lower(opcode, args, inst, addr, labels, refs)
+    if subinstructions is None:
+        words = (encode_primitive(opcode, args, addr, labels, refs),)
+    else:
+        # Each subinstruction is encoded at its own address, so branch
+        # offsets are relative to the branch itself
+        words = ()
+        for sub in subinstructions:
+            words += encode_words(sub, addr + len(words), labels, refs)
+
+    # Only lines that do not use labels encode the same way everywhere
+    if len(refs) == n_refs and len(ENCODED) < MAX_ENCODED:
+        ENCODED[inst] = words
+    return words
+
+
+def encode(inst: str, addr: int, labels: dict | None) -> list:
+    """
+    Encodes instruction as a list of 16-bit integers.
+        inst: raw instruction
+        addr: address of the instruction
+        labels: dictionary containing parsed labels
+
+    Example:
+        add x1, x2, x3
+    gets encoded as
+        000_001_010_0000_011.
+    """
+    return list(encode_words(inst, addr, labels, []))
+
+
 if __name__ == "__main__":
-    print(bin(encode("addi x1, x2, 0", 0, {})))
+    print(bin(encode("addi x1, x2, 0", 0, {})[0]))
@@ -2,6 +2,20 @@
 
 from utils.literals import decode_literal
 
+
+class ExecutionError(Exception):
+    """
+    Raised when a program crashes.
+        pc: address of the instruction that failed
+        cycles: number of instructions completed before the failure
+    """
+    def __init__(self, pc: int, cause: Exception, cycles: int | None = None):
+        super().__init__(f"Execution crashed while pc={pc}: {cause}")
+        self.pc = pc
+        self.cause = cause
+        self.cycles = cycles
+
+
 def execute(inst: int, reg: list, mem: list, pc: int):
     """
     Decode instruction and execute it.
@@ -0,0 +1,246 @@
+# Runs sequences the assembler emits as single handlers.
+#
+# Most words executed come from a few fixed expansions (see encode.lower
+# and utils.pseudo.expand):
+#   li rd, imm              addi rd, r0, hi / swb rd, rd / addi rd, rd, lo
+#   j label, jal label      li r1, label / jalr r0 or r1, r1
+#   virtual registers       lw r1, x(r0) [/ lw r2, y(r0)] / op / sw r1, z(r0)
+#                           lw r1, x(r0) / bz r1, label
+#                           addi r1, r0, imm / sw r1, x(r0)
+# so with fuse set, DecodeCache looks for a run of up to MAX_FUSED words
+# of the form
+#   up to 2 r0-relative lw, then ALU instructions, then optionally one
+#   sw, jalr or branch
+# starting at each address it runs a second time, and runs it with one
+# handler generated for those words. Every such sequence runs to the end
+# once started, since r0-relative loads cannot fail. Handlers add the
+# dispatches they save to cache.fused, which DecodeCache.run() adds to
+# the cycles it reports, so results and cycle counts are the same as
+# running one word at a time.
+#
+# Results of ALU instructions on constants (li, and the li in j and jal)
+# are computed when the handler is built. Constants are passed to the
+# generated code as parameters, so sequences that differ only in
+# immediates or addresses share it. Each handler checks that the words
+# after its first are unchanged before running; sw clears the first as
+# usual.
+
+from typing import Callable
+
+from blocks import BRANCH_CONDS, EXPRS, can_translate, is_device_access
+from predecode import MAX_FUSED, NUM_REGS, READS, make_op, predecode
+
+# Generated handler code -> factory taking its parameters
+FACTORIES = {}
+
+
+def scan(mem: list, addr: int, ports: dict) -> list:
+    """
+    Words from addr that can run as one handler, or fewer than 2 if
+        there are none.
+    """
+    words = []
+    loads = 0
+    size = len(mem)
+    while len(words) < MAX_FUSED and addr + len(words) < size:
+        inst = mem[addr + len(words)]
+        d = predecode(inst)
+        if not can_translate(d) or (ports and is_device_access(d, ports, size)):
+            break
+        if d.name == "lw":
+            if d.rs != 0 or loads != len(words) or loads == 2:
+                break
+            loads += 1
+        elif d.name not in EXPRS:
+            if d.name in ("sw", "jalr") or d.name in BRANCH_CONDS:
+                words.append(inst)
+            break
+        words.append(inst)
+    return words
+
+
+class Builder:
+    """
+    Generates a handler for a sequence of words. Registers live in locals
+        r0..r4, and values known when the handler is built (results of
+        ALU instructions whose operands are constants, such as li) are
+        computed here and passed in as parameters, so handlers for
+        sequences that differ only in constants share their code.
+    """
+    def __init__(self):
+        self.body = []
+        self.params = []
+        # Registers with a known value not yet in their local
+        self.known = {0: 0}
+        self.loaded = set()
+        self.assigned = set()
+
+    def param(self, value) -> str:
+        self.params.append(value)
+        return f"p{len(self.params) - 1}"
+
+    def read(self, i: int) -> str:
+        """
+        Name of a local holding register i.
+        """
+        if i in self.known:
+            self.body.append(f"r{i} = {self.param(self.known.pop(i))}")
+            self.assigned.add(i)
+        elif i not in self.assigned:
+            self.loaded.add(i)
+        return f"r{i}"
+
+    def write(self, i: int, expr: str):
+        self.known.pop(i, None)
+        self.assigned.add(i)
+        self.body.append(f"r{i} = {expr}")
+
+    def value(self, i: int):
+        """
+        Value of register i if it is known.
+        """
+        if i == 0:
+            return 0
+        if i in self.assigned:
+            return None
+        return self.known.get(i)
+
+
+def evaluate(d, known: dict):
+    """
+    Run one instruction on registers with known values. Returns the pc
+        its handler returns when run at pc 0, and the value left in rd.
+    """
+    reg = [known.get(i, 0) for i in range(NUM_REGS)]
+    new_pc = make_op(d)(reg, None, 0)
+    return new_pc, reg[d.rd]
+
+
+def compile_fused(cache, words: tuple) -> Callable:
+    """
+    Build the handler op(reg, mem, pc) -> new_pc for words.
+    """
+    b = Builder()
+    size = len(cache.mem)
+    new_pc = f"pc + {len(words)}"
+    for k, inst in enumerate(words):
+        d = predecode(inst)
+        name, rs, rd, ro, imm = d
+        regs = {"s": rs, "d": rd, "o": ro}
+        sources = [regs[r] for r in READS.get(name, "")]
+        if name in EXPRS:
+            if rd == 0:
+                continue
+            if all(b.value(i) is not None for i in sources):
+                b.known[rd] = evaluate(d, {i: b.value(i) for i in sources})[1]
+                b.assigned.discard(rd)
+                continue
+            for i in sources:
+                b.read(i)
+            b.write(rd, EXPRS[name].format(rs=rs, ro=ro, imm=b.param(imm)))
+        elif name == "lw":
+            # r0 is always 0, so the address is known
+            if rd != 0:
+                b.write(rd, f"mem[{b.param(imm)}] & 0xFFFF")
+        elif name == "sw":
+            known = b.value(rd)
+            value = b.read(rd) if known is None else b.param(known)
+            target = b.param((rs + imm) % size)
+            b.body += [f"mem[{target}] = {value}",
+                       f"entries[{target}] = None",
+                       f"if {target} in watched:",
+                       f"    written({target})"]
+        elif name == "jalr":
+            if rd != 0 and rs == rd:
+                # rd is written first, so it is also the target
+                b.write(rd, f"(pc + {k + 1}) & 0xFFFF")
+                new_pc = f"r{rd}"
+            else:
+                known = b.value(rs)
+                new_pc = b.read(rs) if known is None else b.param(known)
+                if rd != 0:
+                    b.write(rd, f"(pc + {k + 1}) & 0xFFFF")
+        elif name in BRANCH_CONDS:
+            known = b.value(rs)
+            if known is not None:
+                new_pc = f"pc + {k + evaluate(d, {rs: known})[0]}"
+            else:
+                new_pc = f"pc + {k} + {b.param(imm)} if {b.read(rs)} {BRANCH_CONDS[name]} " \
+                    f"else pc + {k + 1}"
+
+    # Registers still only known go straight to reg
+    written = sorted(b.assigned - {0})
+    stores = [(f"reg[{i}]", f"r{i}") for i in written] + \
+        [(f"reg[{i}]", b.param(value)) for i, value in sorted(b.known.items()) if i != 0]
+    check = " or ".join(f"mem[pc + {k}] != {b.param(inst)}" for k, inst in enumerate(words)
+                        if k > 0)
+    body = [f"if {check}:",
+            "    entries[pc] = None",
+            "    return first(reg, mem, pc)"]
+    loaded = sorted(b.loaded)
+    if loaded:
+        body.append(", ".join(f"r{i}" for i in loaded) + " = " +
+                    ", ".join(f"reg[{i}]" for i in loaded))
+    body += b.body
+    if stores:
+        body.append(", ".join(lhs for lhs, _ in stores) + " = " +
+                    ", ".join(rhs for _, rhs in stores))
+    body.append(f"cache.fused += {len(words) - 1}")
+    body.append(f"return {new_pc}")
+
+    factory = FACTORIES.get(tuple(body))
+    if factory is None:
+        args = ", ".join(["first", "cache", "entries", "watched", "written"] +
+                         [f"p{i}" for i in range(len(b.params))])
+        source = f"def factory({args}):\n" + \
+            "    def fused(reg, mem, pc):\n" + \
+            "".join(f"        {line}\n" for line in body) + \
+            "    return fused\n"
+        env = {}
+        exec(source, env)
+        factory = FACTORIES[tuple(body)] = env["factory"]
+    return factory(cache.handler(words[0]), cache, cache.entries, cache.watched,
+                   cache.written, *b.params)
+
+
+def fuse(cache, addr: int) -> tuple | None:
+    """
+    Handler for the sequence starting at addr and its length in words,
+        or None if there is none.
+    """
+    words = tuple(scan(cache.mem, addr, cache.ports))
+    if len(words) < 2:
+        return None
+    op = cache.ops.get(words)
+    if op is None:
+        op = cache.ops[words] = compile_fused(cache, words)
+    return op, len(words)
+
+
+if __name__ == "__main__":
+    # Compare cycles, dispatches and time with and without fusion
+    import sys
+    import time
+
+    from interpreter import Interpreter
+
+    if len(sys.argv) < 2:
+        print(f"Usage: fusion.py <script> [max_cycles]")
+        exit(1)
+    with open(sys.argv[1]) as fin:
+        prog = fin.read()
+    max_cycles = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    results = []
+    for fused in (False, True):
+        interp = Interpreter()
+        interp.load_prog(prog)
+        start = time.perf_counter()
+        result = interp.run(trace=False, max_cycles=max_cycles, fuse=fused, fast_forward=False)
+        elapsed = time.perf_counter() - start
+        saved = interp.decoded.fused
+        print(f"fuse={fused}: {result.cycles} cycles, {result.cycles - saved} dispatches, "
+              f"{elapsed:.3f}s")
+        results.append((result, list(interp.mem)))
+    if results[0] != results[1]:
+        print("Results differ!")
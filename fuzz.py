@@ -0,0 +1,428 @@
+# Differential fuzzing of the execution engines and the encoder/decoder.
+#
+#   python fuzz.py engines [-n CASES] [-j PROCESSES] [--seed S] [--engines a,b]
+#   python fuzz.py roundtrip
+#
+# "engines" generates random programs and machine states, runs each one on
+# execute.execute() one step at a time and on every engine, and compares
+# the final pc, cycle count, registers, memory and error. Mismatches are
+# narrowed down to the first cycle where the engine goes wrong and then
+# minimized by shrinking the program and state while it still diverges.
+# Some cases are counted loops run with no cycle limit, the only way the
+# engines skip loops in the decode path (see idle.py); those are compared
+# only if the reference halts within HALT_LIMIT cycles.
+#
+# "roundtrip" checks every 16-bit word: words that decode must encode back
+# to a word with the same disassembly, and execute the same way.
+
+import argparse
+import os
+import random
+import signal
+import sys
+import time
+from multiprocessing import Pool
+from typing import NamedTuple
+
+from blocks import BlockCache
+from decode import NUM_WORDS, fields, table
+from encode import encode
+from execute import ExecutionError, execute
+from predecode import DecodeCache
+from profiler import Profiler
+from tracefile import TraceWriter
+
+PROG_START = 0x1000
+# Words of data before the program that cases fill in
+DATA_WORDS = 32
+NOP = 0x8000
+
+CYCLE_LIMITS = (50, 200, 1000)
+# Cycles the reference runs cases without a limit for before giving up
+HALT_LIMIT = 20_000
+# Fraction of cases that are counted loops run without a cycle limit
+LOOP_CASES = 0.2
+# Seconds an engine may run a case without a limit before it is taken not
+# to halt
+ENGINE_TIMEOUT = 1
+# Cases run by each worker task
+CHUNK = 200
+
+
+class Case(NamedTuple):
+    """
+    A machine to run.
+        prog: words loaded at pc
+        data: words loaded at address 0
+        max_cycles: None to run until the program halts
+    """
+    seed: int
+    pc: int
+    prog: tuple
+    data: tuple
+    reg: tuple
+    max_cycles: int | None
+
+    def machine(self) -> tuple:
+        """
+        Fresh (reg, mem) for the case.
+        """
+        mem = [0] * NUM_WORDS
+        mem[:len(self.data)] = self.data
+        end = min(self.pc + len(self.prog), NUM_WORDS)
+        mem[self.pc:end] = self.prog[:end - self.pc]
+        return list(self.reg), mem
+
+
+class Outcome(NamedTuple):
+    pc: int
+    cycles: int
+    reg: list
+    mem: list
+    error: str | None
+
+
+def random_inst(rng: random.Random) -> int:
+    """
+    Mostly valid instructions, assembled from text so that the encoder
+        is exercised too, with some words that use bad registers or are
+        not instructions at all.
+    """
+    if rng.random() < 0.05:
+        return rng.randrange(NUM_WORDS)
+    r = lambda: rng.randrange(5)
+    op = rng.choice(["addi", "nandi", "swb", "nand", "sl", "sr", "add", "jalr",
+                     "lw", "sw", "bn", "bz", "bp"])
+    if op in ("addi", "nandi"):
+        text = f"{op} {r()}, {r()}, {rng.randrange(-128, 128)}"
+    elif op in ("nand", "add"):
+        text = f"{op} {r()}, {r()}, {r()}"
+    elif op in ("swb", "sl", "sr", "jalr"):
+        text = f"{op} {r()}, {r()}"
+    elif op in ("lw", "sw"):
+        text = f"{op} {r()}, {rng.randrange(-16, 16)}({r()})"
+    else:
+        # Mostly forward, since backward offsets are where engines differ
+        # from the reference most easily
+        offset = rng.randrange(1, 31) if rng.random() < 0.8 else rng.randrange(-32, 0)
+        text = f"{op} {r()}, {offset}"
+    word = encode(text, 0, {})[0]
+    if rng.random() < 0.03:
+        # Register fields 5-7 do not exist
+        word |= rng.choice([0b110, 0b111]) << rng.choice([2, 5, 8])
+    return word
+
+
+def random_loop(rng: random.Random, pc: int, reg: tuple) -> tuple:
+    """
+    A counted loop at pc shaped like those idle.py skips, with random
+        instructions in its body that may or may not keep it skippable,
+        followed by a halt. Returns (prog, reg) with the counter and the
+        register jalr jumps back through set up in reg.
+    """
+    counter, target = rng.sample(range(1, 5), 2)
+    step = rng.choice([1, -1, 3, -3])
+    body = [random_inst(rng) for _ in range(rng.randrange(0, 5))]
+    body.insert(rng.randrange(len(body) + 1), encode(f"addi {counter}, {counter}, {step}", 0, {})[0])
+    exit_at = rng.randrange(len(body) + 1)
+    # bz jumps past the jalr to the halt
+    offset = len(body) + 2 - exit_at
+    body.insert(exit_at, encode(f"bz {counter}, {offset}", 0, {})[0])
+    prog = tuple(body) + tuple(encode(f"jalr 0, {target}", 0, {}) + encode("jalr 0, 0", 0, {}))
+    reg = list(reg)
+    reg[counter] = -rng.randrange(1, 300) * step & 0xFFFF
+    reg[target] = pc
+    return prog, tuple(reg)
+
+
+def random_case(seed: int) -> Case:
+    rng = random.Random(seed)
+    pc = rng.choice([PROG_START, PROG_START, 10, NUM_WORDS - 6])
+    prog = tuple(random_inst(rng) for _ in range(rng.randrange(1, 40)))
+    data = tuple(rng.randrange(NUM_WORDS) for _ in range(DATA_WORDS))
+    values = [0, 1, 2, PROG_START, PROG_START + 3, 0xFFFF]
+    reg = (0,) + tuple(rng.choice(values + [rng.randrange(NUM_WORDS)]) for _ in range(4))
+    max_cycles = rng.choice(CYCLE_LIMITS)
+    if rng.random() < LOOP_CASES:
+        prog, reg = random_loop(rng, pc, reg)
+        max_cycles = None
+    return Case(seed, pc, prog, data, reg, max_cycles)
+
+
+def reference(reg: list, mem: list, pc: int, max_cycles: int) -> tuple:
+    cycles = 0
+    try:
+        while pc != 0 and cycles < max_cycles:
+            pc = execute(mem[pc], reg, mem, pc)
+            cycles += 1
+    except Exception as e:
+        return pc, cycles, f"{type(e).__name__}: {e}"
+    return pc, cycles, None
+
+
+def stepper(reg: list, mem: list, pc: int, max_cycles: int):
+    decoded = DecodeCache(mem)
+    cycles = 0
+    try:
+        while pc != 0 and (max_cycles is None or cycles < max_cycles):
+            pc = decoded.step(reg, pc)
+            cycles += 1
+    except Exception as e:
+        raise ExecutionError(pc, e, cycles) from e
+    return pc, cycles
+
+
+def fast_forward(reg: list, mem: list, pc: int, max_cycles: int):
+    decoded = DecodeCache(mem)
+    decoded.fast_forward = True
+    return BlockCache(decoded).run(reg, pc, max_cycles)
+
+
+def fused(reg: list, mem: list, pc: int, max_cycles: int):
+    decoded = DecodeCache(mem)
+    decoded.fast_forward = True
+    decoded.fuse = True
+    return decoded.run(reg, pc, max_cycles)
+
+
+def traced(reg: list, mem: list, pc: int, max_cycles: int):
+    with TraceWriter(DecodeCache(mem), os.devnull) as writer:
+        return writer.run(reg, pc, max_cycles)
+
+
+# name -> fn(reg, mem, pc, max_cycles) -> (pc, cycles), raising ExecutionError
+ENGINES = {
+    "step": stepper,
+    "predecode": lambda reg, mem, pc, n: DecodeCache(mem).run(reg, pc, n),
+    "blocks": lambda reg, mem, pc, n: BlockCache(DecodeCache(mem)).run(reg, pc, n),
+    "fast_forward": fast_forward,
+    "fused": fused,
+    "profile": lambda reg, mem, pc, n: Profiler(DecodeCache(mem)).run(reg, pc, n),
+    "trace": traced,
+}
+
+
+def timed_out(signum, frame):
+    raise TimeoutError(f"Did not halt within {ENGINE_TIMEOUT}s")
+
+
+def run_case(case: Case, engine: str | None, max_cycles: int | None = None) -> Outcome:
+    """
+    Run case on an engine, or on the reference if engine is None, with
+        max_cycles in place of the case's limit if given. Cases without
+        a limit run on the reference for at most HALT_LIMIT cycles, and
+        on engines for at most ENGINE_TIMEOUT seconds.
+    """
+    reg, mem = case.machine()
+    max_cycles = case.max_cycles if max_cycles is None else max_cycles
+    if engine is None:
+        limit = HALT_LIMIT if max_cycles is None else max_cycles
+        pc, cycles, error = reference(reg, mem, case.pc, limit)
+    else:
+        if max_cycles is None:
+            signal.signal(signal.SIGALRM, timed_out)
+            signal.alarm(ENGINE_TIMEOUT)
+        try:
+            (pc, cycles), error = ENGINES[engine](reg, mem, case.pc, max_cycles), None
+        except ExecutionError as e:
+            pc, cycles, error = e.pc, e.cycles, f"{type(e.cause).__name__}: {e.cause}"
+        except TimeoutError as e:
+            pc, cycles, error = None, None, f"{type(e).__name__}: {e}"
+        finally:
+            signal.alarm(0)
+    return Outcome(pc, cycles, reg, mem, error)
+
+
+def stops(case: Case, expected: Outcome) -> bool:
+    """
+    Whether the engines can be compared with the reference's outcome,
+        which for cases without a limit means the program halted.
+    """
+    return case.max_cycles is not None or expected.pc == 0 or expected.error is not None
+
+
+def diverges(case: Case, engine: str, max_cycles: int | None = None) -> bool:
+    expected = run_case(case, None, max_cycles)
+    if max_cycles is None and not stops(case, expected):
+        return False
+    return expected != run_case(case, engine, max_cycles)
+
+
+def first_divergence(case: Case, engine: str) -> int:
+    """
+    Smallest cycle limit at which the engine's state differs.
+    """
+    lo, hi = 0, case.max_cycles
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if diverges(case, engine, mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def minimize(case: Case, engine: str) -> Case:
+    """
+    Shrink a diverging case while it still diverges: fewer cycles, a
+        shorter program, nops in place of instructions, and zeroed
+        registers and data.
+    """
+    if case.max_cycles is not None:
+        case = case._replace(max_cycles=first_divergence(case, engine))
+    changed = True
+    while changed:
+        changed = False
+        candidates = []
+        for n in range(len(case.prog) - 1, 0, -1):
+            candidates.append(case._replace(prog=case.prog[:n]))
+        if len(case.prog) > 1:
+            candidates.append(case._replace(pc=case.pc + 1, prog=case.prog[1:]))
+        for i, word in enumerate(case.prog):
+            if word != NOP:
+                candidates.append(case._replace(prog=case.prog[:i] + (NOP,) + case.prog[i + 1:]))
+        for i, value in enumerate(case.reg):
+            if value:
+                candidates.append(case._replace(reg=case.reg[:i] + (0,) + case.reg[i + 1:]))
+        for i, value in enumerate(case.data):
+            if value:
+                candidates.append(case._replace(data=case.data[:i] + (0,) + case.data[i + 1:]))
+        for candidate in candidates:
+            if diverges(candidate, engine):
+                case, changed = candidate, True
+                break
+    return case
+
+
+def describe(case: Case, engine: str) -> str:
+    expected, got = run_case(case, None), run_case(case, engine)
+    limit = "no cycle limit" if case.max_cycles is None else f"{case.max_cycles} cycles"
+    lines = [f"seed {case.seed}, {engine}, {limit} from pc {case.pc:#x}",
+             f"\treg {list(case.reg)}"]
+    data = {i: v for i, v in enumerate(case.data) if v}
+    if data:
+        lines.append(f"\tdata {data}")
+    for i, word in enumerate(case.prog):
+        try:
+            text = fields(word).text
+        except ValueError as e:
+            text = f".fill {word}  # {e}"
+        lines.append(f"\t{case.pc + i:#06x}: {text}")
+    for name, a, b in (("pc", expected.pc, got.pc), ("cycles", expected.cycles, got.cycles),
+                       ("reg", expected.reg, got.reg), ("error", expected.error, got.error)):
+        if a != b:
+            lines.append(f"\t{name}: expected {a}, got {b}")
+    addrs = [i for i in range(NUM_WORDS) if expected.mem[i] != got.mem[i]]
+    if addrs:
+        lines.append(f"\tmem differs at {', '.join(f'{a:#06x}' for a in addrs[:8])}")
+    return "\n".join(lines)
+
+
+def fuzz_chunk(args: tuple) -> tuple:
+    """
+    Run cases with seeds [start, start + n) on engines. Returns the
+        cases run and the (seed, engine) pairs that diverged.
+    """
+    start, n, engines = args
+    failures = []
+    for seed in range(start, start + n):
+        case = random_case(seed)
+        expected = run_case(case, None)
+        if not stops(case, expected):
+            continue
+        for engine in engines:
+            if run_case(case, engine) != expected:
+                failures.append((seed, engine))
+    return n, failures
+
+
+def fuzz_engines(cases: int, engines: list, processes: int | None = None,
+                 seed: int = 0, max_failures: int = 5) -> list:
+    """
+    Fuzz engines against the reference across processes. Returns the
+        minimized failing cases as (case, engine).
+    """
+    chunks = [(s, min(CHUNK, seed + cases - s), engines) for s in range(seed, seed + cases, CHUNK)]
+    failures = []
+    done = 0
+    start = time.perf_counter()
+    with Pool(processes) as pool:
+        for n, found in pool.imap_unordered(fuzz_chunk, chunks):
+            done += n
+            failures.extend(found)
+            if len(failures) >= max_failures:
+                pool.terminate()
+                break
+    elapsed = time.perf_counter() - start
+    print(f"{done} cases in {elapsed:.1f}s ({done / elapsed:,.0f} cases/s), "
+          f"{len(failures)} failures", file=sys.stderr)
+    return [(minimize(random_case(s), engine), engine) for s, engine in failures[:max_failures]]
+
+
+def roundtrip() -> list:
+    """
+    Check encode/decode over all 16-bit words. Returns error messages.
+    """
+    errors = []
+    rng = random.Random(0)
+    entries = table()
+    for word, entry in enumerate(entries):
+        if isinstance(entry, str) or entry.opcode == ".fill":
+            continue
+        try:
+            words = encode(entry.text, 0, {})
+        except Exception as e:
+            errors.append(f"{word:#06x} {entry.text}: does not encode: {e}")
+            continue
+        if len(words) != 1 or entries[words[0]] != entry:
+            errors.append(f"{word:#06x} {entry.text}: encodes to {words}")
+            continue
+        if words[0] == word:
+            continue
+        # Bits the disassembly leaves out must not change what it does
+        for _ in range(4):
+            reg = [0] + [rng.randrange(NUM_WORDS) for _ in range(4)]
+            fill = rng.randrange(NUM_WORDS)
+            results = []
+            for w in (word, words[0]):
+                r, m = list(reg), [fill] * NUM_WORDS
+                try:
+                    pc = execute(w, r, m, 100)
+                except Exception as e:
+                    pc = repr(e)
+                results.append((pc, r, m))
+            if results[0] != results[1]:
+                errors.append(f"{word:#06x} {entry.text}: runs differently from {words[0]:#06x}")
+                break
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Differential fuzzing.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    eng = commands.add_parser("engines", help="fuzz engines against execute()")
+    eng.add_argument("-n", "--cases", type=int, default=20_000)
+    eng.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    eng.add_argument("--seed", type=int, default=0)
+    eng.add_argument("--engines", default=",".join(ENGINES),
+                     help="comma-separated engines to check")
+    commands.add_parser("roundtrip", help="check encode/decode on every word")
+    args = parser.parse_args()
+
+    if args.command == "engines":
+        engines = args.engines.split(",")
+        for name in engines:
+            if name not in ENGINES:
+                parser.error(f"Unknown engine '{name}'")
+        failures = fuzz_engines(args.cases, engines, args.jobs, args.seed)
+        for case, engine in failures:
+            print(describe(case, engine))
+        exit(1 if failures else 0)
+    else:
+        start = time.perf_counter()
+        errors = roundtrip()
+        for error in errors[:20]:
+            print(error)
+        print(f"Checked {NUM_WORDS} words in {time.perf_counter() - start:.1f}s, "
+              f"{len(errors)} errors")
+        exit(1 if errors else 0)
@@ -0,0 +1,176 @@
+# Skips counted loops without running every iteration.
+#
+# Branch offsets only encode forwards, so loops jump back with jalr
+# (e.g. "j loop") and leave with a forward bz. A loop is skipped when its
+# fall-through path from the head back to itself:
+#   - has exactly one exit, "bz c, ..." on a counter register c,
+#   - changes c only with one "addi c, c, d" for odd d,
+#   - touches no memory and has no other branches except bn, which is
+#     never taken,
+#   - otherwise only writes registers whose values are the same on every
+#     iteration: each source is r0, a register the loop never writes, or
+#     a register written earlier in the same iteration,
+#   - ends with "jalr 0, x" back to the head.
+# Then every iteration does the same thing apart from the counter, so n
+# iterations can be replaced by running one and setting c directly.
+#
+# A loop with no bz at all (e.g. "wait: j wait") never exits, and is
+# skipped up to the cycle limit when there is one.
+
+from typing import Callable, NamedTuple
+
+from predecode import NUM_REGS, READS, make_op, predecode
+
+# Longest loop body to look at
+MAX_LOOP_LEN = 64
+
+ALU_OPS = ("addi", "nandi", "swb", "nand", "sl", "sr", "add")
+
+
+class Loop(NamedTuple):
+    """
+    A counted loop found by find_loop().
+        head: address of the first instruction
+        length: instructions per iteration, including the jalr
+        counter, step: the register counted and what addi adds to it, or
+            None and 0 for a loop that never exits
+        exit_after_step: whether bz sees the counter after it is stepped
+        writes: other registers the loop writes
+        target: register jalr jumps back through
+        words: the loop's instruction words, to notice if it is rewritten
+        ops: handlers for one iteration, in order
+    """
+    head: int
+    length: int
+    counter: int | None
+    step: int
+    exit_after_step: bool
+    writes: tuple
+    target: int
+    words: tuple
+    ops: tuple
+
+    def iterations(self, c: int) -> int | None:
+        """
+        Full iterations that run before bz exits, starting at the head
+            with the counter equal to c. None if it never exits.
+        """
+        if self.counter is None:
+            return None
+        # Iteration i exits if c + (i + e) * step == 0 (mod 2^16)
+        e = 1 if self.exit_after_step else 0
+        return (-c * pow(self.step, -1, 1 << 16) - e) % (1 << 16)
+
+    def skip(self, reg: list, mem, limit: int | None = None) -> int:
+        """
+        Run as many whole iterations as possible (and at most limit
+            cycles) at once. Returns the cycles skipped.
+        """
+        n = self.iterations(reg[self.counter] if self.counter is not None else 0)
+        if limit is not None:
+            n = limit // self.length if n is None else min(n, limit // self.length)
+        if not n:
+            return 0
+        if self.target not in self.writes and reg[self.target] != self.head:
+            return 0
+        if any(mem[self.head + i] != word for i, word in enumerate(self.words)):
+            return 0
+
+        # Run one iteration to get the values every iteration writes
+        scratch = list(reg)
+        pc = self.head
+        for op in self.ops:
+            pc = op(scratch, mem, pc)
+        if pc != self.head:
+            # Jumps somewhere else at run time, so it is not a loop
+            return 0
+
+        for r in self.writes:
+            reg[r] = scratch[r]
+        if self.counter is not None:
+            reg[self.counter] = (reg[self.counter] + n * self.step) & 0xFFFF
+        return n * self.length
+
+
+def find_loop(mem, head: int) -> Loop | None:
+    """
+    The counted loop starting at head, or None if it is not one.
+    """
+    path = []
+    words = []
+    pc = head
+    while True:
+        if not 0 <= pc < len(mem) or len(path) >= MAX_LOOP_LEN:
+            return None
+        d = predecode(mem[pc])
+        regs = {"s": d.rs, "d": d.rd, "o": d.ro}
+        if d.rd >= NUM_REGS or any(regs[r] >= NUM_REGS for r in READS.get(d.name, "")):
+            return None
+        if d.name in ("bp", "lw", "sw"):
+            return None
+        path.append(d)
+        words.append(mem[pc])
+        pc += 1
+        if d.name == "jalr":
+            break
+
+    last = path[-1]
+    if last.rd != 0:
+        return None
+    exits = [i for i, d in enumerate(path) if d.name == "bz"]
+    if not exits:
+        exit_at = step_at = counter = None
+    else:
+        if len(exits) != 1 or path[exits[0]].imm == 1:
+            return None
+        exit_at = exits[0]
+        counter = path[exit_at].rs
+        if counter == 0:
+            return None
+
+        steps = [i for i, d in enumerate(path)
+                 if d.name == "addi" and d.rd == counter and d.rs == counter]
+        if len(steps) != 1 or path[steps[0]].imm % 2 == 0:
+            return None
+        step_at = steps[0]
+
+    written = {d.rd for d in path if d.name in ALU_OPS and d.rd != 0}
+    defined = set()
+    for i, d in enumerate(path):
+        if i in (exit_at, step_at):
+            continue
+        if d.name not in ALU_OPS and d.name not in ("bn", "jalr", None):
+            return None
+        if d.name == "bn":
+            continue
+        regs = {"s": d.rs, "d": d.rd, "o": d.ro}
+        for r in (regs[x] for x in READS.get(d.name, "")):
+            # Sources must hold the same value on every iteration
+            if r == counter or (r in written and r not in defined):
+                return None
+        if d.name in ALU_OPS and d.rd != 0:
+            if d.rd == counter:
+                return None
+            defined.add(d.rd)
+
+    ops = tuple(make_op(d) for d in path)
+    step = path[step_at].imm if counter is not None else 0
+    return Loop(head, len(path), counter, step, counter is not None and step_at < exit_at,
+                tuple(sorted(written - {counter})), last.rs, tuple(words), ops)
+
+
+def loop_op(loop: Loop, op: Callable, cache) -> Callable:
+    """
+    Handler for a loop head that skips whole iterations before running
+        the head instruction op, adding the cycles skipped to
+        cache.skipped. Skipping is limited by cache.budget.
+    """
+    def head(reg, mem, pc):
+        budget = cache.budget
+        if budget is None or budget > 0:
+            skipped = loop.skip(reg, mem, budget)
+            cache.skipped += skipped
+            if budget is not None:
+                cache.budget -= skipped
+        return op(reg, mem, pc)
+    return head
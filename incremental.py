@@ -0,0 +1,151 @@
+# Re-assembles edited programs without redoing unchanged lines.
+#
+# Tools that regenerate a program with small edits can reload it with
+#   asm = IncrementalAssembler(interp)
+#   asm.load(prog)      # first load encodes everything
+#   asm.load(edited)    # only re-encodes what the edit affects
+# Each instruction's encoding is kept along with the label values it
+# used. Instructions that use no label encode the same anywhere, so they
+# are reused wherever they move to; the others are reused unless they
+# moved or a label they use moved. Only memory words whose
+# value changed are written, and only their decoded handlers and blocks
+# are dropped, so the engines' caches stay warm.
+
+from typing import NamedTuple
+
+import preprocess
+from encode import encode_words, width
+from interpreter import Interpreter, split_lines
+
+
+class Reload(NamedTuple):
+    """
+    Outcome of IncrementalAssembler.load().
+        changed: addresses whose word changed, in order
+        encoded: instructions encoded, the rest were reused
+        prog_len: words in the new program
+    """
+    changed: list
+    encoded: int
+    prog_len: int
+
+
+class IncrementalAssembler:
+    """
+    Loads programs into interp like Interpreter.load_prog (without the
+        peephole optimizer), reusing the work done for the previous
+        program loaded through it.
+    """
+    def __init__(self, interp: Interpreter):
+        self.interp = interp
+        # inst, or (inst, addr) if it uses labels -> (words, ((label, value),
+        # ...) used to encode it)
+        self.encoded = {}
+
+    def load(self, prog: str, base_dir: str | None = None) -> Reload:
+        """
+        Assemble prog and patch it into memory at interp.PROG_START.
+            Words left over from a longer previous program are zeroed.
+            base_dir: directory .include paths are relative to, by default
+                the working directory (see preprocess.py)
+        Memory is only written once the whole program has assembled.
+        """
+        interp = self.interp
+        if preprocess.has_directives(prog):
+            lines = preprocess.expand(prog, base_dir)
+        else:
+            lines = prog.strip().split("\n")
+        insts, pending_labels = split_lines(lines)
+
+        # FIRST PASS: get label locations
+        labels = {}
+        cur_addr = interp.PROG_START
+        addrs = []
+        for line_no, inst_labels, inst in insts:
+            for label in inst_labels:
+                labels[label] = cur_addr
+            addrs.append(cur_addr)
+            try:
+                cur_addr += width(inst)
+            except Exception as e:
+                print(f"Error loading instruction '{inst}': {e}")
+                raise e
+        for label in pending_labels:
+            labels[label] = cur_addr
+
+        # SECOND PASS: encode what cannot be reused
+        encoded = {}
+        words = []
+        line_of = {}
+        n_encoded = 0
+        for (line_no, _, inst), addr in zip(insts, addrs):
+            key = inst
+            cached = self.encoded.get(key)
+            if cached is None:
+                key = (inst, addr)
+                cached = self.encoded.get(key)
+            if cached is None or any(labels.get(label) != value for label, value in cached[1]):
+                refs = []
+                try:
+                    inst_words = encode_words(inst, addr, labels, refs)
+                except Exception as e:
+                    print(f"Error loading at line {line_no+1}: {inst}\n\t{e}")
+                    raise e
+                cached = (inst_words, tuple((label, labels[label]) for label in set(refs)))
+                key = (inst, addr) if refs else inst
+                n_encoded += 1
+            encoded[key] = cached
+            for k in range(len(cached[0])):
+                line_of[addr + k] = line_no
+            words.extend(cached[0])
+
+        # Patch memory where it differs
+        start = interp.PROG_START
+        mem = interp.mem
+        old_len = interp.prog_len
+        words.extend([0] * (old_len - len(words)))
+        changed = []
+        for addr, word in enumerate(words, start):
+            if mem[addr] != word:
+                mem[addr] = word
+                changed.append(addr)
+        if interp._decoded is not None:
+            for addr in changed:
+                interp._decoded.invalidate(addr)
+
+        self.encoded = encoded
+        interp.labels = labels
+        interp.line_of = line_of
+        interp.source_lines = lines
+        interp.opt_report = None
+        interp.prog_len = cur_addr - start
+        return Reload(changed, n_encoded, interp.prog_len)
+
+
+if __name__ == "__main__":
+    # Compare reloading a program after a one-line edit with load_prog
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print(f"Usage: incremental.py <script>")
+        exit(1)
+    with open(sys.argv[1]) as fin:
+        prog = fin.read()
+    lines = prog.strip().split("\n")
+    edited = "\n".join(lines[:len(lines) // 2] + ["    nop"] + lines[len(lines) // 2:])
+
+    start = time.perf_counter()
+    Interpreter().load_prog(edited)
+    full = time.perf_counter() - start
+
+    interp = Interpreter()
+    asm = IncrementalAssembler(interp)
+    asm.load(prog)
+    start = time.perf_counter()
+    result = asm.load(edited)
+    incremental = time.perf_counter() - start
+
+    print(f"load_prog:   {full * 1000:8.2f} ms")
+    print(f"incremental: {incremental * 1000:8.2f} ms "
+          f"({result.encoded} encoded, {len(result.changed)} words changed)")
@@ -1,28 +1,215 @@
+import asyncio
+import copy
+import os
 import re
 import sys
+from array import array
+from functools import lru_cache
 from pprint import pprint
+from typing import Callable, NamedTuple
 
-from encode import encode
-from execute import execute
+from encode import MAX_ENCODED, encode, width
+from blocks import BlockCache
+from execute import ExecutionError
+import objfile
+import peephole
+import regalloc
+import relax as relaxation
+import preprocess
+from memory import copy_memory, make_memory, view
+from mmio import Device, DeviceMap
+from predecode import DecodeCache
+from profiler import Profiler
+from tracefile import TraceWriter
 
-from decode import decode
+from decode import decode, disassemble
 from utils.reg_names import REG_NAMES, VREG_NAMES
 
+# Instructions run_async() executes between yields to the event loop
+SLICE_CYCLES = 10_000
+
+PURE_LABEL = re.compile(r"^(\w+):$")
+LABELED_INST = re.compile(r"(?:(\w+):)?\s*(.+)")
+VALID_LABEL = re.compile(r"^[\w\d_]+$")
+
+# Opcodes and register names are illegal labels
+RESERVED_LABELS = frozenset(
+    ["addi", "nandi",
+     "swb", "sl", "sr", "nand", "add",
+     "jalr",
+     "bn", "bz", "bp",
+     "lw", "sw",
+     "jal", "halt", "nop", "li"]
+    + [name for names in REG_NAMES + VREG_NAMES if names != None for name in names])
+
+
+def is_valid_label(label: str) -> bool:
+    """
+    Labels are words that are not opcodes or register names.
+    """
+    return label not in RESERVED_LABELS and VALID_LABEL.match(label) is not None
+
+
+@lru_cache(maxsize=MAX_ENCODED)
+def parse_line(line: str) -> tuple:
+    """
+    Split a source line into its label (or None) and instruction (or
+        None), e.g. "loop: addi 1, 1, -1" into ("loop", "addi 1, 1, -1").
+    """
+    line = line.split("#", 1)[0].strip()
+    if len(line) == 0:
+        return None, None
+
+    # Line contains single label, e.g. "loop:"
+    pure_label_match = PURE_LABEL.match(line)
+    if pure_label_match:
+        label, inst = pure_label_match[1], None
+    else:
+        # Line is of the form [label:] opcode arg1, arg2[, arg3]
+        label, inst = LABELED_INST.match(line).groups()
+    if label is not None and not is_valid_label(label):
+        raise NameError(f"Label '{label}' is not valid")
+    return label, inst
+
+
+def split_lines(lines: list) -> tuple:
+    """
+    Instructions in lines as (line_no, labels, inst), with the labels
+        that point at each one, and the labels after the last instruction.
+    """
+    insts = []
+    pending_labels = []
+    for line_no, line in enumerate(lines):
+        label, inst = parse_line(line)
+        if label is not None:
+            pending_labels.append(label)
+        if inst is not None:
+            insts.append((line_no, pending_labels, inst))
+            pending_labels = []
+    return insts, pending_labels
+
+
+class RunResult(NamedTuple):
+    """
+    Outcome of Interpreter.run().
+        cycles: number of instructions executed
+        pc: final program counter (0 if the program halted)
+        reg: copy of the final registers
+        halted: False if the run stopped because of max_cycles
+    """
+    cycles: int
+    pc: int
+    reg: list
+    halted: bool
+
+
+class Snapshot(NamedTuple):
+    """
+    Machine state saved by Interpreter.snapshot().
+        pc: program counter
+        reg: registers
+        mem: memory, in the interpreter's storage
+    """
+    pc: int
+    reg: list
+    mem: object
+
+
 class Interpreter:
     def __init__(self,
-                 PROG_START=0x1000):
+                 PROG_START=0x1000,
+                 storage="list"):
         """
         Create new Interpreter. Params:
             - PROG_START: location in memory where instructions live
+            - storage: "list", "array", "bytearray", "numpy" or "paged";
+                "array", "bytearray" and "numpy" keep memory in a compact
+                16-bit buffer, "paged" makes snapshot() and fork()
+                copy-on-write (see memory.py)
         """
         # Core components
         self.pc = PROG_START
+        # Registers stay a list: there are only 5, and list indexing is
+        # faster than array indexing in the dispatch loop
         self.reg = [0, 0, 0, 0, 0]
-        self.mem = [0] * (1<<16)
+        self.mem = make_memory(storage)
         self.labels = {}
+        self.prog_len = 0
+        # Source line of each word loaded by load_prog
+        self.line_of = {}
+        self.source_lines = []
+        self.opt_report = None
+        self.alloc_report = None
+        self.relax_report = None
+        self.link_report = None
+        # Memory-mapped devices, see attach()
+        self.devices = DeviceMap()
+
+        # Execution engines are created on first use, so idle machines
+        # only cost their memory
+        self._decoded = None
+        self._blocks = None
+        self._profiler = None
 
         # Config params
         self.PROG_START = PROG_START
+        self.storage = storage
+
+    @property
+    def decoded(self) -> DecodeCache:
+        """
+        Per-address cache of decoded instructions.
+        """
+        if self._decoded is None:
+            self._decoded = DecodeCache(self.mem, self.devices.ports)
+        return self._decoded
+
+    @property
+    def blocks(self) -> BlockCache:
+        """
+        Cache of translated basic blocks.
+        """
+        if self._blocks is None:
+            self._blocks = BlockCache(self.decoded)
+        return self._blocks
+
+    @property
+    def profiler(self) -> Profiler:
+        """
+        Counters collected by runs with engine="profile".
+        """
+        if self._profiler is None:
+            self._profiler = Profiler(self.decoded)
+        return self._profiler
+
+    def mem_view(self) -> memoryview:
+        """
+        Zero-copy view of memory as 16-bit words.
+            Only available with compact storage.
+        """
+        return view(self.mem)
+
+    def attach(self, device: Device, addr: int):
+        """
+        Map a device (see mmio.py) into memory at addr, which must be in
+            the top 16 words. Instructions decoded before are re-decoded.
+        """
+        self.devices.attach(device, addr)
+        self._remap()
+
+    def detach(self, addr: int) -> Device:
+        """
+        Unmap the device attached at addr and return it.
+        """
+        device = self.devices.detach(addr)
+        self._remap()
+        return device
+
+    def _remap(self):
+        if self._decoded is not None:
+            # Handlers are shared by instruction word, so drop them too
+            self._decoded.ops.clear()
+            self._decoded.invalidate()
 
     def dump_state(self):
         """
@@ -41,128 +228,311 @@ class Interpreter:
         """
         Print contents of program.
         """
-        cur_addr = self.PROG_START
-        while self.mem[cur_addr] > 0:
-            print(hex(cur_addr), "\t", bin(self.mem[cur_addr])[2:].zfill(16), "\t", decode(self.mem[cur_addr]))
-            cur_addr += 1
+        end = self.PROG_START
+        while self.mem[end] > 0:
+            end += 1
+        lines = disassemble(self.mem, self.PROG_START, end)
+        for addr, text in enumerate(lines, self.PROG_START):
+            print(hex(addr), "\t", bin(self.mem[addr])[2:].zfill(16), "\t", text)
     
-    def run(self):
+    def snapshot(self) -> Snapshot:
+        """
+        Save pc, registers and memory. With paged storage, memory pages
+            are shared with the snapshot until either side writes them.
+        """
+        return Snapshot(self.pc, list(self.reg), copy_memory(self.mem))
+
+    def restore(self, snap: Snapshot):
+        """
+        Return to a snapshot. The snapshot is left intact, so it can be
+            restored again.
+        """
+        self.pc = snap.pc
+        self.reg = list(snap.reg)
+        self.mem = copy_memory(snap.mem)
+        self._decoded = None
+        self._blocks = None
+        self._profiler = None
+
+    def fork(self) -> "Interpreter":
+        """
+        Independent copy of this machine, e.g. to explore one
+            continuation from a checkpoint with run(resume=True).
+        Raises ValueError if devices are attached, since their state
+        cannot be copied; the child starts with none.
+        """
+        if self.devices.devices:
+            raise ValueError("Cannot fork a machine with devices attached")
+        child = copy.copy(self)
+        child.reg = list(self.reg)
+        child.mem = copy_memory(self.mem)
+        child.labels = dict(self.labels)
+        child.line_of = dict(self.line_of)
+        child.source_lines = list(self.source_lines)
+        for report in ("opt_report", "alloc_report", "relax_report", "link_report"):
+            setattr(child, report, copy.deepcopy(getattr(self, report)))
+        child.devices = DeviceMap()
+        child._decoded = None
+        child._blocks = None
+        child._profiler = None
+        return child
+
+    def run(self, trace: bool | str = True, max_cycles: int | None = None,
+            engine: str = "predecode", resume: bool = False,
+            fast_forward: bool = True, fuse: bool = True, flush: bool = True) -> RunResult:
         """
         Runs the program.
+            trace: print the state before every instruction, or write a
+                binary trace to this path (see tracefile.py)
+            max_cycles: stop after this many instructions, even if the
+                program has not halted
+            engine: "predecode" to dispatch one instruction at a time,
+                "blocks" to run translated basic blocks, or "profile" to
+                count executions in self.profiler (untraced only)
+            resume: continue from self.pc instead of PROG_START, e.g.
+                after a run that stopped at max_cycles
+            fast_forward: skip counted loops instead of running every
+                iteration (see idle.py). Never done when tracing or
+                profiling, which need every instruction.
+            fuse: run common expanded sequences with one handler each (see
+                fusion.py), with the predecode engine only. Dispatches
+                saved are counted in self.decoded.fused.
+            flush: hand buffered device output to the host when the run
+                ends (see mmio.py)
+        Raises ExecutionError if the program crashes.
         """
-        self.pc = self.PROG_START
-        cycles = 0
-        while self.pc != 0:
-            self.execute_step()
-            cycles += 1
-        self.dump_state()
-        return cycles
+        if not resume:
+            self.pc = self.PROG_START
+        self.decoded.set_fast_forward(fast_forward and not trace and engine != "profile")
+        self.decoded.set_fuse(fuse and not trace and engine == "predecode")
+        try:
+            if isinstance(trace, str):
+                try:
+                    with TraceWriter(self.decoded, trace) as writer:
+                        self.pc, cycles = writer.run(self.reg, self.pc, max_cycles)
+                except ExecutionError as e:
+                    self.pc = e.pc
+                    raise
+            elif trace:
+                cycles = 0
+                while self.pc != 0 and (max_cycles is None or cycles < max_cycles):
+                    self.execute_step()
+                    cycles += 1
+                self.dump_state()
+            else:
+                try:
+                    engines = {"predecode": lambda: self.decoded, "blocks": lambda: self.blocks,
+                               "profile": lambda: self.profiler}
+                    if engine not in engines:
+                        raise ValueError(f"Unknown engine '{engine}'")
+                    self.pc, cycles = engines[engine]().run(self.reg, self.pc, max_cycles)
+                except ExecutionError as e:
+                    self.pc = e.pc
+                    raise
+        finally:
+            # Output devices buffer until the run ends
+            if flush:
+                self.devices.flush()
+        return RunResult(cycles, self.pc, list(self.reg), self.pc == 0)
     
+    async def run_async(self, max_cycles: int | None = None, engine: str = "predecode",
+                        resume: bool = False, slice_cycles: int = SLICE_CYCLES,
+                        on_slice: Callable | None = None) -> RunResult:
+        """
+        Runs the program like run(trace=False), but slice_cycles
+            instructions at a time, yielding to the event loop in between.
+            Counted loops are skipped up to the end of the slice.
+            on_slice: called with the cycles each slice ran
+        Device output is handed to the host before each yield and when
+            the run ends.
+        Cancelling the task (e.g. with asyncio.wait_for) stops it between
+        slices with self.pc where it stopped, so a later call with
+        resume=True carries on from there.
+        Raises ExecutionError if the program crashes.
+        """
+        if not resume:
+            self.pc = self.PROG_START
+        cycles = 0
+        try:
+            while self.pc != 0 and (max_cycles is None or cycles < max_cycles):
+                n = slice_cycles if max_cycles is None else min(slice_cycles, max_cycles - cycles)
+                try:
+                    done = self.run(trace=False, max_cycles=n, engine=engine, resume=True,
+                                    flush=False).cycles
+                except ExecutionError as e:
+                    if on_slice is not None:
+                        on_slice(e.cycles)
+                    raise
+                cycles += done
+                if on_slice is not None:
+                    on_slice(done)
+                if self.pc != 0 and (max_cycles is None or cycles < max_cycles):
+                    self.devices.flush()
+                    await asyncio.sleep(0)
+        finally:
+            self.devices.flush()
+        return RunResult(cycles, self.pc, list(self.reg), self.pc == 0)
+
     def execute_step(self):
         """
         Steps the program forward.
         """
+        self.dump_state()
         try:
-            self.dump_state()
-            self.pc = execute(
-                self.mem[self.pc], self.reg, self.mem, self.pc)
+            self.pc = self.decoded.step(self.reg, self.pc)
         except Exception as e:
-            print(f"Execution crashed while pc={self.pc}: {e}")
-            exit(1)
+            raise ExecutionError(self.pc, e) from e
 
-    def load_prog(self, prog: str):
+    def load_prog(self, prog: str, optimize: bool = False, allocate: bool = False,
+                  relax: bool = False, base_dir: str | None = None):
         """
         STRING PARSING !!
         Loads a program into memory at address self.PROG_START.
+            optimize: run the peephole optimizer over the expanded program
+                (see peephole.py); its report is kept in self.opt_report
+            allocate: keep virtual registers in free physical registers
+                (see regalloc.py); its report is kept in self.alloc_report
+            relax: give label-dependent li, j and jal their shortest form
+                and turn branches that cannot reach their label into jumps
+                (see relax.py); its report is kept in self.relax_report
+            base_dir: directory .include paths are relative to, by default
+                the working directory (see preprocess.py)
         First pass:
+            - Split lines into labels and instructions
             - Convert pseudoinstructions to real instructions
             - Get locations of labels
         """
-        lines = prog.strip().split("\n")
-        insts = []
-
-        # Opcodes and register names are illegal labels
-        def is_valid_label(label: str) -> bool:
-            opcodes = ["addi", "nandi",
-                       "swb", "sl", "sr", "nand", "add",
-                       "jalr",
-                       "bn", "bz", "bp",
-                       "lw", "sw",
-                       "jal", "halt", "nop", "li"]
-            if label in opcodes:
-                return False
-            for names in REG_NAMES + VREG_NAMES:
-                if names != None and label in names:
-                    return False
-            return re.match(r"^[\w\d_]+$", label) is not None
-
-        # FIRST PASS: convert pseudoinstructions, get label locations
+        if preprocess.has_directives(prog):
+            lines = preprocess.expand(prog, base_dir)
+        else:
+            lines = prog.strip().split("\n")
+        self.source_lines = lines
+        insts, pending_labels = split_lines(lines)
+
+        if allocate:
+            insts, pending_labels, self.alloc_report = regalloc.allocate(insts, pending_labels)
+        if optimize:
+            insts, self.opt_report = peephole.optimize(insts)
+        if relax:
+            insts, self.relax_report = relaxation.relax(insts, pending_labels, self.PROG_START)
+
+        # FIRST PASS: get label locations
         cur_addr = self.PROG_START
-        for line_no, line in enumerate(lines):
-            line = line.split("#", 1)[0].strip()
-            if len(line) == 0:
-                continue
-            
-            # Line contains single label, e.g. "loop:"
-            pure_label_match = re.findall(r"^(\w+):$", line)
-            if pure_label_match:
-                label = pure_label_match[0]
-                if not is_valid_label(label):
-                    raise NameError(f"Label '{label}' is not valid")
+        addrs = []
+        for line_no, labels, inst in insts:
+            for label in labels:
                 self.labels[label] = cur_addr
-            
-            else:
-                # Line is of the form [label:] opcode arg1, arg2[, arg3]
-                inst_match = re.findall(r"(?:(\w+):)?\s*(.+)", line)[0]
-                label, inst = inst_match
-                if label != "":
-                    if not is_valid_label(label):
-                        raise NameError(f"Label '{label}' is not valid")
-                    self.labels[label] = cur_addr
-                
-                # Update list of instructions
-                # Line number is tracked for error handling
-                insts.append((line_no, cur_addr, inst))
-
-                # Some pseudoinstructions are multiple words.
-                # This is inefficient but makes for more concise code!
-                try:
-                    inst_width = len(encode(inst, cur_addr, None))
-                except Exception as e:
-                    print(f"Error loading instruction '{inst}': {e}")
-                    raise e
-                    exit(1)
-                    
-                cur_addr += inst_width
+            addrs.append(cur_addr)
+
+            # Some pseudoinstructions are multiple words
+            try:
+                cur_addr += width(inst)
+            except Exception as e:
+                print(f"Error loading instruction '{inst}': {e}")
+                raise e
+        for label in pending_labels:
+            self.labels[label] = cur_addr
 
         # SECOND PASS: write instructions to memory, etc.
         cur_addr = self.PROG_START
-        for line_no, addr, inst in insts:
+        for (line_no, _, inst), addr in zip(insts, addrs):
             try:
                 for encoding in encode(inst, addr, self.labels):
                     self.mem[cur_addr] = encoding
+                    self.line_of[cur_addr] = line_no
                     cur_addr += 1
             
             except Exception as e:
                 print(f"Error loading at line {line_no+1}: {inst}\n\t{e}")
                 raise e
-            
-        return cur_addr - self.PROG_START
+
+        # Memory was written directly, so drop stale decodings
+        if self._decoded is not None:
+            self._decoded.invalidate()
+
+        self.prog_len = cur_addr - self.PROG_START
+        return self.prog_len
+
+    def object(self) -> objfile.ObjectFile:
+        """
+        The loaded program and its labels as an object file.
+        """
+        start = self.PROG_START
+        words = array("H", self.mem[start:start + self.prog_len])
+        return objfile.ObjectFile(start, start, dict(self.labels), words)
+
+    def save_object(self, path: str):
+        """
+        Write the loaded program and its labels to an object file
+            (see objfile.py), so later runs can skip assembly.
+        """
+        objfile.write(path, self.object())
+
+    def load_object(self, obj: "str | objfile.ObjectFile") -> int:
+        """
+        Load a program written by save_object with a single copy into
+            memory. obj is a path or an already read ObjectFile.
+        """
+        if isinstance(obj, str):
+            obj = objfile.read(obj)
+        if obj.load_addr != self.PROG_START or obj.entry != self.PROG_START:
+            raise ValueError(f"Object is linked at {obj.load_addr:#x}, "
+                             f"but programs start at {self.PROG_START:#x}")
+
+        start = self.PROG_START
+        if isinstance(self.mem, list):
+            self.mem[start:start + len(obj.words)] = obj.words.tolist()
+        else:
+            self.mem[start:start + len(obj.words)] = obj.words
+        self.labels.update(obj.symbols)
+        # Object files carry no source
+        self.line_of = {}
+
+        if self._decoded is not None:
+            self._decoded.invalidate()
+
+        self.prog_len = len(obj.words)
+        return self.prog_len
+
+    def load_linked(self, path: str, cache_dir: str | None = None) -> int:
+        """
+        Load a program and the files it includes by linking modules, only
+            assembling files that are not in the module cache (see
+            linker.py). The report is kept in self.link_report.
+        """
+        # linker.py imports this module
+        import linker
+
+        cache = linker.ModuleCache(cache_dir or linker.DEFAULT_CACHE_DIR)
+        obj, self.link_report = linker.build(path, cache, self.PROG_START)
+        return self.load_object(obj)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(f"Usage: interpreter.py <script>")
+    args = [arg for arg in sys.argv[1:] if arg not in ("-q", "--quiet")]
+    quiet = len(args) < len(sys.argv) - 1
+    if len(args) < 1:
+        print(f"Usage: interpreter.py [-q] <script>")
         exit(1)
 
-    with open(sys.argv[1]) as fin:
-        prog = fin.read()
+    with open(args[0], "rb") as fin:
+        data = fin.read()
     
     interp = Interpreter()
     print(f"Loading program...")
-    prog_len = interp.load_prog(prog)
+    if objfile.is_object(data):
+        prog_len = interp.load_object(objfile.from_bytes(data))
+    else:
+        prog_len = interp.load_prog(data.decode(), base_dir=os.path.dirname(os.path.abspath(args[0])))
     print(f"Loaded program of {prog_len} words.")
-    interp.dump_program()
+    if not quiet:
+        interp.dump_program()
 
-    cycles = interp.run()
-    print(f"Finished running in {cycles} cycles.")
+    try:
+        result = interp.run(trace=not quiet)
+    except ExecutionError as e:
+        print(e)
+        exit(1)
+    if quiet:
+        print("regs:", ", ".join([f"{str(x).rjust(6)}" for x in result.reg]))
+    print(f"Finished running in {result.cycles} cycles.")
@@ -0,0 +1,213 @@
+# Assembles each file of a program separately and links them.
+#
+# Every file (see preprocess.py) is assembled on its own into an
+# objfile.Module at offset 0. Instructions that use a label cannot be
+# encoded before the link step knows where everything is, so their words
+# are left as zeros and the instructions kept as relocations; everything
+# else is encoded once. Labels are shared by all files, so defining one in
+# two files is an error.
+#
+# Modules are cached on disk, named by a hash of the file's expanded
+# source, so building a program again only assembles the files that
+# changed. Linking places the modules one after another from PROG_START,
+# in the same order as Interpreter.load_prog places included files, and
+# encodes the relocations. Labels in relocations always take the longest
+# form, as in load_prog, so placing a module never changes its size.
+#
+# Usage:
+#   obj, report = build("prog.S")
+#   Interpreter.load_linked("prog.S")
+#   python linker.py <script> [-o output.o16] [--cache dir]
+
+import hashlib
+import os
+from array import array
+from typing import NamedTuple
+
+import objfile
+import preprocess
+from encode import MEM_ARG, encode, parse, width
+from interpreter import split_lines
+from utils.literals import parse_literal
+from utils.reg_names import REG_IDX, is_vreg
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "risc16")
+
+
+class BuildReport(NamedTuple):
+    """
+    What build() did.
+        modules: files linked
+        assembled: modules assembled, rather than read from the cache
+        words: program size in words
+        relocs: instructions encoded while linking
+    """
+    modules: int
+    assembled: int
+    words: int
+    relocs: int
+
+
+def label_refs(inst: str) -> list:
+    """
+    Labels an instruction uses.
+    """
+    refs = []
+    for arg in parse(inst).args:
+        found = MEM_ARG.findall(arg)
+        if found:
+            arg = found[0][0]
+        if parse_literal(arg) is None and arg not in REG_IDX and not is_vreg(arg):
+            refs.append(arg)
+    return refs
+
+
+def assemble(lines: list) -> objfile.Module:
+    """
+    Assemble source lines into a module.
+    """
+    insts, pending_labels = split_lines(lines)
+    symbols = {}
+    offset = 0
+    for _, labels, inst in insts:
+        for label in labels:
+            if label in symbols:
+                raise NameError(f"Label '{label}' is defined twice")
+            symbols[label] = offset
+        offset += width(inst)
+    for label in pending_labels:
+        if label in symbols:
+            raise NameError(f"Label '{label}' is defined twice")
+        symbols[label] = offset
+
+    words = array("H")
+    relocs = []
+    used = set()
+    for line_no, _, inst in insts:
+        try:
+            refs = label_refs(inst)
+            if refs:
+                used.update(refs)
+                relocs.append((len(words), line_no, inst))
+                words.extend([0] * width(inst))
+            else:
+                words.extend(encode(inst, len(words), {}))
+        except Exception as e:
+            print(f"Error assembling line {line_no+1}: {inst}\n\t{e}")
+            raise e
+    undefined = tuple(sorted(used - symbols.keys()))
+    return objfile.Module(symbols, tuple(relocs), undefined, words)
+
+
+class ModuleCache:
+    """
+    Assembled modules on disk, by a hash of their source.
+    """
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, lines: list) -> str:
+        h = hashlib.sha256(f"{objfile.MODULE_VERSION}\n".encode())
+        h.update("\n".join(lines).encode())
+        return os.path.join(self.directory, h.hexdigest()[:32] + objfile.MODULE_SUFFIX)
+
+    def get(self, lines: list) -> tuple:
+        """
+        The module for source lines, assembling it if it is not cached.
+            Returns (module, whether it was assembled).
+        """
+        path = self.path(lines)
+        try:
+            with open(path, "rb") as fin:
+                module = objfile.module_from_bytes(fin.read())
+            self.hits += 1
+            return module, False
+        except (OSError, ValueError):
+            pass
+
+        module = assemble(lines)
+        self.misses += 1
+        # Written under another name first, so readers never see half a file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fout:
+            fout.write(objfile.module_to_bytes(module))
+        os.replace(tmp, path)
+        return module, True
+
+
+def link(modules: list, start: int = 0x1000) -> objfile.ObjectFile:
+    """
+    Place (name, Module) pairs from start in order and encode their
+        relocations. Execution starts at the first module.
+    """
+    symbols = {}
+    defined_in = {}
+    bases = []
+    addr = start
+    for name, module in modules:
+        for label, offset in module.symbols.items():
+            if label in symbols:
+                raise NameError(f"Label '{label}' is defined in both "
+                                f"{defined_in[label]} and {name}")
+            symbols[label] = addr + offset
+            defined_in[label] = name
+        bases.append(addr)
+        addr += len(module.words)
+    if addr > 0x10000:
+        raise MemoryError(f"Program of {addr - start} words does not fit from {start:#x}")
+
+    words = array("H")
+    for (name, module), base in zip(modules, bases):
+        for label in module.undefined:
+            if label not in symbols:
+                raise NameError(f"Label '{label}' used in {name} is not defined")
+        placed = array("H", module.words)
+        for offset, line_no, inst in module.relocs:
+            try:
+                encoded = encode(inst, base + offset, symbols)
+            except Exception as e:
+                print(f"Error linking {name} at line {line_no+1}: {inst}\n\t{e}")
+                raise e
+            placed[offset:offset + len(encoded)] = array("H", encoded)
+        words.extend(placed)
+    return objfile.ObjectFile(start, start, symbols, words)
+
+
+def build(path: str, cache: ModuleCache | None = None, start: int = 0x1000) -> tuple:
+    """
+    Assemble (or read from cache) and link a program and the files it
+        includes. Returns (ObjectFile, BuildReport).
+    """
+    cache = cache or ModuleCache()
+    modules = []
+    assembled = 0
+    for source in preprocess.read_sources(path=path):
+        module, fresh = cache.get(source.lines)
+        assembled += fresh
+        modules.append((os.path.relpath(source.path), module))
+    obj = link(modules, start)
+    report = BuildReport(len(modules), assembled, len(obj.words),
+                         sum(len(module.relocs) for _, module in modules))
+    return obj, report
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Assemble and link a program.")
+    parser.add_argument("script")
+    parser.add_argument("-o", "--output", help="object file to write")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR, help="module cache directory")
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    obj, report = build(args.script, ModuleCache(args.cache))
+    elapsed = time.perf_counter() - begin
+    out = args.output or os.path.splitext(args.script)[0] + objfile.SUFFIX
+    objfile.write(out, obj)
+    print(f"Linked {report.modules} modules ({report.assembled} assembled), "
+          f"{report.words} words, {report.relocs} relocations in {elapsed:.3f}s -> {out}")
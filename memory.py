@@ -0,0 +1,139 @@
+# Storage backends for memory.
+
+from array import array
+
+MEM_SIZE = 1 << 16
+STORAGES = ("list", "array", "bytearray", "numpy", "paged")
+
+# Pages of PagedMemory
+PAGE_BITS = 8
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+
+def make_memory(storage: str = "list", size: int = MEM_SIZE):
+    """
+    Allocate zeroed memory of size 16-bit words.
+        storage: "list" for a plain list of ints, "array" for array('H'),
+            "bytearray" for a bytearray viewed as 16-bit words, "numpy"
+            for a uint16 array accessed through a memoryview, or "paged"
+            for copy-on-write pages (see PagedMemory)
+
+    All backends index like a list (including negative indices) and
+    return plain ints. The compact backends take 2 bytes per word instead
+    of a pointer per word, and raise OverflowError or ValueError for
+    values that do not fit in 16 bits rather than wrapping them, which
+    would take a Python call per store. Programs never store such values,
+    since the engines mask every result with & 0xFFFF; only code that
+    writes to memory directly has to.
+    """
+    if storage == "list":
+        return [0] * size
+    if storage == "array":
+        return array("H", bytes(2 * size))
+    if storage == "bytearray":
+        return memoryview(bytearray(2 * size)).cast("H")
+    if storage == "numpy":
+        import numpy as np
+        return memoryview(np.zeros(size, dtype=np.uint16))
+    if storage == "paged":
+        return PagedMemory(size)
+    raise ValueError(f"Unknown storage '{storage}', expected one of {STORAGES}")
+
+
+def view(buf) -> memoryview:
+    """
+    Zero-copy view of compact storage as unsigned 16-bit words.
+    """
+    if isinstance(buf, list):
+        raise TypeError("List storage cannot be viewed without copying")
+    return memoryview(buf).cast("B").cast("H")
+
+
+def copy_memory(mem):
+    """
+    Independent copy of memory from make_memory, in the same storage.
+        Paged memory shares its pages until either copy writes to them.
+    """
+    if isinstance(mem, PagedMemory):
+        return mem.snapshot()
+    if isinstance(mem, memoryview):
+        if isinstance(mem.obj, bytearray):
+            return memoryview(bytearray(mem)).cast("H")
+        import numpy as np
+        return memoryview(np.array(mem, dtype=np.uint16))
+    return mem[:]
+
+
+class PagedMemory:
+    """
+    Memory split into pages of PAGE_SIZE words that are shared between
+    snapshots and copied on first write.
+
+    Indexes like a list, including negative indices and slices, so the
+    execution engines can use it in place of a list. Each access costs a
+    method call, so running is slower than with list storage, but
+    snapshot() only copies the page table.
+    """
+    __slots__ = ("pages", "owned", "size")
+
+    def __init__(self, size: int = MEM_SIZE):
+        n_pages = (size + PAGE_MASK) >> PAGE_BITS
+        # Every page starts out as the same zero page
+        zero = [0] * PAGE_SIZE
+        self.pages = [zero] * n_pages
+        self.owned = bytearray(n_pages)
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+    def index(self, i: int) -> int:
+        """
+        Normalize a list-style index.
+        """
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("list index out of range")
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.size))]
+        i = self.index(i)
+        return self.pages[i >> PAGE_BITS][i & PAGE_MASK]
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            indices = range(*i.indices(self.size))
+            values = list(value)
+            if len(values) != len(indices):
+                raise ValueError(f"Cannot resize memory: assigned {len(values)} "
+                                 f"words to a slice of {len(indices)}")
+            for j, x in zip(indices, values):
+                self[j] = x
+            return
+
+        i = self.index(i)
+        p = i >> PAGE_BITS
+        if not self.owned[p]:
+            self.pages[p] = self.pages[p][:]
+            self.owned[p] = 1
+        self.pages[p][i & PAGE_MASK] = value
+
+    def snapshot(self) -> "PagedMemory":
+        """
+        Copy that shares every page with this memory until written.
+        """
+        copy = PagedMemory.__new__(PagedMemory)
+        copy.pages = self.pages[:]
+        copy.size = self.size
+        # Pages are now shared, so neither side may write them in place
+        copy.owned = bytearray(len(self.pages))
+        self.owned = bytearray(len(self.pages))
+        return copy
@@ -0,0 +1,154 @@
+# Memory-mapped I/O devices.
+#
+# Devices sit in the top 16 words of memory, MMIO_START to 0xFFFF. sw
+# addresses memory by register index plus a 5-bit offset, so these are the
+# only words above the virtual registers that sw can reach, as negative
+# offsets from r0 that wrap around:
+#   lw 3, -16(0)     # read the device at 0xFFF0
+#   sw 4, -15(0)     # write the device at 0xFFF1
+# Whether an instruction touches a device is decided when it is decoded,
+# so other loads and stores run exactly as before. lw through a pointer
+# register (e.g. "lw 3, 0(2)" with r2 = 0xFFF0) is not a device access
+# and reads the plain memory word.
+#
+# Usage:
+#   out = OutputBuffer(callback=lambda words: print(list(words)))
+#   interp.attach(InputStream(data), 0xFFF0)
+#   interp.attach(out, 0xFFF2)
+#   interp.run(trace=False)     # output is flushed when the run ends
+
+import time
+from array import array
+from typing import Callable, Iterable
+
+MMIO_START = 0xFFF0
+MMIO_END = 0x10000
+
+# Words read from an input's source at a time
+INPUT_CHUNK = 1 << 12
+# Words buffered by an output before calling back
+OUTPUT_BATCH = 1 << 12
+
+
+class Device:
+    """
+    Something mapped into memory at size consecutive addresses.
+        Offsets passed to read() and write() are relative to the first.
+    """
+    size = 1
+
+    def read(self, offset: int) -> int:
+        return 0
+
+    def write(self, offset: int, value: int):
+        pass
+
+    def flush(self):
+        """
+        Hand buffered output to the host. Called at the end of every run.
+        """
+
+
+class InputStream(Device):
+    """
+    Words fed to the program from an iterable, read a chunk at a time.
+        offset 0: the next word, or 0 once the input is exhausted
+        offset 1: 1 while there is more input, else 0
+    """
+    size = 2
+
+    def __init__(self, source: Iterable[int]):
+        self.source = iter(source)
+        self.buf = array("H")
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """
+        Read the next chunk from the source. False if it is exhausted.
+        """
+        self.buf = array("H", (w & 0xFFFF for _, w in zip(range(INPUT_CHUNK), self.source)))
+        self.pos = 0
+        return len(self.buf) > 0
+
+    def read(self, offset: int) -> int:
+        if self.pos >= len(self.buf) and not self.fill():
+            return 0
+        if offset == 1:
+            return 1
+        self.pos += 1
+        return self.buf[self.pos - 1]
+
+
+class OutputBuffer(Device):
+    """
+    Words written by the program, passed to callback(words: array) in
+        batches of up to batch words. Without a callback they are kept
+        in self.words.
+    """
+    def __init__(self, callback: Callable | None = None, batch: int = OUTPUT_BATCH):
+        self.callback = callback
+        self.batch = batch
+        self.words = array("H")
+
+    def write(self, offset: int, value: int):
+        self.words.append(value)
+        if self.callback is not None and len(self.words) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.callback is not None and self.words:
+            self.callback(self.words)
+            self.words = array("H")
+
+
+class Timer(Device):
+    """
+    Host time since the device was created, in units of the given number
+        of seconds (milliseconds by default), mod 2^16. Writing restarts it.
+    """
+    def __init__(self, unit: float = 1e-3):
+        self.unit = unit
+        self.start = time.perf_counter()
+
+    def read(self, offset: int) -> int:
+        return int((time.perf_counter() - self.start) / self.unit) & 0xFFFF
+
+    def write(self, offset: int, value: int):
+        self.start = time.perf_counter()
+
+
+class DeviceMap:
+    """
+    Devices by address.
+        ports: address -> (device, offset) for every mapped word
+    """
+    def __init__(self):
+        self.devices = {}
+        self.ports = {}
+
+    def attach(self, device: Device, addr: int):
+        """
+        Map device at addr onwards.
+        """
+        end = addr + device.size
+        if not (MMIO_START <= addr and end <= MMIO_END):
+            raise ValueError(f"Devices must lie within {MMIO_START:#x}-{MMIO_END - 1:#x}")
+        for a in range(addr, end):
+            if a in self.ports:
+                raise ValueError(f"Address {a:#x} is already mapped")
+        self.devices[addr] = device
+        for a in range(addr, end):
+            self.ports[a] = (device, a - addr)
+
+    def detach(self, addr: int) -> Device:
+        """
+        Unmap the device attached at addr and return it.
+        """
+        device = self.devices.pop(addr)
+        for a in range(addr, addr + device.size):
+            del self.ports[a]
+        return device
+
+    def flush(self):
+        for device in self.devices.values():
+            device.flush()
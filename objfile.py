@@ -0,0 +1,227 @@
+# Reads and writes assembled programs.
+#
+# Layout, all little-endian:
+#   header:  magic (4 bytes), version (u16), load address (u16),
+#            entry point (u16), word count (u32), symbol count (u32)
+#   symbols: per symbol, name length (u16), UTF-8 name, address (u16)
+#   words:   the program, one u16 per word
+#
+# Loading is a single read and a single slice copy into memory, so it
+# does not depend on how long the source was or how much it expanded.
+#
+# Modules (see linker.py) are assembled at offset 0 and not yet placed:
+#   header:      magic (4 bytes), version (u16), word count (u32),
+#                symbol count (u32), relocation count (u32),
+#                undefined symbol count (u32)
+#   symbols:     as above, with offsets instead of addresses
+#   relocations: per instruction that uses a label, offset (u16), source
+#                line (u32), text length (u16), UTF-8 instruction text
+#   undefined:   per label used but not defined, length (u16), UTF-8 name
+#   words:       as above, with zeros where relocations go
+
+import struct
+import sys
+from array import array
+from typing import NamedTuple
+
+MAGIC = b"HB16"
+VERSION = 1
+SUFFIX = ".o16"
+MODULE_MAGIC = b"HR16"
+MODULE_VERSION = 1
+MODULE_SUFFIX = ".r16"
+
+HEADER = struct.Struct("<4sHHHII")
+SYMBOL_LEN = struct.Struct("<H")
+SYMBOL_ADDR = struct.Struct("<H")
+MODULE_HEADER = struct.Struct("<4sHIIII")
+RELOC = struct.Struct("<HIH")
+
+
+class ObjectFile(NamedTuple):
+    """
+    An assembled program.
+        load_addr: address of the first word
+        entry: address execution starts at
+        symbols: label name -> address
+        words: array('H') of program words
+    """
+    load_addr: int
+    entry: int
+    symbols: dict
+    words: array
+
+
+class Module(NamedTuple):
+    """
+    An assembled file that has not been placed in memory yet.
+        symbols: label name -> offset from the first word
+        relocs: (offset, line_no, inst) for each instruction that uses a
+            label, to be encoded once labels have addresses
+        undefined: labels used but not defined here
+        words: array('H') of words, zero where relocs go
+    """
+    symbols: dict
+    relocs: tuple
+    undefined: tuple
+    words: array
+
+
+def is_object(data: bytes) -> bool:
+    """
+    Whether data starts like an object file.
+    """
+    return data[:len(MAGIC)] == MAGIC
+
+
+def to_bytes(obj: ObjectFile) -> bytes:
+    """
+    Serialize an object file.
+    """
+    parts = [HEADER.pack(MAGIC, VERSION, obj.load_addr, obj.entry,
+                         len(obj.words), len(obj.symbols))]
+    for name, addr in obj.symbols.items():
+        encoded = name.encode()
+        parts.append(SYMBOL_LEN.pack(len(encoded)))
+        parts.append(encoded)
+        parts.append(SYMBOL_ADDR.pack(addr))
+
+    words = array("H", obj.words)
+    if sys.byteorder != "little":
+        words.byteswap()
+    parts.append(words.tobytes())
+    return b"".join(parts)
+
+
+def from_bytes(data: bytes) -> ObjectFile:
+    """
+    Deserialize an object file.
+    """
+    if len(data) < HEADER.size or not is_object(data):
+        raise ValueError("Not an object file")
+    _, version, load_addr, entry, n_words, n_symbols = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported object file version {version}")
+
+    symbols = {}
+    offset = HEADER.size
+    for _ in range(n_symbols):
+        (length,) = SYMBOL_LEN.unpack_from(data, offset)
+        offset += SYMBOL_LEN.size
+        name = bytes(data[offset:offset + length]).decode()
+        offset += length
+        (symbols[name],) = SYMBOL_ADDR.unpack_from(data, offset)
+        offset += SYMBOL_ADDR.size
+
+    end = offset + 2 * n_words
+    if len(data) < end:
+        raise ValueError(f"Object file truncated: expected {n_words} words")
+    words = array("H")
+    words.frombytes(data[offset:end])
+    if sys.byteorder != "little":
+        words.byteswap()
+    return ObjectFile(load_addr, entry, symbols, words)
+
+
+def pack_name(name: str) -> list:
+    encoded = name.encode()
+    return [SYMBOL_LEN.pack(len(encoded)), encoded]
+
+
+def unpack_name(data: bytes, offset: int) -> tuple:
+    """
+    Read a length-prefixed name. Returns (name, offset after it).
+    """
+    (length,) = SYMBOL_LEN.unpack_from(data, offset)
+    offset += SYMBOL_LEN.size
+    return bytes(data[offset:offset + length]).decode(), offset + length
+
+
+def module_to_bytes(module: Module) -> bytes:
+    """
+    Serialize a module.
+    """
+    parts = [MODULE_HEADER.pack(MODULE_MAGIC, MODULE_VERSION, len(module.words),
+                                len(module.symbols), len(module.relocs), len(module.undefined))]
+    for name, offset in module.symbols.items():
+        parts += pack_name(name)
+        parts.append(SYMBOL_ADDR.pack(offset))
+    for offset, line_no, inst in module.relocs:
+        encoded = inst.encode()
+        parts.append(RELOC.pack(offset, line_no, len(encoded)))
+        parts.append(encoded)
+    for name in module.undefined:
+        parts += pack_name(name)
+
+    words = array("H", module.words)
+    if sys.byteorder != "little":
+        words.byteswap()
+    parts.append(words.tobytes())
+    return b"".join(parts)
+
+
+def module_from_bytes(data: bytes) -> Module:
+    """
+    Deserialize a module.
+    """
+    if len(data) < MODULE_HEADER.size or data[:len(MODULE_MAGIC)] != MODULE_MAGIC:
+        raise ValueError("Not a module")
+    _, version, n_words, n_symbols, n_relocs, n_undefined = MODULE_HEADER.unpack_from(data)
+    if version != MODULE_VERSION:
+        raise ValueError(f"Unsupported module version {version}")
+
+    offset = MODULE_HEADER.size
+    symbols = {}
+    for _ in range(n_symbols):
+        name, offset = unpack_name(data, offset)
+        (symbols[name],) = SYMBOL_ADDR.unpack_from(data, offset)
+        offset += SYMBOL_ADDR.size
+    relocs = []
+    for _ in range(n_relocs):
+        at, line_no, length = RELOC.unpack_from(data, offset)
+        offset += RELOC.size
+        relocs.append((at, line_no, bytes(data[offset:offset + length]).decode()))
+        offset += length
+    undefined = []
+    for _ in range(n_undefined):
+        name, offset = unpack_name(data, offset)
+        undefined.append(name)
+
+    end = offset + 2 * n_words
+    if len(data) < end:
+        raise ValueError(f"Module truncated: expected {n_words} words")
+    words = array("H")
+    words.frombytes(data[offset:end])
+    if sys.byteorder != "little":
+        words.byteswap()
+    return Module(symbols, tuple(relocs), tuple(undefined), words)
+
+
+def write(path: str, obj: ObjectFile):
+    with open(path, "wb") as fout:
+        fout.write(to_bytes(obj))
+
+
+def read(path: str) -> ObjectFile:
+    with open(path, "rb") as fin:
+        return from_bytes(fin.read())
+
+
+if __name__ == "__main__":
+    import os
+
+    from interpreter import Interpreter
+
+    if len(sys.argv) < 2:
+        print(f"Usage: objfile.py <script> [output]")
+        exit(1)
+
+    src = sys.argv[1]
+    out = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(src)[0] + SUFFIX
+    with open(src) as fin:
+        prog = fin.read()
+
+    interp = Interpreter()
+    words = interp.load_prog(prog)
+    interp.save_object(out)
+    print(f"Wrote {words} words and {len(interp.labels)} symbols to {out}")
@@ -0,0 +1,339 @@
+# Peephole optimizer for expanded programs.
+#
+# utils.pseudo.expand keeps virtual registers in memory words 1-15 and
+# goes through r1/r2 for every use, so expanded code reloads values that
+# are already in a register and stores values that are overwritten right
+# away. This pass tracks what each physical register holds and removes:
+#   - loads of a value the register already holds
+#   - stores of a value memory already holds
+#   - instructions that recompute the constant or copy a register holds
+#   - stores overwritten before anything could read them
+#
+# Control is assumed to enter code only at labels, by falling through, or
+# by returning after a jalr. Programs that branch by numeric offset are
+# left alone, since removing words would move their targets.
+#
+# Loads and stores in the device window (see mmio.py) are never removed:
+# each one reads or writes a device, so what is known about memory does
+# not apply to them, and what is known about registers and memory is
+# dropped around them.
+
+from typing import NamedTuple
+
+from encode import ALU2_TYPE, ALU3_TYPE, BR_TYPE, IMM_TYPE, MEM_ARG, \
+    flatten, parse, width
+from mmio import MMIO_START
+from utils.literals import decode_literal, fit_literal, parse_literal
+from utils.reg_names import REG_IDX
+
+MEM_SIZE = 1 << 16
+
+# Instructions that only compute a register, with their argument counts
+ALU_OPS = {**{op: 3 for op in IMM_TYPE}, **{op: 2 for op in ALU2_TYPE},
+           **{op: 3 for op in ALU3_TYPE}}
+
+
+class PeepholeReport(NamedTuple):
+    """
+    What the optimizer removed from a program.
+        words_before, words_after: program size in words
+        loads, stores, constants, copies, dead_stores: instructions
+            removed by each rule
+    """
+    words_before: int
+    words_after: int
+    loads: int
+    stores: int
+    constants: int
+    copies: int
+    dead_stores: int
+
+    @property
+    def words_saved(self) -> int:
+        return self.words_before - self.words_after
+
+
+def reg_idx(name: str) -> int | None:
+    return REG_IDX.get(name)
+
+
+def imm8(x: str) -> int | None:
+    """
+    Value an 8-bit immediate field takes at run time, None for labels.
+    """
+    value = parse_literal(x)
+    if value is None:
+        return None
+    return decode_literal(fit_literal(value, 8, True), 8)
+
+
+def evaluate(opcode: str, a: int | None, b: int | None) -> int | None:
+    """
+    Result of an ALU/immediate instruction on known operands.
+    """
+    if a is None or b is None:
+        return None
+    match opcode:
+        case "addi" | "add":
+            return (a + b) & 0xFFFF
+        case "nandi" | "nand":
+            return ~(a & b) & 0xFFFF
+        case "swb":
+            return ((a & 0xFF) << 8) | ((a & 0xFF00) >> 8)
+        case "sl":
+            return (a << 1) & 0xFFFF
+        case "sr":
+            return a >> 1
+    return None
+
+
+def is_device(opcode: str, imm: int, base: int) -> bool:
+    """
+    Whether a load or store with a literal operand reaches the device
+        window. Stores address memory by the index of the base register,
+        loads by its value, which is only known for r0.
+    """
+    if opcode == "lw" and base != 0:
+        return False
+    return (base + imm) % MEM_SIZE >= MMIO_START
+
+
+def mem_operand(arg: str) -> tuple | None:
+    """
+    Split "imm(reg)" into (imm, reg index), None if it is not literal.
+    """
+    found = MEM_ARG.findall(arg)
+    if not found:
+        return None
+    imm, base = found[0]
+    imm, base = parse_literal(imm), reg_idx(base)
+    if imm is None or base is None:
+        return None
+    return imm, base
+
+
+class State:
+    """
+    What is known about registers and memory at a point in the program.
+        const: known value of each register, or None
+        slots: memory addresses each register is known to equal
+        mem: known values of memory words
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.const = [0, None, None, None, None, None]
+        self.slots = [set() for _ in range(6)]
+        self.mem = {}
+
+    def set_reg(self, r: int, const: int | None, slots: set):
+        if r == 0:
+            return
+        if const is not None:
+            slots = slots | {addr for addr, v in self.mem.items() if v == const}
+        self.const[r] = const
+        self.slots[r] = slots
+
+    def holds(self, r: int, const: int | None, slots: set) -> bool:
+        """
+        Whether register r already has this value.
+        """
+        if const is not None and self.const[r] == const:
+            return True
+        return bool(slots & self.slots[r])
+
+    def store(self, r: int, addr: int):
+        for slots in self.slots:
+            slots.discard(addr)
+        self.slots[r].add(addr)
+        if self.const[r] is None:
+            self.mem.pop(addr, None)
+        else:
+            self.mem[addr] = self.const[r]
+
+
+def forward(insts: list, counts: dict) -> list:
+    """
+    Remove instructions that leave registers and memory unchanged.
+    """
+    state = State()
+    kept = []
+    for item in insts:
+        line_no, labels, inst = item
+        if labels:
+            state.reset()
+
+        opcode, args = parse(inst)
+        regs = [reg_idx(arg) for arg in args]
+        remove = None
+
+        if opcode in ("lw", "sw") and len(args) == 2 and regs[0] is not None \
+                and mem_operand(args[1]) is not None:
+            r = regs[0]
+            imm, base = mem_operand(args[1])
+            if is_device(opcode, imm, base):
+                # Devices are volatile
+                state.reset()
+                if opcode == "lw":
+                    state.set_reg(r, None, set())
+            elif opcode == "lw":
+                if base != 0:
+                    state.set_reg(r, None, set())
+                else:
+                    addr = imm % MEM_SIZE
+                    const = state.mem.get(addr)
+                    if r != 0 and state.holds(r, const, {addr}):
+                        remove = "loads"
+                    else:
+                        state.set_reg(r, const, {addr})
+            else:
+                # Stores address memory by the index of the base register
+                addr = (base + imm) % MEM_SIZE
+                if addr in state.slots[r] or \
+                        (state.const[r] is not None and state.mem.get(addr) == state.const[r]):
+                    remove = "stores"
+                else:
+                    state.store(r, addr)
+
+        elif opcode in ALU_OPS:
+            # The immediate of addi/nandi is not a register
+            operands = regs[:2] if opcode in IMM_TYPE else regs
+            if len(args) != ALU_OPS[opcode] or None in operands:
+                state.reset()
+            else:
+                r, a = regs[0], regs[1]
+                if opcode in IMM_TYPE:
+                    b = imm8(args[2])
+                    const = evaluate(opcode, state.const[a], b)
+                    # addi rd, rs, 0 copies rs
+                    slots = set(state.slots[a]) if opcode == "addi" and b == 0 else set()
+                else:
+                    b = state.const[regs[2]] if opcode in ALU3_TYPE else 0
+                    const = evaluate(opcode, state.const[a], b)
+                    slots = set()
+                if r != 0 and state.holds(r, const, slots):
+                    remove = "constants" if const is not None else "copies"
+                else:
+                    state.set_reg(r, const, slots)
+
+        elif opcode == "li" and len(args) == 2 and regs[0] is not None:
+            r = regs[0]
+            value = parse_literal(args[1])
+            const = None if value is None else value & 0xFFFF
+            if r != 0 and const is not None and state.holds(r, const, set()):
+                remove = "constants"
+            else:
+                state.set_reg(r, const, set())
+
+        elif opcode in BR_TYPE:
+            # Only reads registers; the fall-through path keeps what we know
+            pass
+
+        else:
+            # jalr, .fill and anything still unexpanded
+            state.reset()
+
+        # Nothing is known right after a label, so labelled instructions
+        # are never removed
+        if remove is None:
+            kept.append(item)
+        else:
+            counts[remove] += 1
+    return kept
+
+
+def dead_stores(insts: list, counts: dict) -> list:
+    """
+    Remove stores that are overwritten before they can be read.
+        Only looks within straight-line code.
+    """
+    kept = []
+    overwritten = set()
+    for item in reversed(insts):
+        line_no, labels, inst = item
+        opcode, args = parse(inst)
+        operand = mem_operand(args[1]) if opcode in ("lw", "sw") and len(args) == 2 else None
+
+        remove = False
+        if operand is None or reg_idx(args[0]) is None:
+            # Anything that can transfer control or touch memory
+            if opcode not in ALU_OPS and opcode != "li":
+                overwritten.clear()
+        else:
+            imm, base = operand
+            if is_device(opcode, imm, base):
+                overwritten.clear()
+            elif opcode == "sw":
+                addr = (base + imm) % MEM_SIZE
+                if addr in overwritten:
+                    remove = True
+                overwritten.add(addr)
+            elif base == 0:
+                overwritten.discard(imm % MEM_SIZE)
+            else:
+                overwritten.clear()
+
+        if remove and not labels:
+            counts["dead_stores"] += 1
+        else:
+            kept.append(item)
+        if labels:
+            overwritten.clear()
+    kept.reverse()
+    return kept
+
+
+def optimize(insts: list) -> tuple:
+    """
+    Optimize a program given as (line_no, labels, inst) tuples, as built
+        by Interpreter.load_prog. Returns the new list and a PeepholeReport.
+    """
+    words_before = sum(width(inst) for _, _, inst in insts)
+
+    flat = []
+    for line_no, labels, inst in insts:
+        for i, sub in enumerate(flatten(inst)):
+            flat.append((line_no, labels if i == 0 else [], sub))
+
+    # Numeric branch offsets would break once words move
+    for _, _, inst in flat:
+        opcode, args = parse(inst)
+        if opcode in BR_TYPE and len(args) == 2 and parse_literal(args[1]) is not None:
+            return insts, PeepholeReport(words_before, words_before, 0, 0, 0, 0, 0)
+
+    counts = {"loads": 0, "stores": 0, "constants": 0, "copies": 0, "dead_stores": 0}
+    flat = forward(flat, counts)
+    flat = dead_stores(flat, counts)
+
+    words_after = sum(width(inst) for _, _, inst in flat)
+    return flat, PeepholeReport(words_before, words_after, **counts)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from interpreter import Interpreter
+
+    if len(sys.argv) < 2:
+        print(f"Usage: peephole.py <script> [max_cycles]")
+        exit(1)
+
+    with open(sys.argv[1]) as fin:
+        prog = fin.read()
+    max_cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+
+    results = []
+    for optimize in (False, True):
+        interp = Interpreter()
+        words = interp.load_prog(prog, optimize=optimize)
+        result = interp.run(trace=False, max_cycles=max_cycles)
+        results.append((words, result))
+        if optimize:
+            print(interp.opt_report)
+
+    (words, plain), (opt_words, opt) = results
+    print(f"Words: {words} -> {opt_words} ({words - opt_words} saved)")
+    print(f"Cycles: {plain.cycles} -> {opt.cycles} ({plain.cycles - opt.cycles} saved)")
+    if plain.reg != opt.reg or plain.halted != opt.halted:
+        print("Results differ!")
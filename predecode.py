@@ -0,0 +1,382 @@
+# Predecodes instructions.
+
+from functools import lru_cache
+from typing import Callable, NamedTuple
+
+from execute import ExecutionError
+from utils.literals import decode_literal
+
+# Number of physical registers in Interpreter.reg
+NUM_REGS = 5
+# Longest sequence fusion.py runs as one handler
+MAX_FUSED = 4
+# Most dispatches between checks of the cycle limit while loops may be
+# skipped, which may use whatever the dispatches leave of the limit
+SKIP_ROUND = 64
+
+
+class Decoded(NamedTuple):
+    """
+    Fields of a single instruction word, extracted once.
+        name: mnemonic ("addi", "lw", ...), or None for words that do nothing
+        rs, rd, ro: register indices
+        imm: sign-extended immediate for the instruction's type
+    """
+    name: str | None
+    rs: int
+    rd: int
+    ro: int
+    imm: int
+
+
+# Registers each instruction reads
+READS = {
+    "addi": "s", "nandi": "s", "swb": "s", "sl": "s", "sr": "s",
+    "nand": "so", "add": "so",
+    "jalr": "s", "bn": "s", "bz": "s", "bp": "s",
+    "lw": "s", "sw": "d",
+}
+
+ALU_NAMES = {
+    0b01000: "swb",
+    0b01001: "nand",
+    0b01010: "sl",
+    0b01011: "sr",
+    0b01100: "add",
+    0b00000: "jalr",
+    0b00101: "bn",
+    0b00110: "bz",
+    0b00111: "bp",
+    0b00010: "lw",
+    0b00011: "sw",
+}
+
+
+@lru_cache(maxsize=None)
+def predecode(inst: int) -> Decoded:
+    """
+    Split a 16-bit instruction into its fields.
+        Mirrors the field extraction done by execute.execute().
+    """
+    if not (isinstance(inst, int) and 0 <= inst < (1<<16)):
+        raise Exception(f"Encoded instruction is not a 16-bit value")
+
+    rs = (inst >> 8) & 0b111
+    rd = (inst >> 5) & 0b111
+    ro = (inst >> 2) & 0b111
+
+    top = inst >> 14
+    if top == 0b10 or top == 0b11:
+        imm = decode_literal(((inst >> 6) & (0b111<<5)) + (inst & 0b11111), 8)
+        return Decoded("addi" if top == 0b10 else "nandi", rs, rd, ro, imm)
+
+    name = ALU_NAMES.get(inst >> 11)
+    if name in ("bn", "bz", "bp"):
+        imm = decode_literal(inst & 0xFF, 8)
+    elif name in ("lw", "sw"):
+        imm = decode_literal(inst & 0x1F, 5)
+    else:
+        imm = 0
+    return Decoded(name, rs, rd, ro, imm)
+
+
+def make_op(d: Decoded, cache: "DecodeCache | None" = None) -> Callable:
+    """
+    Build a handler op(reg, mem, pc) -> new_pc for a decoded instruction.
+        cache: DecodeCache to notify when sw writes memory, and whose
+            ports map r0-relative lw/sw addresses to devices (see mmio.py)
+
+    Handlers behave exactly like execute.execute(), including the errors
+    it raises, but do no decoding at run time.
+    """
+    name, rs, rd, ro, imm = d
+
+    if rd >= NUM_REGS:
+        def op(reg, mem, pc):
+            raise IndexError(f"Index {rd} out of range for 5 registers")
+        return op
+
+    def nop(reg, mem, pc):
+        return pc + 1
+
+    # Results written to x0 are discarded, but operands are still read
+    # so that bad register indices fail the same way they do in execute()
+    reads = {
+        "addi": (rs,), "nandi": (rs,), "swb": (rs,), "sl": (rs,), "sr": (rs,),
+        "nand": (rs, ro), "add": (rs, ro),
+    }
+    if rd == 0 and name in reads:
+        if all(idx < NUM_REGS for idx in reads[name]):
+            return nop
+        def op(reg, mem, pc):
+            for idx in reads[name]:
+                reg[idx]
+            return pc + 1
+        return op
+
+    match name:
+        case "addi":
+            def op(reg, mem, pc):
+                reg[rd] = (reg[rs] + imm) & 0xFFFF
+                return pc + 1
+        case "nandi":
+            def op(reg, mem, pc):
+                reg[rd] = ~(reg[rs] & imm) & 0xFFFF
+                return pc + 1
+        case "swb":
+            def op(reg, mem, pc):
+                x = reg[rs]
+                reg[rd] = ((x & 0xFF) << 8) | ((x & 0xFF00) >> 8)
+                return pc + 1
+        case "nand":
+            def op(reg, mem, pc):
+                reg[rd] = ~(reg[rs] & reg[ro]) & 0xFFFF
+                return pc + 1
+        case "sl":
+            def op(reg, mem, pc):
+                reg[rd] = (reg[rs] << 1) & 0xFFFF
+                return pc + 1
+        case "sr":
+            def op(reg, mem, pc):
+                reg[rd] = (reg[rs] >> 1) & 0xFFFF
+                return pc + 1
+        case "add":
+            def op(reg, mem, pc):
+                reg[rd] = (reg[rs] + reg[ro]) & 0xFFFF
+                return pc + 1
+        case "jalr":
+            if rd == 0:
+                def op(reg, mem, pc):
+                    return reg[rs]
+            else:
+                # rd is written first, so "jalr x1, x1" jumps to pc + 1
+                def op(reg, mem, pc):
+                    reg[rd] = (pc + 1) & 0xFFFF
+                    return reg[rs]
+        case "bn":
+            def op(reg, mem, pc):
+                return pc + imm if reg[rs] < 0 else pc + 1
+        case "bz":
+            def op(reg, mem, pc):
+                return pc + imm if reg[rs] == 0 else pc + 1
+        case "bp":
+            def op(reg, mem, pc):
+                return pc + imm if reg[rs] > 0 else pc + 1
+        case "lw":
+            port = cache.ports.get(imm % len(cache.mem)) if cache is not None and rs == 0 else None
+            if port is not None:
+                read, offset = port[0].read, port[1]
+                def op(reg, mem, pc):
+                    value = read(offset) & 0xFFFF
+                    if rd != 0:
+                        reg[rd] = value
+                    return pc + 1
+            elif rd == 0:
+                def op(reg, mem, pc):
+                    mem[reg[rs] + imm]
+                    return pc + 1
+            else:
+                def op(reg, mem, pc):
+                    reg[rd] = mem[reg[rs] + imm] & 0xFFFF
+                    return pc + 1
+        case "sw":
+            # Stores address memory by the index of rs, not its value
+            addr = rs + imm
+            port = cache.ports.get(addr % len(cache.mem)) if cache is not None else None
+            if cache is None:
+                def op(reg, mem, pc):
+                    mem[addr] = reg[rd]
+                    return pc + 1
+            elif port is not None:
+                write, offset = port[0].write, port[1]
+                def op(reg, mem, pc):
+                    write(offset, reg[rd])
+                    return pc + 1
+            else:
+                addr %= len(cache.mem)
+                entries, watched, written = \
+                    cache.entries, cache.watched, cache.written
+                def op(reg, mem, pc):
+                    mem[addr] = reg[rd]
+                    entries[addr] = None
+                    if addr in watched:
+                        written(addr)
+                    return pc + 1
+        case _:
+            op = nop
+
+    return op
+
+
+class DecodeCache:
+    """
+    Per-address cache of instruction handlers for one memory image.
+        Entries are filled the first time an address is executed and
+        cleared when sw writes to that address.
+
+    Code that writes to memory directly (e.g. Interpreter.load_prog)
+    must call invalidate() afterwards.
+
+    Other engines that cache translated code can add addresses to
+    watched and a callback to listeners; the callback is called with
+    the address whenever one of those addresses is written, or with
+    None when the whole cache is invalidated.
+    """
+    def __init__(self, mem: list, ports: dict | None = None):
+        self.mem = mem
+        # Device addresses, see mmio.DeviceMap
+        self.ports = ports if ports is not None else {}
+        self.entries = [None] * len(mem)
+        self.ops = {}
+        self.watched = set()
+        self.listeners = []
+
+        # Counted loops (see idle.py) are skipped when fast_forward is set,
+        # by at most budget cycles if it is not None
+        self.fast_forward = False
+        self.budget = None
+        self.skipped = 0
+
+        # Expanded sequences run as one handler when fuse is set (see
+        # fusion.py), counting the dispatches saved in fused
+        self.fuse = False
+        self.fused = 0
+        self.visited = set()
+
+    def set_fast_forward(self, enabled: bool):
+        """
+        Turn loop skipping on or off, dropping handlers built the other way.
+        """
+        if enabled != self.fast_forward:
+            self.fast_forward = enabled
+            self.invalidate()
+
+    def set_fuse(self, enabled: bool):
+        """
+        Turn fusion on or off, dropping handlers built the other way.
+        """
+        if enabled != self.fuse:
+            self.fuse = enabled
+            self.invalidate()
+
+    def handler(self, inst: int) -> Callable:
+        """
+        Handler for a single instruction word.
+        """
+        op = self.ops.get(inst)
+        if op is None:
+            op = self.ops[inst] = make_op(predecode(inst), self)
+        return op
+
+    def fill(self, addr: int) -> Callable:
+        """
+        Decode the word at addr and cache its handler.
+        """
+        op, length = self.handler(self.mem[addr]), 1
+        if self.fuse and addr in self.visited:
+            # fusion.py imports this module
+            from fusion import fuse
+            op, length = fuse(self, addr) or (op, length)
+        if self.fast_forward and predecode(self.mem[addr + length - 1]).name == "jalr":
+            op = self.loop_finder(op, length)
+        if self.fuse and addr not in self.visited:
+            # Left uncached so that it is fused if it runs again, since
+            # code run once does not repay building a handler
+            self.visited.add(addr)
+            return op
+        self.entries[addr] = op
+        return op
+
+    def loop_finder(self, op: Callable, length: int = 1) -> Callable:
+        """
+        Handler for a jalr, or a fused sequence of length words ending in
+            one, that the first time it jumps backwards checks for a
+            counted loop from the target to itself and makes the loop head
+            skip iterations (see idle.py).
+        """
+        # idle.py imports this module
+        from idle import find_loop, loop_op
+
+        def first(reg, mem, pc):
+            new_pc = op(reg, mem, pc)
+            self.entries[pc] = op
+            if 0 < new_pc <= pc:
+                loop = find_loop(mem, new_pc)
+                if loop is not None and loop.head + loop.length == pc + length:
+                    head = self.entries[new_pc] or self.fill(new_pc)
+                    self.entries[new_pc] = loop_op(loop, head, self)
+            return new_pc
+        return first
+
+    def invalidate(self, addr: int | None = None):
+        """
+        Drop the cached handler at addr, or all of them if addr is None.
+        """
+        if addr is None:
+            # Cleared in place since sw handlers hold a reference to entries
+            self.entries[:] = [None] * len(self.entries)
+            self.written(None)
+        else:
+            self.entries[addr] = None
+            if addr in self.watched:
+                self.written(addr)
+
+    def written(self, addr: int | None):
+        """
+        Tell listeners that the word at a watched address has changed.
+        """
+        for listener in self.listeners:
+            listener(addr)
+
+    def step(self, reg: list, pc: int) -> int:
+        """
+        Execute the instruction at pc, returns new PC.
+        """
+        if self.fuse:
+            # Entries may run several instructions
+            return self.handler(self.mem[pc])(reg, self.mem, pc)
+        op = self.entries[pc] or self.fill(pc)
+        return op(reg, self.mem, pc)
+
+    def run(self, reg: list, pc: int, max_cycles: int | None = None):
+        """
+        Execute from pc until the program halts (pc == 0) or max_cycles
+            instructions have run. Returns (pc, cycles).
+        Raises ExecutionError if an instruction fails.
+        """
+        entries, mem, fill = self.entries, self.mem, self.fill
+        cycles = 0
+        self.budget = None
+        skipped, fused = self.skipped, self.fused
+        try:
+            if max_cycles is None:
+                while pc != 0:
+                    pc = (entries[pc] or fill(pc))(reg, mem, pc)
+                    cycles += 1
+            else:
+                # Each dispatch runs at most span instructions, so run in
+                # rounds that cannot pass max_cycles, and the last few
+                # instructions one at a time. Loops skipped in a round
+                # may use what its dispatches cannot
+                span = MAX_FUSED if self.fuse else 1
+                left = max_cycles
+                while pc != 0 and left >= span:
+                    dispatches = left // span
+                    if self.fast_forward:
+                        # Leave at least half of what is left for skipping
+                        dispatches = max(1, min(dispatches // 2, SKIP_ROUND))
+                    self.budget = left - dispatches * span
+                    stop = cycles + dispatches
+                    while pc != 0 and cycles < stop:
+                        pc = (entries[pc] or fill(pc))(reg, mem, pc)
+                        cycles += 1
+                    left = max_cycles - cycles - (self.fused - fused) - (self.skipped - skipped)
+                self.budget = 0
+                handler = self.handler
+                while pc != 0 and left > 0:
+                    pc = handler(mem[pc])(reg, mem, pc)
+                    cycles += 1
+                    left -= 1
+        except Exception as e:
+            raise ExecutionError(pc, e, cycles + self.fused - fused + self.skipped - skipped) from e
+        return pc, cycles + self.fused - fused + self.skipped - skipped
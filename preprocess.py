@@ -0,0 +1,198 @@
+# Expands .include and .macro directives.
+#
+#   .include "lib/mul.S"    adds lib/mul.S (relative to the including file)
+#                           to the program
+#   .macro name a, b        defines a macro; the lines up to .endm are its
+#   ...                     body, where \a and \b stand for its arguments
+#   .endm                   and \@ for a label suffix unique to each use
+#   name 3, a0              expands to the body
+#
+# A program is its own lines followed by those of each file it includes,
+# in order of first inclusion, depth first, each file once. Code from
+# included files therefore comes after the program's own, so execution
+# still starts at the program's first instruction: included files should
+# hold routines and data that are jumped to or loaded, not fallen into.
+# linker.py assembles each file as its own module in the same order, so
+# both give the same memory image.
+#
+# Macros may be defined in any file and used in any other, and may use
+# other macros. \@ is numbered per file, with the file's name in it, so
+# editing one file does not change the expansion of another.
+
+import os
+import re
+from typing import NamedTuple
+
+from encode import ARG_SEP, PRIMITIVES, parse
+
+INCLUDE = re.compile(r'^\.include\s+"([^"]+)"$')
+MACRO = re.compile(r"^\.macro\s+(\w+)(?:\s+(.+))?$")
+ENDM = ".endm"
+LABELED = re.compile(r"^(?:(\w+):)?\s*(.*)$")
+ARG_REF = re.compile(r"\\(\w+|@)")
+# Macros may not hide these
+OPCODES = frozenset(PRIMITIVES) | {".fill", "halt", "neg", "nop", "mv", "li", "jal", "j"}
+# Deepest chain of macros using macros
+MAX_DEPTH = 64
+
+
+class Macro(NamedTuple):
+    """
+    A macro's parameter names and body lines.
+    """
+    params: tuple
+    body: list
+
+
+class Source(NamedTuple):
+    """
+    A file of a program, with its directives expanded.
+        path: absolute path, or None for a program given as text
+        lines: source lines
+    """
+    path: str | None
+    lines: list
+
+
+def has_directives(text: str) -> bool:
+    """
+    Whether text needs expanding at all.
+    """
+    return ".include" in text or ".macro" in text
+
+
+def strip(line: str) -> str:
+    return line.split("#", 1)[0].strip()
+
+
+def split_file(lines: list, macros: dict) -> tuple:
+    """
+    Take macro definitions out of lines into macros. Returns the
+        remaining lines and the paths of included files, as written.
+    """
+    out = []
+    includes = []
+    macro = None
+    for line in lines:
+        text = strip(line)
+        if macro is not None:
+            if text == ENDM:
+                macro = None
+            else:
+                macro.body.append(text)
+            continue
+
+        match = MACRO.match(text)
+        if match:
+            name, params = match.groups()
+            if name in OPCODES:
+                raise SyntaxError(f"Macro '{name}' has the name of an instruction")
+            if name in macros:
+                raise SyntaxError(f"Macro '{name}' is defined twice")
+            macro = macros[name] = Macro(tuple(ARG_SEP.split(params)) if params else (), [])
+            continue
+        if text == ENDM:
+            raise SyntaxError(f"{ENDM} without .macro")
+
+        match = INCLUDE.match(text)
+        if match:
+            includes.append(match[1])
+        elif text.startswith(".include"):
+            raise SyntaxError(f"Expected .include \"path\", got '{text}'")
+        else:
+            out.append(line)
+    if macro is not None:
+        raise SyntaxError(f"Missing {ENDM}")
+    return out, includes
+
+
+def expand_macros(lines: list, macros: dict, tag: str) -> list:
+    """
+    Replace uses of macros in lines with their bodies. tag makes \\@
+        unique to this file.
+    """
+    uses = 0
+
+    def expand(line: str, depth: int) -> list:
+        nonlocal uses
+        label, inst = LABELED.match(strip(line)).groups()
+        if not inst or inst.split(None, 1)[0] not in macros:
+            return [line]
+        if depth >= MAX_DEPTH:
+            raise RecursionError(f"Macros nested more than {MAX_DEPTH} deep")
+
+        name, args = parse(inst)
+        params, body = macros[name]
+        if len(args) != len(params):
+            raise SyntaxError(f"Macro '{name}' expects {len(params)} arguments, "
+                              f"got {len(args)}")
+        values = dict(zip(params, args))
+        values["@"] = f"{tag}_{uses}"
+        uses += 1
+
+        def substitute(match: re.Match) -> str:
+            if match[1] not in values:
+                raise SyntaxError(f"Macro '{name}' has no parameter '{match[1]}'")
+            return values[match[1]]
+
+        out = [f"{label}:"] if label else []
+        for body_line in body:
+            out += expand(ARG_REF.sub(substitute, body_line), depth + 1)
+        return out
+
+    out = []
+    for line in lines:
+        out += expand(line, 0)
+    return out
+
+
+def file_tag(path: str | None) -> str:
+    """
+    Name of a file usable in labels, e.g. "lib/mul-2.S" -> "mul_2".
+    """
+    if path is None:
+        return "prog"
+    return re.sub(r"\W", "_", os.path.splitext(os.path.basename(path))[0])
+
+
+def read_sources(text: str | None = None, path: str | None = None,
+                 base_dir: str | None = None) -> list:
+    """
+    The files of a program, given as text (with includes relative to
+        base_dir, by default the working directory) or by path, as a list
+        of Sources in the order they are placed.
+    """
+    if text is None:
+        path = os.path.abspath(path)
+        with open(path) as fin:
+            text = fin.read()
+        base_dir = os.path.dirname(path)
+    base_dir = base_dir or os.getcwd()
+
+    macros = {}
+    files = []
+    seen = set() if path is None else {os.path.realpath(path)}
+
+    def visit(path: str | None, text: str, base_dir: str):
+        lines, includes = split_file(text.strip().split("\n"), macros)
+        files.append((path, lines))
+        for include in includes:
+            included = os.path.abspath(os.path.join(base_dir, include))
+            if os.path.realpath(included) in seen:
+                continue
+            seen.add(os.path.realpath(included))
+            with open(included) as fin:
+                visit(included, fin.read(), os.path.dirname(included))
+
+    visit(path, text, base_dir)
+    # Macros are expanded once every file has been read, so a file can use
+    # macros from files included after it
+    return [Source(path, expand_macros(lines, macros, file_tag(path))) for path, lines in files]
+
+
+def expand(text: str, base_dir: str | None = None) -> list:
+    """
+    Lines of a program given as text, with every included file appended
+        and macros expanded.
+    """
+    return [line for source in read_sources(text, base_dir=base_dir) for line in source.lines]
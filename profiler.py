@@ -0,0 +1,205 @@
+# Counts where programs spend their cycles.
+
+from collections import Counter
+
+from execute import ExecutionError
+from predecode import DecodeCache, predecode
+from utils.reg_names import VREG_NAMES
+
+BRANCHES = ("bn", "bz", "bp")
+SLOW_PATH = (*BRANCHES, "jalr", "lw", "sw")
+
+
+class Profiler:
+    """
+    Execution engine that runs like DecodeCache.run() and counts, over all
+    runs until reset():
+        pcs: executions of each address, as a list indexed by address
+        taken, not_taken: outcomes of each branch, by address
+        reads, writes: lw/sw accesses to each memory address
+        leaders: addresses that start a basic block
+
+    Only the address is counted for most instructions; loads, stores,
+    branches and jumps take a slower path. Opcode counts are derived from
+    the instruction at each address when they are asked for, so they are
+    approximate for code that rewrites itself.
+    A branch to the next instruction counts as not taken.
+    """
+    def __init__(self, decoded: DecodeCache):
+        self.decoded = decoded
+        self.reset()
+
+    def reset(self):
+        self.pcs = [0] * len(self.decoded.mem)
+        self.taken = Counter()
+        self.not_taken = Counter()
+        self.reads = Counter()
+        self.writes = Counter()
+        self.leaders = set()
+        self.cycles = 0
+        # Instruction word -> Decoded for the slow path, or None
+        self.special = {}
+
+    def run(self, reg: list, pc: int, max_cycles: int | None = None):
+        """
+        Execute from pc until the program halts (pc == 0) or max_cycles
+            instructions have run. Returns (pc, cycles).
+        Raises ExecutionError if an instruction fails.
+        """
+        entries, mem, fill = self.decoded.entries, self.decoded.mem, self.decoded.fill
+        pcs, special = self.pcs, self.special
+        size = len(mem)
+        self.leaders.add(pc)
+        cycles = 0
+        try:
+            while pc != 0 and (max_cycles is None or cycles < max_cycles):
+                op = entries[pc] or fill(pc)
+                pcs[pc] += 1
+                inst = mem[pc]
+                if inst not in special:
+                    d = predecode(inst)
+                    special[inst] = d if d.name in SLOW_PATH else None
+                d = special[inst]
+                if d is None:
+                    pc = op(reg, mem, pc)
+                    cycles += 1
+                    continue
+
+                name, rs, rd, ro, imm = d
+                # Bad register indices are left for op to raise
+                if name == "lw" and rs < len(reg) and reg[rs] + imm < size:
+                    self.reads[(reg[rs] + imm) % size] += 1
+                elif name == "sw":
+                    self.writes[(rs + imm) % size] += 1
+
+                new_pc = op(reg, mem, pc)
+                cycles += 1
+                if name in BRANCHES:
+                    if new_pc == pc + 1:
+                        self.not_taken[pc] += 1
+                    else:
+                        self.taken[pc] += 1
+                        self.leaders.add(new_pc)
+                    self.leaders.add(pc + 1)
+                elif name == "jalr":
+                    self.leaders.add(new_pc)
+                    self.leaders.add(pc + 1)
+                pc = new_pc
+        except Exception as e:
+            raise ExecutionError(pc, e, cycles) from e
+        finally:
+            self.cycles += cycles
+        return pc, cycles
+
+    def counts(self) -> Counter:
+        """
+        Executions of each address that ran.
+        """
+        return Counter({pc: n for pc, n in enumerate(self.pcs) if n})
+
+    def opcodes(self) -> Counter:
+        """
+        Executions of each opcode.
+        """
+        opcodes = Counter()
+        for pc, n in self.counts().items():
+            opcodes[predecode(self.decoded.mem[pc]).name] += n
+        return opcodes
+
+    def blocks(self, labels: dict | None = None) -> Counter:
+        """
+        Executions of each basic block, by start address.
+            Blocks start at branch targets, after branches and jumps, and
+            at labels.
+        """
+        leaders = set(self.leaders)
+        if labels:
+            leaders.update(labels.values())
+        return Counter({pc: n for pc, n in self.counts().items() if pc in leaders})
+
+    def report(self, interp, top: int = 10) -> str:
+        """
+        Summary of the counters, with addresses mapped back to the
+            labels and source lines of interp's program.
+        """
+        by_addr = sorted((addr, label) for label, addr in interp.labels.items())
+
+        def where(addr: int) -> str:
+            label = None
+            for start, name in by_addr:
+                if start > addr:
+                    break
+                label = f"{name}+{addr - start}" if addr != start else name
+            line_no = interp.line_of.get(addr)
+            source = ""
+            if line_no is not None:
+                source = f"  line {line_no + 1}: {interp.source_lines[line_no].strip()}"
+            return f"{addr:#06x} {label or '':<16}{source}"
+
+        def slot(addr: int) -> str:
+            # Virtual registers live in memory words 1-15
+            if 1 <= addr < len(VREG_NAMES) and VREG_NAMES[addr]:
+                return f"{addr:#06x} ({VREG_NAMES[addr][1]})"
+            return f"{addr:#06x}"
+
+        counts = self.counts()
+        total = max(self.cycles, 1)
+        out = [f"Cycles: {self.cycles}"]
+
+        out.append("\nOpcodes:")
+        for name, n in self.opcodes().most_common():
+            out.append(f"\t{name:<6}{n:>10} {100 * n / total:6.2f}%")
+
+        out.append(f"\nHottest instructions:")
+        for pc, n in counts.most_common(top):
+            out.append(f"\t{n:>10} {100 * n / total:6.2f}%  {where(pc)}")
+
+        lines = Counter()
+        for pc, n in counts.items():
+            if pc in interp.line_of:
+                lines[interp.line_of[pc]] += n
+        if lines:
+            out.append(f"\nHottest source lines:")
+            for line_no, n in lines.most_common(top):
+                out.append(f"\t{n:>10} {100 * n / total:6.2f}%  line {line_no + 1}: "
+                           f"{interp.source_lines[line_no].strip()}")
+
+        out.append(f"\nHottest blocks:")
+        for pc, n in self.blocks(interp.labels).most_common(top):
+            out.append(f"\t{n:>10}  {where(pc)}")
+
+        branches = self.taken + self.not_taken
+        if branches:
+            out.append(f"\nBranches (taken / not taken):")
+            for pc, n in branches.most_common(top):
+                out.append(f"\t{self.taken[pc]:>10} / {self.not_taken[pc]:<10}  {where(pc)}")
+
+        for title, accesses in (("Memory reads", self.reads), ("Memory writes", self.writes)):
+            if accesses:
+                out.append(f"\n{title}:")
+                for addr, n in accesses.most_common(top):
+                    out.append(f"\t{n:>10}  {slot(addr)}")
+
+        return "\n".join(out)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from interpreter import Interpreter
+
+    if len(sys.argv) < 2:
+        print(f"Usage: profiler.py <script> [max_cycles]")
+        exit(1)
+
+    with open(sys.argv[1]) as fin:
+        prog = fin.read()
+    max_cycles = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    interp = Interpreter()
+    interp.load_prog(prog)
+    try:
+        interp.run(trace=False, max_cycles=max_cycles, engine="profile")
+    except ExecutionError as e:
+        print(e)
+    print(interp.profiler.report(interp))
@@ -0,0 +1,319 @@
+# Register allocation for virtual registers.
+#
+# utils.pseudo.expand keeps every virtual register in its memory word
+# (1-15) and loads and stores it around each use. When a program never
+# names r3 or r4, this pass gives those registers to the most used
+# virtual registers instead, renaming them in the source before it is
+# expanded, so their loads and stores disappear. r1 and r2 stay the
+# expansions' scratch registers, and r5 does not exist at run time.
+#
+# Virtual registers whose live ranges over the control flow graph do not
+# overlap may share a physical register. Uses are weighted by loop depth,
+# so registers used in inner loops are promoted first. Promoted registers
+# are loaded from memory at the start when their initial value is used,
+# and stored back before halting ("halt", a raw jalr, which may jump to 0,
+# and running off the end), so their memory words hold the same values
+# when the program stops. While it runs they may not, so a register is
+# not promoted if its word is accessed directly (e.g. "lw 2, 3(0)", or a
+# sw, which stores by register index), or it is an operand of lw or sw.
+# Loads through pointers into words 1-15 are assumed not to happen.
+#
+# Fewer expansions means r1 and r2 are loaded less often, so code that
+# reads them after using a virtual register (including the lw and sw
+# expansions and jumps through r1) can see other values, and r1-r4 may
+# differ when the program stops.
+#
+# Like the peephole optimizer, this pass leaves programs that branch by
+# numeric offset alone, since inserted words would move their targets.
+
+from typing import NamedTuple
+
+from encode import BR_TYPE, MEM_ARG, parse, width
+from utils.literals import parse_literal
+from utils.reg_names import REG_IDX, VREG_NAMES, is_vreg, vr2idx
+
+# Physical registers that can hold virtual registers
+CANDIDATES = (3, 4)
+# Weight of a use inside each level of loop nesting
+LOOP_WEIGHT = 10
+
+# Argument roles by opcode: d is written, s read, m is a memory operand
+# "imm(base)" whose base is read
+ROLES = {
+    "add": "dss", "nand": "dss", "addi": "ds", "nandi": "ds",
+    "swb": "ds", "sl": "ds", "sr": "ds", "mv": "ds", "neg": "ds",
+    "jalr": "ds", "lw": "dm", "sw": "sm", "li": "d",
+    "bn": "s", "bz": "s", "bp": "s",
+}
+
+
+class AllocReport(NamedTuple):
+    """
+    What the allocator did to a program.
+        promoted: virtual register -> physical register index
+        spilled: virtual registers left in memory
+        words_before, words_after: program size in words
+    """
+    promoted: dict
+    spilled: tuple
+    words_before: int
+    words_after: int
+
+    @property
+    def words_saved(self) -> int:
+        return self.words_before - self.words_after
+
+
+def vreg_name(slot: int) -> str:
+    """
+    Canonical name of the virtual register in a memory word, e.g. "a0".
+    """
+    return VREG_NAMES[slot][1]
+
+
+def base_of(arg: str) -> tuple:
+    """
+    Split a memory operand "imm(base)" into (imm, base).
+    """
+    found = MEM_ARG.findall(arg)
+    if not found:
+        raise SyntaxError(f"Expected imm(reg), got '{arg}'")
+    return found[0]
+
+
+class Inst:
+    """
+    An instruction with the virtual registers (as memory words) it
+        reads and writes, and the instructions that can run after it.
+    """
+    def __init__(self, line_no: int, labels: list, text: str):
+        self.line_no = line_no
+        self.labels = labels
+        self.text = text
+        self.opcode, self.args = parse(text)
+        self.uses = set()
+        self.defs = set()
+        self.succ = []
+        for role, arg in zip(ROLES.get(self.opcode, ""), self.args):
+            if role == "m":
+                arg = base_of(arg)[1]
+            if is_vreg(arg):
+                (self.defs if role == "d" else self.uses).add(vr2idx(arg))
+
+
+def analyse(insts: list) -> tuple:
+    """
+    Build the control flow graph. Returns (Insts, slots that cannot be
+        promoted, physical registers the program names). Index len(insts)
+        stands for running off the end.
+    """
+    code = [Inst(*inst) for inst in insts]
+    end = len(code)
+    targets = {}
+    for i, inst in enumerate(code):
+        for label in inst.labels:
+            targets[label] = i
+
+    pinned = set()
+    named = set()
+    # Where a raw jalr can go: any label, or back after a jal
+    anywhere = sorted(set(targets.values()) |
+                      {i + 1 for i, inst in enumerate(code) if inst.opcode == "jal"} | {end})
+
+    for i, inst in enumerate(code):
+        for role, arg in zip(ROLES.get(inst.opcode, ""), inst.args):
+            imm = None
+            if role == "m":
+                imm, arg = base_of(arg)
+            if arg in REG_IDX:
+                named.add(REG_IDX[arg])
+            # Words addressed directly: lw from r0, or sw by any index
+            if role == "m" and arg in REG_IDX and (inst.opcode == "sw" or REG_IDX[arg] == 0):
+                value = parse_literal(imm)
+                if value is not None:
+                    pinned.add(REG_IDX[arg] + value if inst.opcode == "sw" else value)
+        if inst.opcode in ("lw", "sw") and inst.uses | inst.defs:
+            # These expand to go through r1 and r2 whatever the operands,
+            # and the stores to word 1
+            pinned |= inst.uses | inst.defs
+            if inst.opcode == "sw":
+                pinned.add(1)
+
+        match inst.opcode:
+            case "j":
+                inst.succ = [targets.get(inst.args[0], end)]
+            case "jal":
+                # jalr 1, 1 links before reading r1, so it may fall through
+                inst.succ = [i + 1, targets.get(inst.args[0], end)]
+            case "halt":
+                inst.succ = []
+            case "jalr":
+                inst.succ = anywhere
+            case _ if inst.opcode in BR_TYPE:
+                inst.succ = [i + 1, targets.get(inst.args[1], end)]
+            case _:
+                inst.succ = [i + 1]
+    return code, pinned, named
+
+
+def liveness(code: list, slots: set) -> list:
+    """
+    Virtual registers live into each instruction. Every register counts
+        as used when the program may stop, since its memory word is then
+        the result.
+    """
+    end = len(code)
+    exits = {i for i, inst in enumerate(code) if inst.opcode in ("halt", "jalr")}
+    live_in = [set() for _ in range(end + 1)]
+    live_in[end] = set(slots)
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(end)):
+            inst = code[i]
+            out = set()
+            for s in inst.succ:
+                out |= live_in[s]
+            new = (out - inst.defs) | inst.uses
+            if i in exits:
+                new |= slots
+            if new != live_in[i]:
+                live_in[i] = new
+                changed = True
+    return live_in
+
+
+def loop_depths(code: list) -> list:
+    """
+    How many backward jumps enclose each instruction.
+    """
+    depth = [0] * len(code)
+    for i, inst in enumerate(code):
+        for s in inst.succ:
+            if s <= i and inst.opcode != "jalr":
+                for k in range(s, i + 1):
+                    depth[k] += 1
+    return depth
+
+
+def allocate(insts: list, pending_labels: list) -> tuple:
+    """
+    Allocate registers in a program given as (line_no, labels, inst)
+        tuples and the labels after its end, as built by
+        Interpreter.load_prog. Returns the new list, the labels now after
+        its end, and an AllocReport.
+    """
+    words_before = sum(width(inst) for _, _, inst in insts)
+    unchanged = (insts, pending_labels, AllocReport({}, (), words_before, words_before))
+
+    for _, _, inst in insts:
+        opcode, args = parse(inst)
+        if opcode in BR_TYPE and len(args) == 2 and parse_literal(args[1]) is not None:
+            return unchanged
+
+    code, pinned, named = analyse(insts)
+    free = [r for r in CANDIDATES if r not in named]
+    slots = set()
+    for inst in code:
+        slots |= inst.uses | inst.defs
+    if not free or not slots:
+        return unchanged
+
+    live_in = liveness(code, slots)
+    depth = loop_depths(code)
+    weight = dict.fromkeys(slots, 0)
+    for inst, d in zip(code, depth):
+        for slot in inst.uses | inst.defs:
+            weight[slot] += LOOP_WEIGHT ** d
+
+    interferes = {slot: set() for slot in slots}
+    def conflict(a: int, b: int):
+        if a != b:
+            interferes[a].add(b)
+            interferes[b].add(a)
+    for i, inst in enumerate(code):
+        out = set()
+        for s in inst.succ:
+            out |= live_in[s]
+        for d in inst.defs:
+            for v in out:
+                conflict(d, v)
+    for a in live_in[0]:
+        for b in live_in[0]:
+            conflict(a, b)
+
+    assigned = {}
+    for slot in sorted(slots - pinned, key=lambda s: (-weight[s], s)):
+        taken = {assigned[other] for other in interferes[slot] if other in assigned}
+        for r in free:
+            if r not in taken:
+                assigned[slot] = r
+                break
+    if not assigned:
+        return unchanged
+
+    def rename(arg: str) -> str:
+        if arg in MEM_NAMES:
+            return str(assigned[MEM_NAMES[arg]])
+        found = MEM_ARG.findall(arg)
+        if found and found[0][1] in MEM_NAMES:
+            return f"{found[0][0]}({assigned[MEM_NAMES[found[0][1]]]})"
+        return arg
+
+    MEM_NAMES = {}
+    for slot in assigned:
+        for name in VREG_NAMES[slot]:
+            MEM_NAMES[name] = slot
+
+    def write_back(line_no: int, labels: list) -> list:
+        stores = [(line_no, [], f"sw {r}, {slot}(0)") for slot, r in sorted(assigned.items())]
+        stores[0] = (line_no, labels, stores[0][2])
+        return stores
+
+    out = [(code[0].line_no if code else 0, [], f"lw {r}, {slot}(0)")
+           for slot, r in sorted(assigned.items()) if slot in live_in[0]]
+    for inst in code:
+        text = inst.text
+        if inst.args and any(rename(arg) != arg for arg in inst.args):
+            text = f"{inst.opcode} " + ", ".join(rename(arg) for arg in inst.args)
+        labels = inst.labels
+        if inst.opcode in ("halt", "jalr"):
+            out.extend(write_back(inst.line_no, labels))
+            labels = []
+        out.append((inst.line_no, labels, text))
+    # Jumps to the end must also write back
+    out.extend(write_back(code[-1].line_no, pending_labels))
+
+    promoted = {vreg_name(slot): r for slot, r in sorted(assigned.items())}
+    spilled = tuple(vreg_name(slot) for slot in sorted(slots - set(assigned)))
+    words_after = sum(width(inst) for _, _, inst in out)
+    return out, [], AllocReport(promoted, spilled, words_before, words_after)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from interpreter import Interpreter
+
+    if len(sys.argv) < 2:
+        print(f"Usage: regalloc.py <script> [max_cycles]")
+        exit(1)
+
+    with open(sys.argv[1]) as fin:
+        prog = fin.read()
+    max_cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+
+    results = []
+    for allocate in (False, True):
+        interp = Interpreter()
+        words = interp.load_prog(prog, allocate=allocate)
+        result = interp.run(trace=False, max_cycles=max_cycles)
+        results.append((words, result, list(interp.mem[1:16])))
+        if allocate:
+            print(interp.alloc_report)
+
+    (words, plain, plain_vregs), (alloc_words, alloc, alloc_vregs) = results
+    print(f"Words: {words} -> {alloc_words} ({words - alloc_words} saved)")
+    print(f"Cycles: {plain.cycles} -> {alloc.cycles} ({plain.cycles - alloc.cycles} saved)")
+    if plain_vregs != alloc_vregs or plain.halted != alloc.halted:
+        print("Results differ!")
@@ -0,0 +1,235 @@
+# Picks the shortest encoding of label-dependent instructions.
+#
+# Widths have to be known before label addresses are, so encode.lower
+# gives "li rd, label" (and the li in "j label" and "jal label") its
+# three-word form, and a branch to a label further than its 8-bit offset
+# reaches fails to assemble. Once addresses are known:
+#   - li loads the label's value with as few words as encode.load_imm can,
+#     as does li of a literal, which always takes one or three words
+#     otherwise so that layouts do not change unless this pass is asked for
+#   - j becomes "bz r0, label" when the label is in reach of a branch,
+#     which is always taken and leaves r1 alone
+#   - branches that cannot reach their label jump there instead, behind
+#     the opposite branch:
+#       bz r, far  ->  bp r, skip / j far / skip:
+#       bp r, far  ->  bz r, skip / j far / skip:
+#       bn r, far  ->  bn r, go / bz r0, skip / go: j far / skip:
+#     Like j, they clobber r1 when taken.
+# Branch offsets whose low byte sets the register field (bits 5-7) to 5
+# or more decode as a bad register and fail when executed, so those are
+# out of range too: a branch reaches 127 words forward or 97-128 back.
+#
+# Like the peephole optimizer, this pass leaves programs that branch by
+# numeric offset alone, since resized instructions would move their
+# targets.
+#
+# Resizing moves labels, which can change what fits, so this starts with
+# every instruction at its smallest and grows any that no longer fit
+# until nothing changes. Sizes only grow, so it always stops; an
+# instruction that ends up longer than it needs is padded with nops.
+#
+# Usage:
+#   Interpreter.load_prog(prog, relax=True)
+
+from typing import NamedTuple
+
+from encode import BR_TYPE, flatten, load_imm, parse, width
+from utils.literals import parse_literal
+from utils.reg_names import is_vreg
+
+NOP = "add 0, 0, 0"
+# Opposite of each branch, given that registers are never negative
+INVERSE = {"bz": "bp", "bp": "bz"}
+
+
+class RelaxReport(NamedTuple):
+    """
+    What relaxation did to a program.
+        words_before, words_after: program size in words
+        shortened: li, j and jal instructions given a shorter form
+        relaxed: branches turned into jumps
+        padding: nops added to instructions that grew past their size
+        passes: layouts tried
+    """
+    words_before: int
+    words_after: int
+    shortened: int
+    relaxed: int
+    padding: int
+    passes: int
+
+    @property
+    def words_saved(self) -> int:
+        return self.words_before - self.words_after
+
+
+def label_arg(inst: str) -> str | None:
+    """
+    The label a relaxable instruction depends on, or None. Instructions
+        on virtual registers expand around the load, so they are left as
+        they are.
+    """
+    opcode, args = parse(inst)
+    if args and is_vreg(args[0]):
+        return None
+    if opcode == "li" and len(args) == 2:
+        arg = args[1]
+    elif opcode in ("j", "jal") and len(args) == 1:
+        arg = args[0]
+    elif opcode in BR_TYPE and len(args) == 2:
+        arg = args[1]
+    else:
+        return None
+    return arg if parse_literal(arg) is None else None
+
+
+def branch_reaches(offset: int) -> bool:
+    """
+    Whether a branch can encode the offset and run.
+    """
+    return 0 <= offset < 0x80 or -0x80 <= offset < -0x60
+
+
+def jump(link: str, target: int) -> list:
+    return load_imm("1", target, shortest=True) + [f"jalr {link}, 1"]
+
+
+def literal_load(inst: str) -> list | None:
+    """
+    The shortest load for "li rd, value", or None for other instructions.
+    """
+    opcode, args = parse(inst)
+    if opcode != "li" or len(args) != 2 or is_vreg(args[0]):
+        return None
+    value = parse_literal(args[1])
+    return None if value is None else load_imm(args[0], value & 0xFFFF, shortest=True)
+
+
+def shortest(inst: str, addr: int, labels: dict) -> list:
+    """
+    The fewest instructions that do what inst does at addr.
+    """
+    opcode, args = parse(inst)
+    label = label_arg(inst)
+    if label not in labels:
+        raise NameError(f"Label '{label}' not found")
+    target = labels[label]
+    if opcode == "li":
+        return load_imm(args[0], target, shortest=True)
+    if opcode == "j":
+        if branch_reaches(target - addr):
+            return [f"bz 0, {label}"]
+        return jump("0", target)
+    if opcode == "jal":
+        return jump("1", target)
+
+    rs = args[0]
+    if branch_reaches(target - addr):
+        return [inst]
+    far = jump("0", target)
+    if opcode in INVERSE:
+        return [f"{INVERSE[opcode]} {rs}, {len(far) + 1}"] + far
+    return [f"bn {rs}, 2", f"bz 0, {len(far) + 1}"] + far
+
+
+def relax(insts: list, pending_labels: list, start: int) -> tuple:
+    """
+    Relax a program given as (line_no, labels, inst) tuples and the labels
+        after its end, as built by Interpreter.load_prog, to be loaded at
+        start. Returns the new list and a RelaxReport.
+    """
+    words_before = sum(width(inst) for _, _, inst in insts)
+
+    # Numeric branch offsets would break once words move
+    for _, _, inst in insts:
+        for sub in flatten(inst):
+            opcode, args = parse(sub)
+            if opcode in BR_TYPE and len(args) == 2 and parse_literal(args[1]) is not None:
+                return insts, RelaxReport(words_before, words_before, 0, 0, 0, 0)
+
+    # j and jal stay whole, since they can become a branch. Loads of
+    # literals have a fixed size, so they take their shortest form here
+    flat = []
+    shortened = 0
+    for line_no, labels, inst in insts:
+        subs = []
+        for sub in [inst] if label_arg(inst) is not None else flatten(inst):
+            load = literal_load(sub)
+            if load is not None and len(load) < width(sub):
+                shortened += 1
+                subs += load
+            else:
+                subs.append(sub)
+        for i, sub in enumerate(subs):
+            flat.append((line_no, labels if i == 0 else [], sub))
+
+    relaxable = [label_arg(inst) is not None for _, _, inst in flat]
+    sizes = [0 if r else width(inst) for (_, _, inst), r in zip(flat, relaxable)]
+    passes = 0
+    changed = True
+    while changed:
+        passes += 1
+        labels = {}
+        addrs = []
+        addr = start
+        for (_, inst_labels, _), size in zip(flat, sizes):
+            for label in inst_labels:
+                labels[label] = addr
+            addrs.append(addr)
+            addr += size
+        for label in pending_labels:
+            labels[label] = addr
+
+        changed = False
+        for i, (_, _, inst) in enumerate(flat):
+            if relaxable[i]:
+                need = sum(width(sub) for sub in shortest(inst, addrs[i], labels))
+                if need > sizes[i]:
+                    sizes[i] = need
+                    changed = True
+
+    out = []
+    relaxed = padding = 0
+    for (line_no, inst_labels, inst), addr, size, r in zip(flat, addrs, sizes, relaxable):
+        if not r:
+            out.append((line_no, inst_labels, inst))
+            continue
+        subs = shortest(inst, addr, labels)
+        used = sum(width(sub) for sub in subs)
+        subs += [NOP] * (size - used)
+        padding += size - used
+        if parse(inst).opcode in BR_TYPE:
+            relaxed += len(subs) > 1
+        elif used < width(inst):
+            shortened += 1
+        for i, sub in enumerate(subs):
+            out.append((line_no, inst_labels if i == 0 else [], sub))
+
+    words_after = sum(width(inst) for _, _, inst in out)
+    return out, RelaxReport(words_before, words_after, shortened, relaxed, padding, passes)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from interpreter import Interpreter
+
+    if len(sys.argv) < 2:
+        print(f"Usage: relax.py <script> [max_cycles]")
+        exit(1)
+
+    with open(sys.argv[1]) as fin:
+        prog = fin.read()
+    max_cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+
+    for relaxed in (False, True):
+        interp = Interpreter()
+        try:
+            words = interp.load_prog(prog, relax=relaxed)
+        except Exception as e:
+            print(f"relax={relaxed}: does not assemble ({e})")
+            continue
+        result = interp.run(trace=False, max_cycles=max_cycles)
+        print(f"relax={relaxed}: {words} words, {result.cycles} cycles")
+        if relaxed:
+            print(interp.relax_report)
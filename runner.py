@@ -0,0 +1,196 @@
+# Runs batches of programs and inputs across worker processes.
+#
+# The manifest is a JSON lines file with one job per line:
+#   {"id": "fib-10",                  optional, defaults to the line number
+#    "program": "scripts/fib_2.S",    assembly source or object file
+#    "reg": {"in": 10, "a0": 3},      registers; virtual registers set
+#                                     their memory word
+#    "mem": {"0x20": [1, 2, 3]},      words written from an address or label
+#    "max_cycles": 100000,            optional cycle limit
+#    "engine": "blocks",              optional, see Interpreter.run
+#    "dump": [[0, 16], ["data", 4]]}  memory to report, as [start, length]
+#
+# Each program is assembled once in the parent and sent to the workers as
+# an object file (see objfile.py). Results are written as JSON lines, in
+# manifest order, as soon as each one is ready.
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+import objfile
+from execute import ExecutionError
+from interpreter import Interpreter
+from utils.reg_names import REG_IDX, is_vreg, vr2idx
+
+# Set in each worker by init_worker: program path -> object file bytes,
+# or the error message if it failed to assemble
+PROGRAMS = {}
+# Object files parsed so far in this worker
+LOADED = {}
+
+
+def assemble(path: str) -> bytes:
+    """
+    Object file bytes for a program, assembling it if it is source.
+    """
+    with open(path, "rb") as fin:
+        data = fin.read()
+    if objfile.is_object(data):
+        return data
+
+    interp = Interpreter()
+    # load_prog reports errors on stdout, which carries the results
+    with contextlib.redirect_stdout(sys.stderr):
+        interp.load_prog(data.decode(), base_dir=os.path.dirname(os.path.abspath(path)))
+    return objfile.to_bytes(interp.object())
+
+
+def address(x, labels: dict) -> int:
+    """
+    Address given as an int, a numeric string, or a label.
+    """
+    if isinstance(x, int):
+        return x
+    if x in labels:
+        return labels[x]
+    try:
+        return int(x, 0)
+    except ValueError:
+        raise NameError(f"Label '{x}' not found") from None
+
+
+def set_reg(interp: Interpreter, name: str, value: int):
+    """
+    Set a physical register, or the memory word of a virtual register.
+    """
+    if is_vreg(name):
+        interp.mem[vr2idx(name)] = value & 0xFFFF
+        interp.decoded.invalidate(vr2idx(name))
+        return
+    idx = REG_IDX.get(name)
+    if idx is None or not 0 < idx < len(interp.reg):
+        raise ValueError(f"Cannot set register '{name}'")
+    interp.reg[idx] = value & 0xFFFF
+
+
+def init_worker(programs: dict):
+    PROGRAMS.update(programs)
+
+
+def run_job(job: dict) -> dict:
+    """
+    Run one job from the manifest and describe its outcome.
+    """
+    result = {"id": job["id"], "program": job["program"]}
+    data = PROGRAMS[job["program"]]
+    if isinstance(data, str):
+        result["error"] = f"Assembly failed: {data}"
+        return result
+
+    obj = LOADED.get(job["program"])
+    if obj is None:
+        obj = LOADED[job["program"]] = objfile.from_bytes(data)
+
+    interp = Interpreter(PROG_START=obj.load_addr)
+    try:
+        interp.load_object(obj)
+    except Exception as e:
+        result["error"] = f"Bad job: {e}"
+        return result
+    return run_loaded(interp, job, result)
+
+
+def run_loaded(interp: Interpreter, job: dict, result: dict) -> dict:
+    """
+    Set a job's inputs on an interpreter with its program loaded, run it,
+        and add the outcome to result.
+    """
+    try:
+        for name, value in job.get("reg", {}).items():
+            set_reg(interp, name, value)
+        for addr, values in job.get("mem", {}).items():
+            values = values if isinstance(values, list) else [values]
+            start = address(addr, interp.labels)
+            interp.mem[start:start + len(values)] = [v & 0xFFFF for v in values]
+            # Inputs may overwrite code that has already been decoded
+            for written in range(start, start + len(values)):
+                interp.decoded.invalidate(written)
+    except Exception as e:
+        result["error"] = f"Bad job: {e}"
+        return result
+
+    error = None
+    try:
+        run = interp.run(trace=False, max_cycles=job.get("max_cycles"),
+                         engine=job.get("engine", "predecode"))
+        cycles = run.cycles
+    except ExecutionError as e:
+        error, cycles = str(e), e.cycles
+    except ValueError as e:
+        result["error"] = f"Bad job: {e}"
+        return result
+
+    result.update(cycles=cycles, pc=interp.pc, halted=interp.pc == 0,
+                  reg=list(interp.reg), error=error)
+    if "dump" in job:
+        result["mem"] = {}
+        for start, length in job["dump"]:
+            addr = address(start, interp.labels)
+            result["mem"][str(start)] = list(interp.mem[addr:addr + length])
+    return result
+
+
+def read_manifest(path: str) -> list:
+    """
+    Jobs from a JSON lines manifest, with ids filled in.
+    """
+    jobs = []
+    with open(path) as fin:
+        for line_no, line in enumerate(fin):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            job.setdefault("id", line_no)
+            jobs.append(job)
+    return jobs
+
+
+def run_jobs(jobs: list, processes: int | None = None, chunksize: int = 16):
+    """
+    Run jobs across a pool of processes, yielding results in order.
+    """
+    programs = {}
+    for job in jobs:
+        path = job["program"]
+        if path not in programs:
+            try:
+                programs[path] = assemble(path)
+            except Exception as e:
+                # Passed to workers as the error message
+                programs[path] = str(e)
+
+    with Pool(processes, initializer=init_worker, initargs=(programs,)) as pool:
+        yield from pool.imap(run_job, jobs, chunksize)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a manifest of jobs in parallel.")
+    parser.add_argument("manifest", help="JSON lines file, one job per line")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument("-o", "--output", help="write results here instead of stdout")
+    args = parser.parse_args()
+
+    jobs = read_manifest(args.manifest)
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for result in run_jobs(jobs, args.jobs):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,156 @@
+# Runs many machines on one asyncio event loop.
+#
+# Each machine runs as a task that executes a slice of cycles and then
+# yields, so machines take turns in the order they became ready and get
+# the same number of cycles per turn. The event loop's other tasks run
+# between slices.
+#
+# Usage:
+#   sched = Scheduler(slice_cycles=5_000)
+#   for i, interp in enumerate(machines):
+#       sched.spawn(interp, name=i, timeout=2.0)
+#   await sched.wait()
+#   print(sched.stats[0].cycles)
+
+import asyncio
+import time
+
+from execute import ExecutionError
+from interpreter import SLICE_CYCLES, Interpreter, RunResult
+
+
+class MachineStats:
+    """
+    Accounting for one machine.
+        cycles: instructions executed so far
+        slices: turns taken
+        seconds: time spent executing, excluding waiting for a turn
+        result: RunResult once it finishes
+        error: why it stopped early: the ExecutionError, "timeout" or
+            "cancelled"
+    """
+    def __init__(self, name):
+        self.name = name
+        self.cycles = 0
+        self.slices = 0
+        self.seconds = 0.0
+        self.result = None
+        self.error = None
+        self.last = time.perf_counter()
+
+    def on_slice(self, cycles: int):
+        now = time.perf_counter()
+        self.cycles += cycles
+        self.slices += 1
+        self.seconds += now - self.last
+
+    def resumed(self):
+        self.last = time.perf_counter()
+
+    def __repr__(self) -> str:
+        return (f"MachineStats({self.name!r}, cycles={self.cycles}, slices={self.slices}, "
+                f"seconds={self.seconds:.3f}, error={self.error!r})")
+
+
+class Scheduler:
+    """
+    Multiplexes machines on the running event loop.
+        stats: name -> MachineStats for every machine spawned
+        tasks: name -> asyncio.Task running it
+    """
+    def __init__(self, slice_cycles: int = SLICE_CYCLES, engine: str = "predecode"):
+        self.slice_cycles = slice_cycles
+        self.engine = engine
+        self.stats = {}
+        self.tasks = {}
+
+    def spawn(self, interp: Interpreter, name=None, max_cycles: int | None = None,
+              timeout: float | None = None, resume: bool = False) -> asyncio.Task:
+        """
+        Start running interp as a task. Must be called with an event loop
+            running. The task returns the RunResult, or None if the machine
+            crashed, timed out or was cancelled (see stats[name].error).
+        """
+        name = len(self.stats) if name is None else name
+        if name in self.stats:
+            raise ValueError(f"Machine '{name}' already exists")
+        stats = self.stats[name] = MachineStats(name)
+        task = asyncio.create_task(self.supervise(interp, stats, max_cycles, timeout, resume))
+        self.tasks[name] = task
+        return task
+
+    async def supervise(self, interp: Interpreter, stats: MachineStats,
+                        max_cycles: int | None, timeout: float | None,
+                        resume: bool) -> RunResult | None:
+        def on_slice(cycles: int):
+            stats.on_slice(cycles)
+            # The next slice starts after this machine's turn comes round
+            loop.call_soon(stats.resumed)
+
+        loop = asyncio.get_running_loop()
+        stats.resumed()
+        run = interp.run_async(max_cycles, self.engine, resume, self.slice_cycles, on_slice)
+        try:
+            stats.result = await asyncio.wait_for(run, timeout)
+        except asyncio.TimeoutError:
+            stats.error = "timeout"
+        except ExecutionError as e:
+            stats.error = e
+        except asyncio.CancelledError:
+            stats.error = "cancelled"
+            raise
+        return stats.result
+
+    def cancel(self, name):
+        """
+        Stop a machine after its current slice.
+        """
+        self.tasks[name].cancel()
+
+    async def wait(self) -> dict:
+        """
+        Wait for every machine to finish. Returns name -> RunResult or None.
+        """
+        results = await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        return {name: result if isinstance(result, RunResult) else None
+                for name, result in zip(self.tasks, results)}
+
+
+if __name__ == "__main__":
+    # Run several copies of a program side by side, with a heartbeat
+    # task to show the event loop stays responsive
+    import sys
+
+    if len(sys.argv) < 2:
+        print(f"Usage: scheduler.py <script> [machines] [timeout]")
+        exit(1)
+    with open(sys.argv[1]) as fin:
+        prog = fin.read()
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    timeout = float(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    async def main():
+        beats = 0
+
+        async def heartbeat():
+            nonlocal beats
+            while True:
+                await asyncio.sleep(0.01)
+                beats += 1
+
+        beat = asyncio.create_task(heartbeat())
+        sched = Scheduler()
+        start = time.perf_counter()
+        for i in range(n):
+            interp = Interpreter()
+            interp.load_prog(prog)
+            sched.spawn(interp, timeout=timeout)
+        await sched.wait()
+        elapsed = time.perf_counter() - start
+        beat.cancel()
+
+        for stats in sched.stats.values():
+            print(stats)
+        print(f"{elapsed:.3f}s, {beats} heartbeats")
+
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from batch import BatchMachine
+from execute import ExecutionError
+from testing import loaded, run
+
+# r3 is each lane's input; r3 == 0 jumps to a word with a bad register
+PROG = "bz 3, bad\nloop: addi 4, 4, 2\naddi 3, 3, -1\nbz 3, done\nj loop\ndone: halt\nbad: .fill 0xFFFF"
+
+
+def test_lanes_match_single_machines():
+    inputs = [0, 1, 2, 5, 9, 30]
+    machine = BatchMachine(loaded(PROG), len(inputs))
+    machine.reg[:, 3] = inputs
+    result = machine.run(max_cycles=100)
+    for lane, value in enumerate(inputs):
+        interp = loaded(PROG)
+        interp.reg[3] = value
+        try:
+            expected = run(interp, max_cycles=100)
+            error = None
+        except ExecutionError as e:
+            expected, error = None, e
+        assert (result.errors[lane] is None) == (error is None)
+        if error is None:
+            assert list(result.reg[lane]) == expected.reg
+            assert (result.pc[lane], result.cycles[lane]) == (expected.pc, expected.cycles)
+            assert result.halted[lane] == expected.halted
+            assert (machine.mem[lane] == np.array(interp.mem, dtype=np.uint16)).all()
+        else:
+            assert result.cycles[lane] == error.cycles
+    assert result.errors[0] is not None
+    # The 30 lane runs out of cycles
+    assert not result.halted[-1] and result.errors[-1] is None
@@ -0,0 +1,43 @@
+from encode import encode
+from mmio import InputStream, OutputBuffer
+from testing import LOOP, loaded, run, script
+
+
+def test_matches_predecode():
+    for prog in (LOOP, script("fib_2.S")):
+        plain, blocks = loaded(prog), loaded(prog)
+        assert run(blocks, engine="blocks") == run(plain, engine="predecode")
+        assert blocks.mem == plain.mem
+
+
+def test_stops_at_max_cycles_inside_a_block():
+    for n in range(0, 40, 3):
+        plain, blocks = loaded(), loaded()
+        assert run(blocks, engine="blocks", max_cycles=n) == run(plain, engine="predecode", max_cycles=n)
+        assert blocks.mem == plain.mem
+
+
+def test_rewritten_code_is_retranslated():
+    plain, blocks = loaded(), loaded()
+    run(plain, engine="predecode")
+    run(blocks, engine="blocks")
+    addr = blocks.labels["loop"] + 1
+    word = encode("add 1, 1, 1", addr, {})[0]
+    for interp in (plain, blocks):
+        interp.mem[addr] = word
+        interp.decoded.invalidate(addr)
+    assert run(blocks, engine="blocks") == run(plain, engine="predecode")
+    assert blocks.mem == plain.mem
+
+
+def test_device_accesses_in_blocks():
+    prog = "lw 3, -16(0)\nadd 4, 3, 3\nsw 4, -14(0)\nlw 3, -16(0)\nsw 3, -14(0)\nhalt"
+    outputs = []
+    for engine in ("predecode", "blocks"):
+        interp = loaded(prog)
+        out = []
+        interp.attach(InputStream([5, 8]), 0xFFF0)
+        interp.attach(OutputBuffer(out.extend), 0xFFF2)
+        run(interp, engine=engine)
+        outputs.append(out)
+    assert outputs[0] == outputs[1] == [10, 8]
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from client import Client
+from daemon import Daemon
+
+PROG = "li a0, 5\nadd a1, a0, a0\nhalt"
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    server = Daemon(path, cache_size=4)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def connect(path: str) -> Client:
+    client = Client(path)
+    client.sock.settimeout(10)
+    return client
+
+
+def test_runs_cached_programs(daemon):
+    with connect(daemon) as client:
+        first = client.request({"op": "run", "source": PROG, "dump": [[0, 16]]})
+        again = client.request({"op": "run", "hash": first["hash"], "dump": [[0, 16]]})
+        assert first["mem"] == again["mem"]
+        assert first["mem"]["0"][3:5] == [5, 10]
+        stats = client.request({"op": "stats"})
+        assert (stats["programs"], stats["hits"], stats["misses"], stats["runs"]) == (1, 1, 1, 2)
+
+
+def test_open_connection_does_not_block_others(daemon):
+    with connect(daemon) as idle, connect(daemon) as busy:
+        idle.request({"op": "stats"})
+        # idle keeps its connection open while busy is served
+        assert busy.request({"op": "run", "source": PROG})["halted"]
+
+
+def test_concurrent_runs_of_one_program(daemon):
+    with connect(daemon) as client:
+        key = client.request({"op": "assemble", "source": PROG})["hash"]
+    results = []
+
+    def work():
+        with connect(daemon) as client:
+            for _ in range(20):
+                results.append(client.request({"op": "run", "hash": key,
+                                               "dump": [[0, 16]]})["mem"])
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 80
+    assert all(result == results[0] for result in results)
+
+
+def test_source_includes_are_hashed_as_expanded(daemon, tmp_path):
+    lib = tmp_path / "lib.S"
+    source = '.include "lib.S"\nj value\ndone: halt'
+    request = {"op": "run", "source": source, "base_dir": str(tmp_path)}
+    with connect(daemon) as client:
+        lib.write_text("value: li 3, 1\nj done")
+        first = client.request(request)
+        lib.write_text("value: li 3, 2\nj done")
+        second = client.request(request)
+        assert first["hash"] != second["hash"]
+        assert (first["reg"][3], second["reg"][3]) == (1, 2)
+        # Relative includes would otherwise be found from the daemon's directory
+        assert "base_dir" in client.request({"op": "run", "source": source})["error"]
@@ -0,0 +1,69 @@
+import pytest
+
+from decode import Disassembled, decode, disassemble, fields
+from encode import encode
+from testing import loaded, script
+
+# Words and what the decoder printed for them before the table
+DECODED = {
+    0x0000: "jalr 0, 0",
+    0x0320: "jalr 1, 3",
+    0x1000: "lw 0, 0(0)",
+    0x1234: "lw 1, -12(2)",
+    0x2000: ".fill 8192",
+    0x2864: "bn 0, 100",
+    0x3123: "bz 1, 35",
+    0x4000: "swb 0, 0",
+    0x6310: "add 0, 3, 4",
+    0x6824: ".fill 26660",
+    0x8c25: "addi 1, 4, 37",
+}
+# Words naming registers that do not exist, and the index reported
+INVALID = {0x1fe0: 7, 0xffff: 7, 0x86e0: 6, 0x66e4: 6, 0x1ee0: 6}
+
+
+def test_decode_is_unchanged():
+    for word, text in DECODED.items():
+        assert decode(word) == text
+    for word, idx in INVALID.items():
+        with pytest.raises(ValueError, match=f"Invalid register index: {idx}"):
+            decode(word)
+    with pytest.raises(ValueError):
+        decode(1 << 16)
+    with pytest.raises(TypeError):
+        decode("add")
+
+
+def test_decode_inverts_encode():
+    for inst in ("add 1, 2, 3", "nand 4, 5, 0", "addi 3, 2, -128", "nandi 1, 1, 127",
+                 "sl 2, 3", "sr 4, 4", "swb 1, 5", "lw 3, -16(0)", "sw 2, 15(4)",
+                 "bz 3, -7", "bp 1, 127", "jalr 1, 2"):
+        assert decode(encode(inst, 0, {})[0]) == inst
+
+
+def test_fields():
+    assert fields(0x8c25) == Disassembled("addi", 1, 4, None, 37, "addi 1, 4, 37")
+    assert fields(0x1234) == Disassembled("lw", 1, 2, None, -12, "lw 1, -12(2)")
+    assert fields(0x6310) == Disassembled("add", 0, 3, 4, None, "add 0, 3, 4")
+    assert fields(0x2864) == Disassembled("bn", None, 0, None, 100, "bn 0, 100")
+    assert fields(0x2000) == Disassembled(".fill", None, None, None, 0x2000, ".fill 8192")
+    with pytest.raises(ValueError):
+        fields(0xffff)
+
+
+def test_disassemble_matches_decode():
+    interp = loaded(script("fib_2.S"))
+    start = interp.PROG_START
+    end = start + 64
+    interp.mem[end - 1] = 0xffff
+    lines = disassemble(interp.mem, start, end)
+    assert len(lines) == end - start
+    for addr, line in zip(range(start, end), lines):
+        word = interp.mem[addr]
+        try:
+            text = decode(word)
+        except ValueError:
+            text = f".fill {word}"
+        assert line == text
+    with pytest.raises(ValueError):
+        disassemble(interp.mem, start, end, errors=True)
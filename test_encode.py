@@ -0,0 +1,59 @@
+from decode import decode
+from encode import ENCODED, encode, encode_words, width
+from execute import execute
+from testing import loaded, run
+
+END = 0x1008
+
+
+def disassembled(inst: str, addr: int = 0x1000) -> list:
+    return [decode(word) for word in encode(inst, addr, {"end": END})]
+
+
+def test_widths():
+    widths = {
+        "add 3, 4, 2": 1, "halt": 1, "nop": 1, "mv 3, 4": 1, "neg 3, 4": 2,
+        "li 3, 5": 1, "li 3, 0x1234": 3, "li 3, end": 3, "li a0, 5": 2,
+        "bz a0, end": 2, "add a0, a1, 3": 3, "sw a1, 2(0)": 3, "j end": 4, "jal end": 4,
+    }
+    for inst, n in widths.items():
+        assert width(inst) == n, inst
+        assert len(encode(inst, 0x1000, {"end": END})) == n, inst
+
+
+def test_li_loads_every_value():
+    for imm in range(1 << 16):
+        inst = f"li 3, {imm}"
+        mem = encode(inst, 0, {})
+        # One word exactly when a single sign-extended addi reaches imm
+        assert width(inst) == len(mem) == (1 if imm < 0x80 or imm >= 0xFF80 else 3)
+        reg, pc = [0] * 5, 0
+        while pc < len(mem):
+            pc = execute(mem[pc], reg, mem, pc)
+        assert reg[3] == imm
+
+
+def test_li_encodings():
+    assert disassembled("li 3, 5") == ["addi 3, 0, 5"]
+    assert disassembled("li 3, -1") == ["addi 3, 0, -1"]
+    assert disassembled("li 3, 0x1234") == ["addi 3, 0, 18", "swb 3, 3", "addi 3, 3, 52"]
+    # Values around 0x8000 start from 0x7FFF
+    assert disassembled("li 3, 0x8000") == ["addi 3, 0, -1", "sr 3, 3", "addi 3, 3, 1"]
+    # Labels always take three words, whatever their value
+    assert disassembled("li 3, end") == ["addi 3, 0, 16", "swb 3, 3", "addi 3, 3, 8"]
+
+
+def test_vreg_branch_offsets_are_relative_to_the_branch():
+    # The bz is the second word, so it is 7 words before end
+    assert disassembled("bz a0, end") == ["lw 1, 3(0)", "bz 1, 7"]
+    interp = loaded("li a0, 0\nbz a0, skip\naddi 3, 0, 1\nskip: addi 4, 0, 2\nhalt")
+    result = run(interp)
+    assert result.reg[3:] == [0, 2]
+
+
+def test_only_lines_without_labels_are_cached():
+    refs = []
+    words = encode_words("add 3, 4, 2", 0x1000, {}, refs)
+    assert ENCODED["add 3, 4, 2"] == words and refs == []
+    encode_words("bz 3, end", 0x1000, {"end": END}, refs)
+    assert refs == ["end"] and "bz 3, end" not in ENCODED
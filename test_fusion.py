@@ -0,0 +1,36 @@
+from encode import encode
+from mmio import InputStream
+from testing import loaded, run
+
+
+def test_same_results_and_cycles_as_unfused():
+    plain, fused = loaded(), loaded()
+    assert run(fused, fuse=True) == run(plain, fuse=False)
+    assert fused.mem == plain.mem
+    assert fused.decoded.fused > 0
+
+
+def test_notices_rewritten_words_after_the_first():
+    fused, plain = loaded(), loaded()
+    run(fused, fuse=True)
+    run(plain, fuse=False)
+    # The second word of the sequence at loop, which its handler covers
+    addr = fused.labels["loop"] + 1
+    word = encode("add 1, 1, 1", addr, {})[0]
+    for interp in (fused, plain):
+        interp.mem[addr] = word
+        interp.decoded.invalidate(addr)
+    assert run(fused, fuse=True) == run(plain, fuse=False)
+    assert fused.mem == plain.mem
+
+
+def test_device_loads_are_not_fused():
+    prog = "lw 1, -16(0)\nlw 2, -16(0)\nadd 3, 1, 2\nhalt"
+    results = []
+    for fuse in (False, True):
+        interp = loaded(prog)
+        interp.attach(InputStream([4, 5, 6, 7]), 0xFFF0)
+        # Run twice, since sequences are fused the second time they run
+        results.append((run(interp, fuse=fuse), run(interp, fuse=fuse)))
+    assert results[0] == results[1]
+    assert results[1][1].reg[3] == 13
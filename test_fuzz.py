@@ -0,0 +1,17 @@
+from fuzz import ENGINES, fuzz_chunk, random_case, run_case, stops
+
+
+def test_engines_match_reference():
+    n, failures = fuzz_chunk((0, 300, list(ENGINES)))
+    assert n == 300
+    assert failures == []
+
+
+def test_loops_without_a_cycle_limit_are_compared():
+    unbounded = [case for case in map(random_case, range(300)) if case.max_cycles is None]
+    halting = [case for case in unbounded if stops(case, run_case(case, None))]
+    assert len(halting) > 20
+    for case in halting:
+        expected = run_case(case, None)
+        for engine in ("fast_forward", "fused"):
+            assert run_case(case, engine) == expected
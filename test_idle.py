@@ -0,0 +1,55 @@
+from idle import find_loop
+from testing import loaded, run
+
+COUNTED = "li 2, 1000\nloop: addi 3, 0, 5\naddi 2, 2, -1\nbz 2, done\nj loop\ndone: halt"
+
+
+def compared(prog: str, **kwargs) -> tuple:
+    """
+    Run prog without and with fast-forwarding. Returns both
+        (Interpreter, RunResult) pairs.
+    """
+    plain, fast = loaded(prog), loaded(prog)
+    return ((plain, run(plain, fast_forward=False, **kwargs)),
+            (fast, run(fast, fast_forward=True, **kwargs)))
+
+
+def test_finds_counted_loops():
+    interp = loaded(COUNTED)
+    loop = find_loop(interp.mem, interp.labels["loop"])
+    assert loop is not None
+    assert (loop.counter, loop.step, loop.exit_after_step) == (2, -1, True)
+    assert loop.iterations(1000) == 999
+
+
+def test_rejects_loops_that_touch_memory():
+    prog = COUNTED.replace("addi 3, 0, 5", "sw 3, 5(0)")
+    interp = loaded(prog)
+    assert find_loop(interp.mem, interp.labels["loop"]) is None
+
+
+def test_skipping_gives_the_same_result():
+    for engine in ("predecode", "blocks"):
+        for max_cycles in (None, 1000, 4321):
+            (plain, plain_result), (fast, fast_result) = compared(
+                COUNTED, engine=engine, max_cycles=max_cycles)
+            assert fast_result == plain_result
+            assert fast.mem == plain.mem
+    assert compared(COUNTED)[1][0].decoded.skipped > 0
+
+
+def test_loop_without_exit_runs_to_max_cycles():
+    prog = "addi 3, 0, 1\nwait: j wait"
+    (_, plain_result), (fast, fast_result) = compared(prog, max_cycles=5003)
+    assert fast_result == plain_result
+    assert fast.decoded.skipped > 0
+
+
+def test_rewritten_loop_is_not_skipped():
+    interp = loaded(COUNTED)
+    loop = find_loop(interp.mem, interp.labels["loop"])
+    reg = list(interp.reg)
+    reg[2], reg[1] = 10, loop.head
+    assert loop.skip(list(reg), interp.mem) > 0
+    interp.mem[loop.head] += 1
+    assert loop.skip(reg, interp.mem) == 0
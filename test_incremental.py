@@ -0,0 +1,46 @@
+from incremental import IncrementalAssembler
+from interpreter import Interpreter
+from testing import loaded, run, write
+
+PROG = "\n".join(["li a0, 3", "loop: addi 3, 3, 2", "add 4, 4, 3", "addi a0, a0, -1",
+                  "bz a0, done", "j loop", "done: halt"] +
+                 [f"li 2, {k}" for k in range(50)])
+
+
+def test_matches_load_prog_after_edits():
+    interp = Interpreter()
+    asm = IncrementalAssembler(interp)
+    asm.load(PROG)
+    edited = "nop\n" + PROG.replace("addi 3, 3, 2", "addi 3, 3, 5")
+    asm.load(edited)
+    fresh = loaded(edited)
+    assert interp.mem == fresh.mem
+    assert interp.labels == fresh.labels
+    assert run(interp).reg == run(fresh).reg
+
+
+def test_insertion_only_reencodes_label_dependent_lines():
+    asm = IncrementalAssembler(Interpreter())
+    first = asm.load(PROG)
+    assert first.encoded == PROG.count("\n") + 1
+    result = asm.load("nop\n" + PROG)
+    # The new line, and the branch and jump whose labels moved
+    assert result.encoded == 3
+
+
+def test_shorter_program_clears_leftover_words():
+    interp = Interpreter()
+    asm = IncrementalAssembler(interp)
+    asm.load(PROG)
+    asm.load("halt")
+    assert interp.mem == loaded("halt").mem
+
+
+def test_expands_includes_and_macros(tmp_path):
+    write(tmp_path, {"lib.S": ".macro twice r\nadd \\r, \\r, \\r\n.endm\n"
+                              "double: twice 3\nj done"})
+    prog = '.include "lib.S"\nli 3, 5\nj double\ndone: halt'
+    interp = Interpreter()
+    IncrementalAssembler(interp).load(prog, base_dir=str(tmp_path))
+    assert interp.mem == loaded(prog, base_dir=str(tmp_path)).mem
+    assert run(interp, max_cycles=1000).reg[3] == 10
@@ -0,0 +1,34 @@
+import pytest
+
+from execute import ExecutionError
+from testing import loaded, run
+
+# Three increments of r3, then a word that names register 7
+BAD = "addi 3, 3, 1\naddi 3, 3, 1\naddi 3, 3, 1\nbad: .fill 0xFFFF"
+
+
+def test_max_cycles_stops_exactly():
+    full = run(loaded())
+    assert full.halted and full.pc == 0
+    for n in (0, 1, 7, full.cycles - 1):
+        interp = loaded()
+        result = run(interp, max_cycles=n)
+        assert (result.cycles, result.halted) == (n, False)
+        assert result.pc == interp.pc != 0
+        assert result.reg == interp.reg
+    assert run(loaded(), max_cycles=full.cycles) == full
+
+
+def test_traced_run_matches_quiet_run(capsys):
+    traced = loaded().run(trace=True, max_cycles=20)
+    assert capsys.readouterr().out
+    assert run(loaded(), max_cycles=20) == traced
+
+
+def test_bad_instruction_raises_execution_error():
+    interp = loaded(BAD)
+    with pytest.raises(ExecutionError) as info:
+        run(interp)
+    assert info.value.pc == interp.pc == interp.labels["bad"]
+    assert info.value.cycles == 3
+    assert interp.reg[3] == 3
@@ -0,0 +1,73 @@
+import os
+from array import array
+
+import pytest
+
+import objfile
+from interpreter import Interpreter
+from linker import ModuleCache, build
+from testing import loaded, run, write
+
+FILES = {
+    "main.S": '.include "lib/mul.S"\n.include "lib/data.S"\n'
+              'li 3, 6\nli 4, 7\nj mul\nback: lw 2, 0(0)\nhalt',
+    "lib/mul.S": ".macro step\nadd 2, 2, 3\naddi 4, 4, -1\n.endm\n"
+                 "mul: addi 2, 0, 0\nloop: step\nbz 4, out\nj loop\nout: sw 2, 0(0)\nj back",
+    "lib/data.S": "table: .fill 1\n.fill 2",
+}
+
+
+def load_prog(path: str) -> Interpreter:
+    with open(path) as fin:
+        return loaded(fin.read(), base_dir=os.path.dirname(path))
+
+
+def test_linked_image_matches_load_prog(tmp_path):
+    path = write(tmp_path, FILES)
+    obj, report = build(path, ModuleCache(str(tmp_path / "cache")))
+    assert (report.modules, report.assembled) == (3, 3)
+    expected = load_prog(path)
+    linked = Interpreter()
+    linked.load_object(obj)
+    assert linked.mem == expected.mem
+    assert linked.labels == expected.labels
+    assert run(linked, max_cycles=1000).reg[2] == 42
+
+
+def test_only_changed_files_are_reassembled(tmp_path):
+    path = write(tmp_path, FILES)
+    cache = ModuleCache(str(tmp_path / "cache"))
+    build(path, cache)
+    assert build(path, cache)[1].assembled == 0
+    write(tmp_path, {"lib/data.S": "table: .fill 3\n.fill 4\n.fill 5"})
+    obj, report = build(path, cache)
+    assert report.assembled == 1
+    linked = Interpreter()
+    linked.load_object(obj)
+    assert linked.mem == load_prog(path).mem
+
+
+def test_load_linked(tmp_path):
+    path = write(tmp_path, FILES)
+    interp = Interpreter()
+    interp.load_linked(path, cache_dir=str(tmp_path / "cache"))
+    assert interp.link_report.modules == 3
+    assert run(interp, max_cycles=1000).reg[2] == 42
+
+
+def test_label_errors(tmp_path):
+    cache = ModuleCache(str(tmp_path / "cache"))
+    path = write(tmp_path, {"main.S": '.include "lib.S"\nx: j y', "lib.S": "x: halt"})
+    with pytest.raises(NameError):
+        build(path, cache)
+    path = write(tmp_path, {"main.S": "j nowhere", "lib.S": ""})
+    with pytest.raises(NameError):
+        build(path, cache)
+
+
+def test_module_roundtrip():
+    module = objfile.Module({"start": 0, "end": 3}, ((1, 2, "j start"),), ("lib",),
+                            array("H", [5, 0, 0, 0, 0, 7]))
+    assert objfile.module_from_bytes(objfile.module_to_bytes(module)) == module
+    with pytest.raises(ValueError):
+        objfile.module_from_bytes(objfile.to_bytes(objfile.ObjectFile(0, 0, {}, [])))
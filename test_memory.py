@@ -0,0 +1,76 @@
+import pytest
+
+from interpreter import Interpreter
+from memory import STORAGES, PagedMemory, copy_memory, make_memory, view
+from testing import LOOP, run
+
+
+def storages():
+    for storage in STORAGES:
+        if storage == "numpy":
+            pytest.importorskip("numpy")
+        yield storage
+
+
+def test_backends_index_like_lists():
+    for storage in storages():
+        mem = make_memory(storage, 1024)
+        mem[5] = 0xFFFF
+        mem[-1] = 7
+        assert (len(mem), mem[5], mem[1023], mem[-1]) == (1024, 0xFFFF, 7, 7)
+        for i in (10, 11, 12):
+            mem[i] = i
+        assert list(mem[9:14]) == [0, 10, 11, 12, 0]
+        assert type(mem[5]) is int
+        with pytest.raises(IndexError):
+            mem[1024]
+
+
+def test_compact_backends_reject_wide_values():
+    for storage in storages():
+        if storage in ("array", "bytearray", "numpy"):
+            mem = make_memory(storage, 16)
+            with pytest.raises((OverflowError, ValueError)):
+                mem[0] = 0x10000
+            assert len(view(mem)) == 16
+
+
+def test_copies_are_independent():
+    for storage in storages():
+        mem = make_memory(storage, 1024)
+        mem[3] = 1
+        copy = copy_memory(mem)
+        copy[3] = 2
+        mem[4] = 5
+        assert (mem[3], copy[3], copy[4]) == (1, 2, 0)
+
+
+def test_paged_snapshots_share_pages_until_written():
+    mem = PagedMemory(1024)
+    mem[0] = 1
+    snap = mem.snapshot()
+    assert snap.pages[0] is mem.pages[0]
+    mem[1] = 2
+    assert snap.pages[0] is not mem.pages[0]
+    assert (mem[1], snap[1], snap[0]) == (2, 0, 1)
+    assert snap.pages[1] is mem.pages[1]
+
+
+def test_interpreter_runs_on_every_backend():
+    results = []
+    for storage in storages():
+        interp = Interpreter(storage=storage)
+        interp.load_prog(LOOP)
+        results.append((run(interp), list(interp.mem[:16])))
+    assert all(result == results[0] for result in results)
+    assert results[0][1][4] == 55
+
+
+def test_engine_results_wrap_on_every_backend():
+    prog = "li 3, 0xFFFF\naddi 3, 3, 2\nsw 3, 5(0)\nhalt"
+    for storage in storages():
+        for engine in ("predecode", "blocks"):
+            interp = Interpreter(storage=storage)
+            interp.load_prog(prog)
+            run(interp, engine=engine)
+            assert interp.mem[5] == interp.reg[3] == 1
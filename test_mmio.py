@@ -0,0 +1,55 @@
+import pytest
+
+from interpreter import Interpreter
+from mmio import Device, InputStream, OutputBuffer
+from testing import loaded, run
+
+ECHO = """loop: lw 3, -15(0)
+bz 3, done
+lw 4, -16(0)
+sw 4, -14(0)
+j loop
+done: halt"""
+
+
+def test_echo_on_every_engine():
+    data = list(range(1, 50)) + [0xFFFF]
+    for engine in ("predecode", "blocks", "profile"):
+        interp = loaded(ECHO)
+        batches = []
+        interp.attach(InputStream(data), 0xFFF0)
+        interp.attach(OutputBuffer(lambda words: batches.append(list(words)), batch=8), 0xFFF2)
+        run(interp, engine=engine)
+        assert sum(batches, []) == data
+        # Full batches while running, the rest when the run ends
+        assert [len(b) for b in batches] == [8] * 6 + [2]
+
+
+def test_attach_checks_addresses():
+    interp = Interpreter()
+    with pytest.raises(ValueError):
+        interp.attach(Device(), 0xFFEF)
+    with pytest.raises(ValueError):
+        interp.attach(InputStream([]), 0xFFFF)
+    interp.attach(InputStream([]), 0xFFF0)
+    with pytest.raises(ValueError):
+        interp.attach(Device(), 0xFFF1)
+
+
+def test_detach_restores_plain_memory():
+    interp = loaded("lw 3, -16(0)\nhalt")
+    interp.attach(InputStream([5]), 0xFFF0)
+    run(interp)
+    assert interp.reg[3] == 5
+    interp.detach(0xFFF0)
+    interp.mem[0xFFF0] = 42
+    run(interp)
+    assert interp.reg[3] == 42
+
+
+def test_loads_through_pointers_read_memory():
+    interp = loaded("addi 2, 0, -16\nlw 3, 0(2)\nhalt")
+    interp.attach(InputStream([5]), 0xFFF0)
+    interp.mem[0xFFF0] = 9
+    run(interp)
+    assert interp.reg[3] == 9
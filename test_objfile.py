@@ -0,0 +1,34 @@
+import pytest
+
+import objfile
+from interpreter import Interpreter
+from testing import loaded, run
+
+
+def test_saved_programs_load_and_run_the_same(tmp_path):
+    source = loaded()
+    path = str(tmp_path / f"loop{objfile.SUFFIX}")
+    source.save_object(path)
+
+    interp = Interpreter()
+    assert interp.load_object(path) == source.prog_len
+    assert interp.labels == source.labels
+    assert interp.mem == source.mem
+    assert run(interp) == run(source)
+
+
+def test_object_roundtrip(tmp_path):
+    path = str(tmp_path / f"loop{objfile.SUFFIX}")
+    loaded().save_object(path)
+    obj = objfile.read(path)
+    data = objfile.to_bytes(obj)
+    assert objfile.is_object(data)
+    assert objfile.from_bytes(data) == obj
+
+
+def test_rejects_bad_files():
+    with pytest.raises(ValueError):
+        objfile.from_bytes(b"not an object file at all")
+    data = objfile.to_bytes(objfile.ObjectFile(0x1000, 0x1000, {}, [1, 2, 3]))
+    with pytest.raises(ValueError):
+        objfile.from_bytes(data[:-1])
@@ -0,0 +1,38 @@
+from interpreter import Interpreter
+from mmio import InputStream, OutputBuffer
+from testing import run
+
+
+def optimized(prog: str, optimize: bool) -> tuple:
+    interp = Interpreter()
+    prog_len = interp.load_prog(prog, optimize=optimize)
+    run(interp, max_cycles=100_000)
+    return interp, prog_len
+
+
+def test_removes_redundant_vreg_loads_and_stores():
+    prog = "li a0, 10\nli a1, 1\naddi a0, a0, -1\nadd a1, a1, a0\nmv a2, a1\nhalt"
+    (plain, plain_len), (opt, opt_len) = optimized(prog, False), optimized(prog, True)
+    assert opt.mem[1:16] == plain.mem[1:16]
+    assert opt_len < plain_len
+    assert opt.opt_report.words_saved == plain_len - opt_len
+
+
+def test_keeps_programs_with_numeric_branches():
+    prog = "li a0, 3\nbz 0, 2\nli a0, 3\nhalt"
+    (_, plain_len), (opt, opt_len) = optimized(prog, False), optimized(prog, True)
+    assert opt_len == plain_len
+    assert opt.opt_report.words_saved == 0
+
+
+def test_device_accesses_are_not_removed():
+    prog = "lw 3, -16(0)\nlw 3, -16(0)\nsw 3, -14(0)\nsw 3, -14(0)\nhalt"
+    for optimize in (False, True):
+        interp = Interpreter()
+        out = []
+        interp.attach(InputStream([7, 9]), 0xFFF0)
+        interp.attach(OutputBuffer(out.extend), 0xFFF2)
+        interp.load_prog(prog, optimize=optimize)
+        run(interp)
+        assert interp.reg[3] == 9
+        assert out == [9, 9]
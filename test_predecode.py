@@ -0,0 +1,23 @@
+from encode import encode
+from testing import LOOP, loaded, reference, run, script
+
+
+def test_matches_execute():
+    for prog in (LOOP, script("fib_2.S")):
+        interp = loaded(prog)
+        cycles, reg, mem = reference(interp)
+        result = run(interp)
+        assert (result.cycles, result.reg) == (cycles, reg)
+        assert interp.mem == mem
+
+
+def test_invalidate_redecodes_written_words():
+    interp = loaded()
+    run(interp)
+    addr = interp.labels["loop"]
+    interp.mem[addr] = encode("add 1, 1, 1", addr, {})[0]
+    interp.decoded.invalidate(addr)
+    cycles, reg, mem = reference(interp)
+    result = run(interp)
+    assert (result.cycles, result.reg) == (cycles, reg)
+    assert interp.mem == mem
@@ -0,0 +1,52 @@
+import pytest
+
+import preprocess
+from testing import loaded, run, write
+
+
+def test_includes_follow_the_program_once_each(tmp_path):
+    write(tmp_path, {
+        "main.S": '.include "lib/a.S"\n.include "lib/b.S"\nhalt',
+        # Paths are relative to the including file
+        "lib/a.S": '.include "b.S"\na: nop',
+        "lib/b.S": '.include "a.S"\nb: nop',
+    })
+    sources = preprocess.read_sources(path=str(tmp_path / "main.S"))
+    assert [s.path for s in sources] == [str(tmp_path / p) for p in ("main.S", "lib/a.S", "lib/b.S")]
+    assert [line for s in sources for line in s.lines] == ["halt", "a: nop", "b: nop"]
+
+
+def test_macros_expand_with_unique_labels():
+    text = """.macro countdown r, n
+addi \\r, 0, \\n
+top\\@: addi \\r, \\r, -1
+bz \\r, end\\@
+j top\\@
+end\\@:
+.endm
+countdown 3, 4
+countdown 4, 2
+halt"""
+    lines = preprocess.expand(text)
+    assert "addi 3, 0, 4" in lines and "topprog_1: addi 4, 4, -1" in lines
+    result = run(loaded(text), max_cycles=1000)
+    assert result.halted and result.reg[3:] == [0, 0]
+
+
+def test_macro_errors():
+    with pytest.raises(SyntaxError):
+        preprocess.expand(".macro add a\nnop\n.endm")
+    with pytest.raises(SyntaxError):
+        preprocess.expand(".macro m a\nnop")
+    with pytest.raises(SyntaxError):
+        preprocess.expand(".macro m a\nnop\n.endm\nm 1, 2")
+    with pytest.raises(SyntaxError):
+        preprocess.expand(".macro m a\naddi \\b, 0, 1\n.endm\nm 1")
+    with pytest.raises(RecursionError):
+        preprocess.expand(".macro m\nm\n.endm\nm")
+
+
+def test_load_prog_resolves_includes_from_base_dir(tmp_path):
+    write(tmp_path, {"lib.S": "five: addi 3, 0, 5\nj back"})
+    interp = loaded('.include "lib.S"\nj five\nback: halt', base_dir=str(tmp_path))
+    assert run(interp, max_cycles=100).reg[3] == 5
@@ -0,0 +1,17 @@
+from testing import loaded, run
+
+
+def test_counts_match_the_run():
+    expected = run(loaded())
+    interp = loaded()
+    result = run(interp, engine="profile")
+    assert result == expected
+    profiler = interp.profiler
+    assert sum(profiler.pcs) == profiler.cycles == result.cycles
+    assert profiler.pcs[interp.labels["loop"]] == 10
+
+    # The loop's bz, taken once when a0 reaches 0
+    (bz,) = set(profiler.taken) | set(profiler.not_taken)
+    assert (profiler.taken[bz], profiler.not_taken[bz]) == (1, 9)
+    assert profiler.opcodes()["bz"] == 10
+    assert interp.labels["loop"] in profiler.leaders
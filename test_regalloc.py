@@ -0,0 +1,37 @@
+from testing import LOOP, loaded, run
+
+
+def allocated(prog: str, allocate: bool) -> tuple:
+    interp = loaded(prog, allocate=allocate)
+    return interp, run(interp, max_cycles=100_000)
+
+
+def test_promotes_vregs_and_stores_them_back():
+    (plain, plain_result), (alloc, alloc_result) = allocated(LOOP, False), allocated(LOOP, True)
+    assert alloc.alloc_report.promoted == {"a0": 3, "a1": 4}
+    assert alloc.mem[1:16] == plain.mem[1:16]
+    assert alloc.mem[4] == 55
+    assert alloc.prog_len < plain.prog_len
+    assert alloc_result.cycles < plain_result.cycles
+
+
+def test_leaves_named_registers_alone():
+    prog = LOOP.replace("li a1, 0", "addi 3, 0, 1\nli a1, 0")
+    alloc, _ = allocated(prog, True)
+    assert 3 not in alloc.alloc_report.promoted.values()
+    assert alloc.reg[3] == 1
+    assert alloc.mem[4] == 55
+
+
+def test_keeps_words_accessed_directly_in_memory():
+    # Word 3 is a0
+    prog = LOOP.replace("li a1, 0", "li a1, 0\nlw 2, 3(0)")
+    alloc, _ = allocated(prog, True)
+    assert "a0" in alloc.alloc_report.spilled
+
+
+def test_keeps_programs_with_numeric_branches():
+    prog = "li a0, 3\nbz 0, 2\nli a0, 3\nhalt"
+    (plain, _), (alloc, _) = allocated(prog, False), allocated(prog, True)
+    assert alloc.prog_len == plain.prog_len
+    assert alloc.alloc_report.words_saved == 0
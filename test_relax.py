@@ -0,0 +1,44 @@
+from testing import loaded, run
+
+
+def relaxed(prog: str, relax: bool) -> tuple:
+    interp = loaded(prog, relax=relax)
+    return interp, run(interp, max_cycles=100_000)
+
+
+def test_literal_li_keeps_its_size_unless_relaxed():
+    assert loaded("li 3, 5\nhalt").prog_len == 2
+    assert loaded("li 3, 0x1234\nhalt").prog_len == 4
+    # 0x500 is 5 with its bytes swapped, which takes two words
+    assert loaded("li 3, -1\nli 4, 0x500\nhalt").prog_len == 5
+    interp, result = relaxed("li 3, -1\nli 4, 0x500\nhalt", True)
+    assert interp.prog_len == 4
+    assert result.reg[3:] == [0xFFFF, 0x500]
+
+
+def test_j_becomes_a_branch_when_in_reach():
+    prog = "j end\naddi 3, 0, 1\nend: addi 4, 0, 2\nhalt"
+    (plain, plain_result), (interp, result) = relaxed(prog, False), relaxed(prog, True)
+    assert interp.prog_len == plain.prog_len - 3
+    assert result.reg[3:] == plain_result.reg[3:] == [0, 2]
+    assert interp.relax_report.shortened == 1
+
+
+def test_far_branches_are_relaxed():
+    pad = "\n".join("addi 3, 3, 1" for _ in range(200))
+    forward = f"bz 0, far\n{pad}\nfar: addi 4, 0, 9\nhalt"
+    _, result = relaxed(forward, True)
+    assert result.halted and result.reg[3:] == [0, 9]
+
+    backward = f"addi 2, 0, 3\ntop: {pad}\naddi 2, 2, -1\nbp 2, top\nhalt"
+    interp, result = relaxed(backward, True)
+    assert result.halted and result.reg[3] == 600
+    assert interp.relax_report.relaxed == 1
+
+
+def test_keeps_programs_with_numeric_branches():
+    prog = "bz 0, 5\nj end\naddi 2, 0, 7\nend: halt"
+    (plain, plain_result), (interp, result) = relaxed(prog, False), relaxed(prog, True)
+    assert interp.prog_len == plain.prog_len == 7
+    assert result.reg[2] == plain_result.reg[2] == 7
+    assert interp.relax_report.words_saved == 0
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from execute import ExecutionError
+from runner import read_manifest, run_jobs
+from testing import loaded, run
+
+# Adds table[0] to r4 a0 times, and stores the sum in word 8
+SUM = """lw 3, 3(0)
+li 1, table
+lw 2, 0(1)
+loop: add 4, 4, 2
+addi 3, 3, -1
+bz 3, done
+j loop
+done: sw 4, 8(0)
+halt
+table: .fill 1"""
+
+# Fails on its second instruction, which names register 7
+BAD = "addi 3, 3, 1\n.fill 0xFFFF"
+
+
+def expected(prog: str, setup=None, **kwargs) -> dict:
+    """
+    What the runner should report, from running prog in this process.
+        setup: called with the Interpreter before the run
+    """
+    interp = loaded(prog)
+    if setup:
+        setup(interp)
+    try:
+        result = run(interp, **kwargs)
+        cycles, error = result.cycles, None
+    except ExecutionError as e:
+        cycles, error = e.cycles, str(e)
+    return {"cycles": cycles, "pc": interp.pc, "halted": interp.pc == 0,
+            "reg": interp.reg, "error": error, "interp": interp}
+
+
+def test_results_match_single_runs(tmp_path):
+    (tmp_path / "sum.S").write_text(SUM)
+    (tmp_path / "bad.S").write_text(BAD)
+    sum_path, bad_path = str(tmp_path / "sum.S"), str(tmp_path / "bad.S")
+    jobs = [
+        {"id": "sum", "program": sum_path, "reg": {"a0": 5}, "mem": {"table": [3]},
+         "dump": [[8, 1], ["table", 1]]},
+        {"program": sum_path, "reg": {"a0": 1000, "r4": 100}, "max_cycles": 50,
+         "engine": "blocks", "dump": [[8, 1]]},
+        {"id": "bad", "program": bad_path},
+    ]
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text("\n".join(json.dumps(job) for job in jobs) + "\n")
+
+    def sum_inputs(interp):
+        interp.mem[3], interp.mem[interp.labels["table"]] = 5, 3
+
+    def limited_inputs(interp):
+        interp.mem[3], interp.reg[4] = 1000, 100
+
+    expectations = [
+        expected(SUM, sum_inputs),
+        expected(SUM, limited_inputs, max_cycles=50, engine="blocks"),
+        expected(BAD),
+    ]
+    results = [json.loads(json.dumps(result)) for result in run_jobs(read_manifest(manifest), 2)]
+    # Jobs without an id are named by their line
+    assert [result["id"] for result in results] == ["sum", 1, "bad"]
+    for job, result, want in zip(jobs, results, expectations):
+        interp = want.pop("interp")
+        assert {key: result[key] for key in want} == want
+        for start, length in job.get("dump", []):
+            addr = interp.labels.get(start, start)
+            assert result["mem"][str(start)] == interp.mem[addr:addr + length]
+
+    assert results[0]["mem"] == {"8": [15], "table": [3]}
+    assert results[1]["cycles"] == 50 and not results[1]["halted"]
+    assert results[2]["error"] and results[2]["cycles"] == 1
+
+
+def test_unknown_registers_are_reported(tmp_path):
+    (tmp_path / "sum.S").write_text(SUM)
+    jobs = [{"id": 0, "program": str(tmp_path / "sum.S"), "reg": {"r9": 1}}]
+    (result,) = run_jobs(jobs, 2)
+    assert result["error"].startswith("Bad job")
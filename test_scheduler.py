@@ -0,0 +1,59 @@
+import asyncio
+
+from mmio import Device
+from scheduler import Scheduler
+from testing import loaded, run
+
+# A counted loop that idle.py can skip, then a little work after it
+PROG = "li 2, 20000\nloop: addi 2, 2, -1\nbz 2, done\nj loop\ndone: addi 3, 0, 7\nhalt"
+
+
+class FlushCounter(Device):
+    def __init__(self):
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_slices_skip_loops_and_match_run():
+    expected = run(loaded(PROG), fast_forward=False)
+    interp = loaded(PROG)
+    counter = FlushCounter()
+    interp.attach(counter, 0xFFF0)
+    slices = []
+    result = asyncio.run(interp.run_async(slice_cycles=1000, on_slice=slices.append))
+    assert result == expected
+    assert interp.decoded.skipped > 0
+    assert sum(slices) == expected.cycles
+    assert all(n <= 1000 for n in slices)
+    # Once before each yield, and once at the end
+    assert counter.flushes == len(slices)
+
+
+def test_machines_share_the_event_loop():
+    expected = run(loaded(PROG), fast_forward=False)
+
+    async def main():
+        sched = Scheduler(slice_cycles=500)
+        for name in ("a", "b", "c"):
+            sched.spawn(loaded(PROG), name=name)
+        return sched, await sched.wait()
+
+    sched, results = asyncio.run(main())
+    assert results == {"a": expected, "b": expected, "c": expected}
+    assert all(stats.cycles == expected.cycles for stats in sched.stats.values())
+
+
+def test_timeout_stops_a_machine_that_does_not_halt():
+    interp = loaded("wait: addi 3, 3, 1\nj wait")
+
+    async def main():
+        sched = Scheduler(slice_cycles=500)
+        sched.spawn(interp, name="spin", timeout=0.05)
+        return sched, await sched.wait()
+
+    sched, results = asyncio.run(main())
+    assert results == {"spin": None}
+    assert sched.stats["spin"].error == "timeout"
+    assert sched.stats["spin"].cycles > 0
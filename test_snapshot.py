@@ -0,0 +1,69 @@
+import pytest
+
+from interpreter import Interpreter
+from mmio import InputStream
+from testing import LOOP, run
+
+
+def halfway(storage: str = "list") -> Interpreter:
+    interp = Interpreter(storage=storage)
+    interp.load_prog(LOOP)
+    run(interp, max_cycles=20)
+    return interp
+
+
+def test_restore_returns_to_the_snapshot():
+    interp = halfway()
+    snap = interp.snapshot()
+    expected = run(interp, resume=True)
+    assert expected.halted and interp.mem[4] == 55
+    for _ in range(2):
+        interp.restore(snap)
+        assert (interp.pc, interp.reg, interp.mem[4]) == (snap.pc, snap.reg, snap.mem[4])
+        assert run(interp, resume=True) == expected
+        assert interp.mem[4] == 55
+
+
+def test_fork_continues_independently():
+    for storage in ("list", "paged"):
+        expected = run(halfway(storage), resume=True)
+        parent = halfway(storage)
+        child = parent.fork()
+        # Restart the child's count from 5; a0 is memory word 3
+        child.mem[3] = 5
+        child_result, parent_result = run(child, resume=True), run(parent, resume=True)
+        assert parent_result == expected
+        assert parent.mem[4] == 55
+        assert child_result.halted and child_result.cycles < parent_result.cycles
+        assert child.mem[4] != parent.mem[4]
+
+
+def test_forks_share_pages_until_written():
+    parent = halfway("paged")
+    child = parent.fork()
+    assert all(a is b for a, b in zip(child.mem.pages, parent.mem.pages))
+    run(child, resume=True)
+    # The vregs are in page 0; the program's page is only read
+    program = parent.PROG_START // 256
+    assert child.mem.pages[0] is not parent.mem.pages[0]
+    assert child.mem.pages[program] is parent.mem.pages[program]
+    assert child.mem[4] == 55 and parent.mem[4] != 55
+
+
+def test_fork_copies_program_state():
+    parent = halfway()
+    parent_lines, parent_labels = dict(parent.line_of), dict(parent.labels)
+    child = parent.fork()
+    child.load_prog("nop\nnop\nhalt")
+    child.attach(InputStream([1]), 0xFFF0)
+    assert (parent.line_of, parent.labels) == (parent_lines, parent_labels)
+    assert parent.source_lines != child.source_lines
+    assert not parent.devices.ports
+    assert run(parent, resume=True).halted and parent.mem[4] == 55
+
+
+def test_fork_refuses_attached_devices():
+    interp = halfway()
+    interp.attach(InputStream([1]), 0xFFF0)
+    with pytest.raises(ValueError):
+        interp.fork()
@@ -0,0 +1,28 @@
+from testing import LOOP, loaded, run
+from timetravel import TimeMachine
+
+LONG_LOOP = LOOP.replace("li a0, 10", "li a0, 40")
+
+
+def state_at(cycles: int) -> tuple:
+    interp = loaded(LONG_LOOP)
+    run(interp, max_cycles=cycles)
+    return interp.pc, list(interp.reg), list(interp.mem)
+
+
+def test_goto_and_step_back_restore_earlier_states():
+    interp = loaded(LONG_LOOP)
+    interp.pc = interp.PROG_START
+    machine = TimeMachine(interp, interval=64)
+    total = machine.run()
+    assert interp.pc == 0
+    for cycle in (total - 1, 300, 130, 64, 5, 0):
+        machine.goto(cycle)
+        assert machine.cycle == cycle
+        assert (interp.pc, interp.reg, interp.mem) == state_at(cycle)
+    machine.goto(200)
+    machine.step_back(3)
+    assert (interp.pc, interp.reg, interp.mem) == state_at(197)
+    # Going forward again re-executes
+    machine.run()
+    assert (interp.pc, interp.reg, interp.mem) == state_at(total)
@@ -0,0 +1,52 @@
+from execute import execute
+from mmio import OutputBuffer
+from testing import loaded, run
+from tracefile import TraceReader
+
+
+def test_trace_records_every_instruction(tmp_path):
+    path = str(tmp_path / "loop.trace")
+    interp = loaded()
+    result = interp.run(trace=path)
+
+    reader = TraceReader(path)
+    try:
+        assert len(reader) == result.cycles
+        # Replaying the recorded effects on a fresh machine gives the same state
+        fresh = loaded()
+        reg, mem, pc = fresh.reg, fresh.mem, fresh.PROG_START
+        for record in reader.records():
+            assert (record.pc, record.inst) == (pc, mem[pc])
+            pc = execute(mem[pc], reg, mem, pc)
+            if record.reg is not None:
+                assert reg[record.reg] == record.reg_value
+            if record.mem_addr is not None:
+                assert mem[record.mem_addr] == record.mem_value
+        assert pc == 0 and reg == result.reg and mem == interp.mem
+
+        stores = list(reader.records(mem=True))
+        assert stores and all(record.mem_addr is not None for record in stores)
+        assert [r.cycle for r in reader.records(cycles=(5, 8))] == [5, 6, 7]
+    finally:
+        reader.close()
+
+
+def test_traced_run_matches_untraced_run(tmp_path):
+    traced = loaded().run(trace=str(tmp_path / "loop.trace"), max_cycles=40)
+    assert traced == run(loaded(), max_cycles=40)
+
+
+def test_device_stores_record_the_stored_value(tmp_path):
+    path = str(tmp_path / "out.trace")
+    interp = loaded("addi 3, 0, 7\nsw 3, -16(0)\nhalt")
+    out = []
+    interp.attach(OutputBuffer(out.extend), 0xFFF0)
+    interp.run(trace=path)
+    reader = TraceReader(path)
+    try:
+        (store,) = reader.records(mem=True)
+    finally:
+        reader.close()
+    assert out == [7]
+    assert (store.mem_addr, store.mem_value) == (0xFFF0, 7)
+    assert interp.mem[0xFFF0] == 0
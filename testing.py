@@ -0,0 +1,55 @@
+# Helpers shared by the tests.
+
+from execute import execute
+from interpreter import Interpreter
+
+# Sums 10 down to 1 into a1 (memory word 4)
+LOOP = "li a0, 10\nli a1, 0\nloop: add a1, a1, a0\naddi a0, a0, -1\nbz a0, done\nj loop\ndone: halt"
+
+
+def script(name: str) -> str:
+    """
+    Source of one of the example programs in scripts/.
+    """
+    with open(f"scripts/{name}") as fin:
+        return fin.read()
+
+
+def write(tmp_path, files: dict) -> str:
+    """
+    Write {relative path: text} under tmp_path, creating directories.
+        Returns the path of main.S.
+    """
+    for name, text in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+    return str(tmp_path / "main.S")
+
+
+def loaded(prog: str = LOOP, **kwargs) -> Interpreter:
+    """
+    A new Interpreter with prog loaded. kwargs are passed to load_prog().
+    """
+    interp = Interpreter()
+    interp.load_prog(prog, **kwargs)
+    return interp
+
+
+def run(interp: Interpreter, **kwargs):
+    """
+    interp.run() without the trace. kwargs are passed to run().
+    """
+    return interp.run(trace=False, **kwargs)
+
+
+def reference(interp: Interpreter) -> tuple:
+    """
+    Run a copy of interp's program with execute(), one instruction at a
+        time. Returns (cycles, reg, mem).
+    """
+    reg, mem, pc, cycles = list(interp.reg), list(interp.mem), interp.PROG_START, 0
+    while pc != 0:
+        pc = execute(mem[pc], reg, mem, pc)
+        cycles += 1
+    return cycles, reg, mem
@@ -0,0 +1,203 @@
+# Steps programs backwards and jumps to any earlier cycle.
+#
+# TimeMachine runs a program while recording, for every cycle, the pc and
+# the old value of whatever the instruction overwrote (one register or
+# one memory word), as 4 u16 words:
+#   pc, flags, memory address, old value
+# The low byte of flags is the register written (0 for none), and
+# MEM_WRITE is set for stores. It also saves the pc and registers every
+# interval cycles.
+#
+# Stepping back undoes one record. Jumping back to cycle t undoes the
+# memory writes made since the checkpoint before t, restores the
+# registers saved there, and replays at most one interval of cycles.
+# Device I/O (see mmio.py) is not undone.
+
+from array import array
+from bisect import bisect_left
+
+from execute import ExecutionError
+from predecode import NUM_REGS, predecode
+
+# Cycles between checkpoints, i.e. the most goto() replays
+CHECKPOINT_INTERVAL = 1 << 12
+RECORD_WORDS = 4
+MEM_WRITE = 0x100
+
+# Instructions that write rd
+WRITES_RD = ("addi", "nandi", "swb", "nand", "sl", "sr", "add", "lw", "jalr")
+
+
+class TimeMachine:
+    """
+    Runs interp from its current pc, which becomes cycle 0, keeping
+        enough history to return to any cycle since.
+        cycle: cycles executed from the start
+        log: one record per cycle (see top of file)
+        checkpoints: (pc, registers) at every multiple of interval cycles
+        stores: cycles whose instruction wrote memory, in order
+    """
+    def __init__(self, interp, interval: int = CHECKPOINT_INTERVAL):
+        self.interp = interp
+        self.interval = interval
+        self.cycle = 0
+        self.log = array("H")
+        self.checkpoints = [(interp.pc, tuple(interp.reg))]
+        self.stores = array("Q")
+        # Instruction word -> (rd written or 0, sw address or None)
+        self.effects = {}
+        # Loop skipping and fusion would leave cycles unrecorded
+        interp.decoded.set_fast_forward(False)
+        interp.decoded.set_fuse(False)
+
+    def effect(self, inst: int) -> tuple:
+        name, rs, rd, ro, imm = predecode(inst)
+        # Bad register indices are left for the instruction to raise
+        rd = rd if name in WRITES_RD and rd < NUM_REGS else 0
+        addr = (rs + imm) % len(self.interp.mem) if name == "sw" else None
+        return self.effects.setdefault(inst, (rd, addr))
+
+    def run(self, max_cycles: int | None = None) -> int:
+        """
+        Execute and record until the program halts (pc == 0) or
+            max_cycles instructions have run. Returns the cycles run.
+        Raises ExecutionError if an instruction fails; it is not recorded.
+        """
+        interp = self.interp
+        decoded = interp.decoded
+        entries, mem, fill = decoded.entries, decoded.mem, decoded.fill
+        reg, pc = interp.reg, interp.pc
+        effects, extend, checkpoints = self.effects, self.log.extend, self.checkpoints
+        interval = self.interval
+        cycle = start = self.cycle
+        try:
+            while pc != 0 and (max_cycles is None or cycle - start < max_cycles):
+                if cycle % interval == 0 and cycle // interval == len(checkpoints):
+                    checkpoints.append((pc, tuple(reg)))
+                op = entries[pc] or fill(pc)
+                inst = mem[pc]
+                rd, addr = effects.get(inst) or self.effect(inst)
+                if addr is None:
+                    extend((pc & 0xFFFF, rd, 0, reg[rd]))
+                else:
+                    extend((pc & 0xFFFF, MEM_WRITE, addr, mem[addr]))
+                    self.stores.append(cycle)
+                try:
+                    pc = op(reg, mem, pc)
+                except Exception:
+                    del self.log[-RECORD_WORDS:]
+                    if addr is not None:
+                        self.stores.pop()
+                    raise
+                cycle += 1
+        except Exception as e:
+            raise ExecutionError(pc, e, cycle - start) from e
+        finally:
+            interp.pc = pc
+            self.cycle = cycle
+        return cycle - start
+
+    def step(self, n: int = 1) -> int:
+        """
+        Execute n instructions forward. Returns the cycles run.
+        """
+        return self.run(n)
+
+    def step_back(self, n: int = 1) -> int:
+        """
+        Undo the last n instructions, or as many as there are. Returns
+            the number undone.
+        """
+        interp = self.interp
+        log, reg, mem = self.log, interp.reg, interp.mem
+        n = min(n, self.cycle)
+        for _ in range(n):
+            pc, flags, addr, old = log[-RECORD_WORDS:]
+            del log[-RECORD_WORDS:]
+            if flags & MEM_WRITE:
+                mem[addr] = old
+                self.stores.pop()
+                interp.decoded.invalidate(addr)
+            elif flags:
+                reg[flags] = old
+            interp.pc = pc
+            self.cycle -= 1
+        del self.checkpoints[self.cycle // self.interval + 1:]
+        return n
+
+    def goto(self, cycle: int):
+        """
+        Go to the state before the given cycle runs, replaying forward
+            from the nearest checkpoint if it is in the past. History
+            after it is dropped, so going forward again re-executes.
+        """
+        if cycle < 0:
+            raise ValueError("Cycle must not be negative")
+        if cycle >= self.cycle:
+            self.run(cycle - self.cycle)
+            return
+        checkpoint = cycle // self.interval
+        if self.cycle - cycle <= cycle - checkpoint * self.interval:
+            # Closer to undo from here than to replay
+            self.step_back(self.cycle - cycle)
+            return
+
+        # Undo memory writes back to the checkpoint
+        start = checkpoint * self.interval
+        interp = self.interp
+        mem = interp.mem
+        log = self.log
+        first = bisect_left(self.stores, start)
+        written = set()
+        for i in reversed(range(first, len(self.stores))):
+            at = self.stores[i] * RECORD_WORDS
+            mem[log[at + 2]] = log[at + 3]
+            written.add(log[at + 2])
+        for addr in written:
+            interp.decoded.invalidate(addr)
+        del self.stores[first:]
+        del self.log[start * RECORD_WORDS:]
+        del self.checkpoints[checkpoint + 1:]
+
+        interp.pc, reg = self.checkpoints[checkpoint]
+        interp.reg[:] = reg
+        self.cycle = start
+        self.run(cycle - start)
+
+
+if __name__ == "__main__":
+    # Run a program to the end, then compare jumping back to cycles
+    # in the middle with re-running from the start
+    import sys
+    import time
+
+    from interpreter import Interpreter
+
+    if len(sys.argv) < 2:
+        print(f"Usage: timetravel.py <script> [cycle ...]")
+        exit(1)
+    with open(sys.argv[1]) as fin:
+        prog = fin.read()
+
+    interp = Interpreter()
+    interp.load_prog(prog)
+    start = time.perf_counter()
+    tm = TimeMachine(interp)
+    total = tm.run()
+    print(f"Recorded {total} cycles in {time.perf_counter() - start:.3f}s "
+          f"({len(tm.log) * 2 / 1e6:.1f} MB of history)")
+
+    cycles = [int(x) for x in sys.argv[2:]] or [total - 1, total // 2, total // 3, 0]
+    for cycle in cycles:
+        start = time.perf_counter()
+        tm.goto(cycle)
+        elapsed = time.perf_counter() - start
+        print(f"cycle {cycle}: pc={interp.pc} reg={interp.reg} ({elapsed * 1000:.2f} ms)")
+
+        fresh = Interpreter()
+        fresh.load_prog(prog)
+        start = time.perf_counter()
+        fresh.run(trace=False, max_cycles=cycle, fast_forward=False)
+        elapsed = time.perf_counter() - start
+        same = (fresh.pc, fresh.reg, fresh.mem) == (interp.pc, interp.reg, interp.mem)
+        print(f"\trerun: {elapsed * 1000:.2f} ms, {'same' if same else 'DIFFERENT'} state")
@@ -0,0 +1,229 @@
+# Binary execution traces.
+#
+# A trace is a header followed by one fixed-size record per executed
+# instruction, so record n is cycle n and ranges of cycles can be read
+# without scanning. Each record is 6 little-endian u16 words:
+#   pc, instruction word, flags, register value, memory address, value stored
+# The low byte of flags is the register written (0 for none), and
+# MEM_WRITE is set if the instruction stored to memory.
+#
+# Usage:
+#   python tracefile.py record <script> <trace> [max_cycles]
+#   python tracefile.py show <trace> [--pc A:B] [--cycles A:B] [--reg N] [--mem]
+
+import sys
+from array import array
+from typing import NamedTuple
+
+from decode import decode
+from execute import ExecutionError
+from predecode import DecodeCache, predecode
+
+MAGIC = b"HB16TRC\0"
+RECORD_WORDS = 6
+RECORD_SIZE = 2 * RECORD_WORDS
+MEM_WRITE = 0x100
+
+# Records buffered before each write to disk
+BUFFER_RECORDS = 1 << 14
+
+# Instructions that write rd
+WRITES_RD = ("addi", "nandi", "swb", "nand", "sl", "sr", "add", "lw", "jalr")
+
+
+class TraceRecord(NamedTuple):
+    """
+    One executed instruction.
+        reg: register written, or None
+        mem_addr: address stored to, or None
+    """
+    cycle: int
+    pc: int
+    inst: int
+    reg: int | None
+    reg_value: int
+    mem_addr: int | None
+    mem_value: int
+
+    def __str__(self) -> str:
+        out = f"{self.cycle:>10}  {self.pc:#06x}  {decoded(self.inst):<20}"
+        if self.reg is not None:
+            out += f"  r{self.reg} = {self.reg_value}"
+        if self.mem_addr is not None:
+            out += f"  mem[{self.mem_addr:#06x}] = {self.mem_value}"
+        return out
+
+
+def decoded(inst: int) -> str:
+    try:
+        return decode(inst)
+    except ValueError:
+        return f"<{inst:#06x}>"
+
+
+class TraceWriter:
+    """
+    Execution engine that runs like DecodeCache.run() and writes a
+    trace record for every instruction.
+    """
+    def __init__(self, decoded: DecodeCache, path: str):
+        self.decoded = decoded
+        self.fout = open(path, "wb")
+        self.fout.write(MAGIC)
+        self.buf = array("H")
+        # Instruction word -> (rd written or stored by sw, or 0; sw address or None)
+        self.effects = {}
+
+    def effect(self, inst: int) -> tuple:
+        name, rs, rd, ro, imm = predecode(inst)
+        rd = rd if name in WRITES_RD or name == "sw" else 0
+        addr = (rs + imm) % len(self.decoded.mem) if name == "sw" else None
+        return self.effects.setdefault(inst, (rd, addr))
+
+    def flush(self):
+        if sys.byteorder != "little":
+            self.buf.byteswap()
+        self.buf.tofile(self.fout)
+        self.buf = array("H")
+
+    def close(self):
+        self.flush()
+        self.fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, reg: list, pc: int, max_cycles: int | None = None):
+        """
+        Execute from pc until the program halts (pc == 0) or max_cycles
+            instructions have run. Returns (pc, cycles).
+        Raises ExecutionError if an instruction fails; the instructions
+        before it are still written.
+        """
+        entries, mem, fill = self.decoded.entries, self.decoded.mem, self.decoded.fill
+        effects = self.effects
+        extend = self.buf.extend
+        limit = BUFFER_RECORDS * RECORD_WORDS
+        cycles = 0
+        try:
+            while pc != 0 and (max_cycles is None or cycles < max_cycles):
+                op = entries[pc] or fill(pc)
+                inst = mem[pc]
+                rd, addr = effects.get(inst) or self.effect(inst)
+                new_pc = op(reg, mem, pc)
+                # Negative pcs wrap around, like list indices
+                if addr is None:
+                    extend((pc & 0xFFFF, inst, rd, reg[rd] if rd else 0, 0, 0))
+                else:
+                    # The stored value, since a device store leaves mem alone
+                    extend((pc & 0xFFFF, inst, MEM_WRITE, 0, addr, reg[rd] & 0xFFFF))
+                pc = new_pc
+                cycles += 1
+                if len(self.buf) >= limit:
+                    self.flush()
+                    extend = self.buf.extend
+        except Exception as e:
+            raise ExecutionError(pc, e, cycles) from e
+        return pc, cycles
+
+
+class TraceReader:
+    """
+    Reads a trace lazily, a buffer of records at a time.
+    """
+    def __init__(self, path: str):
+        self.fin = open(path, "rb")
+        if self.fin.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+
+    def __len__(self) -> int:
+        self.fin.seek(0, 2)
+        return (self.fin.tell() - len(MAGIC)) // RECORD_SIZE
+
+    def records(self, cycles: tuple | None = None, pcs: tuple | None = None,
+                reg: int | None = None, mem: bool = False):
+        """
+        Yield TraceRecords, optionally only:
+            cycles: (start, end) cycle range, end exclusive or None
+            pcs: (start, end) pc range, end exclusive
+            reg: records that write this register
+            mem: records that write memory
+        """
+        start, end = cycles or (0, None)
+        self.fin.seek(len(MAGIC) + start * RECORD_SIZE)
+        cycle = start
+        while end is None or cycle < end:
+            n = BUFFER_RECORDS if end is None else min(BUFFER_RECORDS, end - cycle)
+            chunk = self.fin.read(n * RECORD_SIZE)
+            if len(chunk) < RECORD_SIZE:
+                return
+            words = array("H")
+            words.frombytes(chunk[:len(chunk) - len(chunk) % RECORD_SIZE])
+            if sys.byteorder != "little":
+                words.byteswap()
+
+            for i in range(0, len(words), RECORD_WORDS):
+                pc, inst, flags, reg_value, mem_addr, mem_value = words[i:i + RECORD_WORDS]
+                written = flags & 0xFF
+                if (pcs is None or pcs[0] <= pc < pcs[1]) and \
+                        (reg is None or written == reg) and \
+                        (not mem or flags & MEM_WRITE):
+                    yield TraceRecord(cycle, pc, inst, written or None, reg_value,
+                                      mem_addr if flags & MEM_WRITE else None, mem_value)
+                cycle += 1
+
+    def close(self):
+        self.fin.close()
+
+
+def parse_range(x: str) -> tuple:
+    """
+    Parse "A:B" with either side optional.
+    """
+    lo, _, hi = x.partition(":")
+    return int(lo, 0) if lo else 0, int(hi, 0) if hi else None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record and inspect binary traces.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="run a program and trace it")
+    record.add_argument("script")
+    record.add_argument("trace")
+    record.add_argument("max_cycles", type=int, nargs="?")
+
+    show = commands.add_parser("show", help="print a trace")
+    show.add_argument("trace")
+    show.add_argument("--pc", type=parse_range, help="pc range A:B")
+    show.add_argument("--cycles", type=parse_range, help="cycle range A:B")
+    show.add_argument("--reg", type=int, help="only records that write this register")
+    show.add_argument("--mem", action="store_true", help="only records that write memory")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from interpreter import Interpreter
+
+        with open(args.script) as fin:
+            prog = fin.read()
+        interp = Interpreter()
+        interp.load_prog(prog)
+        try:
+            result = interp.run(trace=args.trace, max_cycles=args.max_cycles)
+            print(f"Traced {result.cycles} cycles to {args.trace}")
+        except ExecutionError as e:
+            print(f"Traced {e.cycles} cycles to {args.trace}")
+            print(e)
+    else:
+        reader = TraceReader(args.trace)
+        pcs = args.pc and (args.pc[0], args.pc[1] if args.pc[1] is not None else 1 << 16)
+        try:
+            for rec in reader.records(args.cycles, pcs, args.reg, args.mem):
+                print(rec)
+        except BrokenPipeError:
+            pass
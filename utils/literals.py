@@ -1,25 +1,44 @@
 import re
+from functools import lru_cache
 
-def encode_literal(x: str | int, width: int, signed: bool):
+LITERAL = re.compile(r"^-?(0x[0-9a-fA-F]+|0b[01]+|0o[0-7]+|\d+)$")
+
+
+@lru_cache(maxsize=None)
+def parse_literal(x: str) -> int | None:
     """
-    Decode a literal decimal, hex, or binary string.
-    If it is none of the above, return None.
+    Parse a literal decimal, hex, binary or octal string.
+    If it is none of the above (e.g. a label), return None.
     """
-    if not (isinstance(x, int) or (isinstance(x, str) and re.match(r"-?\d+", x) or re.match("0x[0-9a-f]+", x))):
+    if not LITERAL.match(x):
         return None
-    
-    if isinstance(x, str):
-        x = eval(x)
-    
-    assert isinstance(x, int)
+    return int(x, 0)
+
+def fit_literal(x: int, width: int, signed: bool) -> int:
+    """
+    Check that x fits in width bits and return its bit pattern.
+    """
     if x >= 0 or (not signed):
         if x >= (1<<width):
             raise SyntaxError(f"Unsigned immediate '{x}' does not fit in {width} bits")
-        return bin(x)[2:].zfill(width)
+        return x
     else:
         if x < -(1<<(width-1)) or x >= (1<<(width-1)):
             raise SyntaxError(f"Signed immediate '{x}' does not fit in {width} bits")
-        return bin((1<<width) + x)[2:].zfill(width)
+        return (1<<width) + x
+
+def encode_literal(x: str | int, width: int, signed: bool):
+    """
+    Decode a literal decimal, hex, or binary string.
+    If it is none of the above, return None.
+    """
+    if isinstance(x, str):
+        x = parse_literal(x)
+        if x is None:
+            return None
+    
+    assert isinstance(x, int)
+    return bin(fit_literal(x, width, signed))[2:].zfill(width)
 
 def decode_literal(x: int, width: int):
     """
@@ -29,33 +29,33 @@ VREG_NAMES = [
     ["x15", "t2"]
 ]
 
+# Lookup tables from every name to its index
+REG_IDX = {name: idx for idx, names in enumerate(REG_NAMES) for name in names}
+VREG_IDX = {name: idx for idx, names in enumerate(VREG_NAMES)
+            # Our ISA only supports 16 virtual registers
+            if names != None and 1 <= idx <= 15
+            for name in names}
+
 def is_vreg(name: str):
     """
     Is it a virtual register?
     """
-    for names in VREG_NAMES:
-        if names != None and name in names:
-            return True
-    return False
+    return name in VREG_IDX
 
 def r2idx(name: str):
     """
     Return index of register given name.
     """
-    for reg_idx, names in enumerate(REG_NAMES):
-        if name in names:
-            return reg_idx
-    raise Exception(f"Register name '{name}' not found.")
+    idx = REG_IDX.get(name)
+    if idx is None:
+        raise Exception(f"Register name '{name}' not found.")
+    return idx
 
 def vr2idx(name: str):
     """
     Return index of virtual register given name.
     """
-    for reg_idx, names in enumerate(VREG_NAMES):
-        # Our ISA only supports 16 virtual registers
-        if not 1 <= reg_idx <= 15:
-            continue
-        
-        if names != None and name in names:
-            return reg_idx
-    raise Exception(f"Virtual register name '{name}' not found.")
+    idx = VREG_IDX.get(name)
+    if idx is None:
+        raise Exception(f"Virtual register name '{name}' not found.")
+    return idx